@@ -0,0 +1,171 @@
+"""
+Пакетный расчёт сценариев (несколько месяцев, варианты парка) на общих складах и предприятиях.
+Матрица расстояний считается один раз в родительском процессе и кладётся в разделяемую память;
+процессы-исполнители подключаются к ней по имени и читают строки без копирования.
+Склады и предприятия передаются исполнителю один раз при запуске, а каждой задаче — только
+её сценарий (машины и изменения остатков/потребностей).
+Если пул процессов или разделяемая память недоступны (одно ядро, нет /dev/shm),
+сценарии считаются по очереди в текущем процессе.
+"""
+import os
+from array import array
+from typing import Callable, Dict, List, Any, Optional, Tuple
+
+from diagnostics import log
+from distances import DistanceMatrix
+from model import compile_problem, Problem
+from plan_cache import merge_changes
+
+MAX_SCENARIOS = 32
+SCENARIO_WORKERS = int(os.environ.get('SCENARIO_WORKERS', '0')) or (os.cpu_count() or 1)
+
+# planner(problem, distances, options) → (маршруты, сводка)
+Planner = Callable[[Problem, DistanceMatrix, Dict[str, Any]], Tuple[List[Dict], Dict]]
+
+# Состояние процесса-исполнителя: заполняется один раз в _init_worker
+_worker: Dict[str, Any] = {}
+
+
+def prepare_scenarios(
+    raw: Any,
+    warehouses: List[Dict],
+    enterprises: List[Dict],
+    vehicles: List[Dict],
+    defaults: Dict[str, Any]
+) -> List[Dict[str, Any]]:
+    """
+    Проверка и нормализация сценариев запроса:
+    {"name", "month", "vehicles" (иначе общий список), "changes", "mode", "timeBudgetMs"}.
+    Сценарий может менять только остатки складов и потребности предприятий (координаты
+    и состав точек общие — на них посчитана общая матрица) и любые поля машин.
+    """
+    if not isinstance(raw, list) or not raw or len(raw) > MAX_SCENARIOS:
+        raise ValueError(f"scenarios: ожидается непустой список до {MAX_SCENARIOS} сценариев")
+
+    warehouse_ids = {w['id'] for w in warehouses}
+    enterprise_ids = {e['id'] for e in enterprises}
+    scenarios = []
+    for k, scenario in enumerate(raw):
+        if not isinstance(scenario, dict):
+            raise ValueError(f"scenarios[{k}]: ожидается объект")
+        changes = scenario.get('changes') or {}
+        for section, ids, field in (('warehouses', warehouse_ids, 'stocks'), ('enterprises', enterprise_ids, 'needs')):
+            for change in changes.get(section) or []:
+                if not isinstance(change, dict) or change.get('id') not in ids or set(change) - {'id', field}:
+                    raise ValueError(
+                        f"scenarios[{k}].changes.{section}: можно менять только {field} существующих точек"
+                    )
+        scenario_vehicles = scenario.get('vehicles') or vehicles
+        if not scenario_vehicles:
+            raise ValueError(f"scenarios[{k}]: не указан транспорт")
+        # Ошибки в машинах (повторы номеров) — сейчас, ответом 400, а не в процессе-исполнителе
+        try:
+            merge_changes([], [], scenario_vehicles, {'vehicles': changes.get('vehicles')})
+        except ValueError as e:
+            raise ValueError(f"scenarios[{k}]: {e}")
+        scenarios.append({
+            'name': scenario.get('name') or f'Сценарий {k + 1}',
+            'month': scenario.get('month', defaults.get('month', '')),
+            'vehicles': scenario_vehicles,
+            'changes': changes,
+            'options': {
+                'mode': scenario.get('mode') or defaults['mode'],
+                'timeBudgetMs': float(scenario.get('timeBudgetMs') or defaults['timeBudgetMs'])
+            }
+        })
+    return scenarios
+
+
+def run_scenario(
+    scenario: Dict[str, Any],
+    warehouses: List[Dict],
+    enterprises: List[Dict],
+    distances: DistanceMatrix,
+    planner: Planner
+) -> Dict[str, Any]:
+    scenario_warehouses, scenario_enterprises, scenario_vehicles = merge_changes(
+        warehouses, enterprises, scenario['vehicles'], scenario['changes']
+    )
+    problem = compile_problem(scenario_warehouses, scenario_enterprises, scenario_vehicles)
+    routes, summary = planner(problem, distances, scenario['options'])
+    return {
+        'name': scenario['name'],
+        'month': scenario['month'],
+        'routes': routes,
+        'total_routes': len(routes),
+        'summary': summary
+    }
+
+
+def _init_worker(shm_name: str, size: int, warehouses: List[Dict], enterprises: List[Dict], planner: Planner) -> None:
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=shm_name)
+    view = shm.buf.cast('d')
+    rows = [view[i * size:(i + 1) * size] for i in range(size)]
+    _worker.update(
+        shm=shm,
+        warehouses=warehouses,
+        enterprises=enterprises,
+        distances=DistanceMatrix.from_rows(enterprises, warehouses, rows),
+        planner=planner
+    )
+
+
+def _run_in_worker(scenario: Dict[str, Any]) -> Dict[str, Any]:
+    return run_scenario(scenario, _worker['warehouses'], _worker['enterprises'], _worker['distances'], _worker['planner'])
+
+
+def run_batch(
+    warehouses: List[Dict],
+    enterprises: List[Dict],
+    scenarios: List[Dict[str, Any]],
+    planner: Planner,
+    distance_provider: Optional[Any] = None,
+    workers: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """Результаты сценариев в порядке запроса"""
+    distances = DistanceMatrix(enterprises, warehouses, distance_provider)
+    workers = min(len(scenarios), workers or SCENARIO_WORKERS)
+    log.info('Пакет сценариев', scenarios=len(scenarios), workers=workers)
+
+    if workers > 1:
+        # multiprocessing — самый тяжёлый импорт функции (~60 мс), а нужен он только пакетам сценариев
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            return _run_parallel(warehouses, enterprises, scenarios, planner, distances, workers)
+        except (OSError, BrokenProcessPool) as e:
+            log.warning('Пул процессов недоступен, сценарии считаются по очереди', error=str(e))
+
+    return [run_scenario(s, warehouses, enterprises, distances, planner) for s in scenarios]
+
+
+def _run_parallel(
+    warehouses: List[Dict],
+    enterprises: List[Dict],
+    scenarios: List[Dict[str, Any]],
+    planner: Planner,
+    distances: DistanceMatrix,
+    workers: int
+) -> List[Dict[str, Any]]:
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    size = distances.size
+    shm = shared_memory.SharedMemory(create=True, size=max(8, 8 * size * size))
+    try:
+        view = shm.buf.cast('d')
+        try:
+            for i in range(size):
+                view[i * size:(i + 1) * size] = array('d', distances.row(i))
+        finally:
+            view.release()
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(shm.name, size, warehouses, enterprises, planner)
+        ) as pool:
+            return list(pool.map(_run_in_worker, scenarios))
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,108 @@
+"""
+JSON тела запроса и ответа и сжатие ответа.
+orjson (если установлен: добавьте его в requirements.txt функции) разбирает и собирает JSON в разы
+быстрее json из стандартной библиотеки; без него работает json. Ответ сжимается brotli или gzip,
+если клиент их принимает (Accept-Encoding) и тело не меньше MIN_COMPRESS_BYTES; среда функций
+передаёт двоичное тело в base64 (isBase64Encoded).
+
+Файл одинаков байт в байт в backend/optimize-routes и backend/osrm-route: каждая функция
+разворачивается из своей папки и импортирует соседние модули по имени, общий модуль положить некуда.
+Меняйте обе копии вместе — tests/test_codec_copies.py сверяет их.
+"""
+import base64
+import json
+import zlib
+from typing import Dict, Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Меньшие тела сжатие почти не уменьшает, а base64 раздувает на треть
+MIN_COMPRESS_BYTES = 1024
+# Уровни сжатия с упором на скорость: ответ сжимается на каждый вызов
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+# Кодировки в порядке предпочтения
+ENCODINGS = ('br', 'gzip')
+
+# Модуль brotli: None — ещё не искали, False — не установлен
+_brotli: Any = None
+
+
+def loads(data: Any) -> Any:
+    """Разбор JSON (str или bytes); пустое тело — пустой объект"""
+    if not data:
+        return {}
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(payload: Any) -> str:
+    """Компактный JSON в UTF-8 без экранирования кириллицы"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass  # то, что orjson не умеет (целые больше 64 бит), собирает json
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))
+
+
+def brotli_module() -> Optional[Any]:
+    """brotli импортируется при первом сжатии, а не при загрузке функции"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli
+            _brotli = brotli
+        except ImportError:
+            _brotli = False
+    return _brotli or None
+
+
+def accepted_encoding(headers: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Лучшая из ENCODINGS, которую принимает клиент и умеет функция; None — отдать как есть"""
+    value = ''
+    for name, header in (headers or {}).items():
+        if name.lower() == 'accept-encoding':
+            value = str(header or '')
+            break
+    accepted = set()
+    for part in value.lower().split(','):
+        token, _, params = part.strip().partition(';')
+        quality = params.strip()
+        if quality.startswith('q=') and quality[2:].strip() in ('0', '0.0', '0.00', '0.000'):
+            continue
+        accepted.add(token.strip())
+    for encoding in ENCODINGS:
+        if (encoding in accepted or '*' in accepted) and (encoding != 'br' or brotli_module() is not None):
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli_module().compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_response(response: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Ответ функции со сжатым телом, если клиент это принимает и тело того стоит"""
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not isinstance(body, str) or len(body) < MIN_COMPRESS_BYTES:
+        return response
+    encoding = accepted_encoding(event.get('headers'))
+    if encoding is None:
+        return response
+    headers = dict(response.get('headers') or {})
+    headers['Content-Encoding'] = encoding
+    headers['Vary'] = 'Accept-Encoding'
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compress(body.encode(), encoding)).decode('ascii'),
+        'isBase64Encoded': True
+    }
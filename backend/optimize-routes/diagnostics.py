@@ -0,0 +1,88 @@
+"""
+Журнал и замеры оптимизатора.
+Журнал пишет строки JSON (уровень, событие, поля) — их разбирает сборщик логов функции.
+Уровень задаётся переменной окружения LOG_LEVEL (DEBUG, INFO, WARNING, ERROR), по умолчанию INFO.
+Подробные дампы (наборы товаров, потребности по предприятиям, остатки по складам) пишутся
+на уровне DEBUG и собираются только под log.enabled(DEBUG).
+Diagnostics — таймеры фаз и счётчики одного запроса; в ответ попадают, если запрос просит profile.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Any, Optional
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {'DEBUG': DEBUG, 'INFO': INFO, 'WARNING': WARNING, 'ERROR': ERROR}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+
+class Logger:
+    __slots__ = ('level',)
+
+    def __init__(self, level: str = 'INFO'):
+        self.level = LEVELS.get(level.upper(), INFO)
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, level: int, event: str, **fields: Any) -> None:
+        if level < self.level:
+            return
+        print(json.dumps({'level': LEVEL_NAMES[level], 'event': event, **fields}, ensure_ascii=False, default=str))
+
+    def debug(self, event: str, **fields: Any) -> None:
+        self.log(DEBUG, event, **fields)
+
+    def info(self, event: str, **fields: Any) -> None:
+        self.log(INFO, event, **fields)
+
+    def warning(self, event: str, **fields: Any) -> None:
+        self.log(WARNING, event, **fields)
+
+    def error(self, event: str, **fields: Any) -> None:
+        self.log(ERROR, event, **fields)
+
+
+# Один журнал на процесс: уровень читается при «холодном» старте функции
+log = Logger(os.environ.get('LOG_LEVEL', 'INFO'))
+
+
+class Diagnostics:
+    """
+    Замеры запроса: время фаз (суммируется, если фаза встречается несколько раз),
+    счётчики и разбивка по машинам (рейсы, время планирования)
+    """
+    __slots__ = ('phases', 'counters', 'vehicles')
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.vehicles: Dict[str, Dict[str, float]] = {}
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def vehicle(self, number: str, trips: int, planning_seconds: Optional[float] = None) -> None:
+        stats: Dict[str, float] = {'trips': trips}
+        if planning_seconds is not None:
+            stats['planning_ms'] = round(planning_seconds * 1000, 3)
+        self.vehicles[number] = stats
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'phases_ms': {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+            'vehicles': self.vehicles
+        }
@@ -0,0 +1,328 @@
+"""
+Расстояния между точками плана: предприятия (стоянки, точки доставки) и склады.
+Матрица считается один раз на запрос, дальше все обращения — O(1) по индексу.
+Откуда берутся сами расстояния, решает провайдер: по прямой, по прямой с коэффициентом
+извилистости дорог или по дорогам через OSRM Table API.
+"""
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Sequence, Tuple
+
+from codec import loads
+from diagnostics import log
+
+MISSING_DISTANCE = 999999.0
+EARTH_RADIUS_KM = 6371.0
+DEFAULT_DETOUR_FACTOR = 1.3
+OSRM_TABLE_URL = os.environ.get('OSRM_TABLE_URL', 'https://router.project-osrm.org')
+
+Point = Tuple[Optional[float], Optional[float]]
+
+
+def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Расчёт расстояния между двумя точками (км)"""
+    if not all([lat1, lng1, lat2, lng2]):
+        return MISSING_DISTANCE
+
+    R = EARTH_RADIUS_KM
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    delta_lat = math.radians(lat2 - lat1)
+    delta_lng = math.radians(lng2 - lng1)
+
+    a = math.sin(delta_lat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lng / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+    return round(R * c, 2)
+
+
+def is_valid_point(point: Point) -> bool:
+    return bool(point[0]) and bool(point[1])
+
+
+class HaversineProvider:
+    """Расстояние по прямой (та же формула, что calculate_distance)"""
+    name = 'haversine'
+    symmetric = True
+
+    def rows(self, points: List[Point], sources: List[int]) -> List[List[float]]:
+        valid = [is_valid_point(p) for p in points]
+        # Всё, что не зависит от пары точек, считаем один раз на точку
+        cos_lat = [math.cos(math.radians(p[0])) if ok else 0.0 for p, ok in zip(points, valid)]
+        radians, sin, sqrt, atan2 = math.radians, math.sin, math.sqrt, math.atan2
+        size = len(points)
+
+        result = []
+        for i in sources:
+            row = [MISSING_DISTANCE] * size
+            if valid[i]:
+                lat1, lng1 = points[i]
+                cos1 = cos_lat[i]
+                for j in range(size):
+                    if not valid[j]:
+                        continue
+                    lat2, lng2 = points[j]
+                    a = sin(radians(lat2 - lat1) / 2)**2 + cos1 * cos_lat[j] * sin(radians(lng2 - lng1) / 2)**2
+                    row[j] = round(EARTH_RADIUS_KM * (2 * atan2(sqrt(a), sqrt(1 - a))), 2)
+            result.append(row)
+        return result
+
+
+class DetourProvider(HaversineProvider):
+    """Расстояние по прямой × коэффициент извилистости дорог"""
+    name = 'detour'
+
+    def __init__(self, factor: float = DEFAULT_DETOUR_FACTOR):
+        self.factor = factor
+
+    def rows(self, points: List[Point], sources: List[int]) -> List[List[float]]:
+        factor = self.factor
+        return [
+            [d if d == MISSING_DISTANCE else round(d * factor, 2) for d in row]
+            for row in super().rows(points, sources)
+        ]
+
+
+# Расстояния по дорогам между запросами: (откуда, куда) с округлёнными координатами → км
+_road_distance_cache: 'OrderedDict[Tuple[Point, Point], float]' = OrderedDict()
+_road_distance_lock = threading.Lock()
+ROAD_CACHE_ENTRIES = 200000
+
+
+class OsrmTableProvider:
+    """
+    Матрица расстояний по дорогам через OSRM Table API.
+    Большие матрицы режутся на блоки chunk_size × chunk_size (публичный сервер ограничивает
+    число координат в запросе). Уже известные пары берутся из кэша процесса.
+    Если блок не удалось получить, для него используется fallback (по умолчанию — по прямой).
+    """
+    name = 'osrm'
+    symmetric = False
+
+    def __init__(
+        self,
+        base_url: str = OSRM_TABLE_URL,
+        chunk_size: int = 50,
+        timeout: float = 10,
+        workers: int = 4,
+        fallback: Optional[Any] = None
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.chunk_size = max(1, chunk_size)
+        self.timeout = timeout
+        self.workers = max(1, workers)
+        self.fallback = fallback or HaversineProvider()
+        self.requests = 0
+        self.failed_chunks = 0
+        self.cached_pairs = 0
+
+    def rows(self, points: List[Point], sources: List[int]) -> List[List[float]]:
+        size = len(points)
+        keys = [(round(p[0], 5), round(p[1], 5)) if is_valid_point(p) else None for p in points]
+        result = {i: [MISSING_DISTANCE] * size for i in sources}
+
+        # Сначала всё, что уже есть в кэше; остальное — блоками к OSRM
+        missing_sources = set()
+        missing_targets = set()
+        with _road_distance_lock:
+            for i in sources:
+                if keys[i] is None:
+                    continue
+                row = result[i]
+                for j in range(size):
+                    if keys[j] is None:
+                        continue
+                    if i == j:
+                        row[j] = 0.0
+                        continue
+                    cached = _road_distance_cache.get((keys[i], keys[j]))
+                    if cached is None:
+                        missing_sources.add(i)
+                        missing_targets.add(j)
+                    else:
+                        row[j] = cached
+                        self.cached_pairs += 1
+
+        if missing_sources:
+            source_list = sorted(missing_sources)
+            target_list = sorted(missing_targets)
+            blocks = [
+                (source_list[a:a + self.chunk_size], target_list[b:b + self.chunk_size])
+                for a in range(0, len(source_list), self.chunk_size)
+                for b in range(0, len(target_list), self.chunk_size)
+            ]
+            # Пул потоков и urllib нужны только дорожным расстояниям: при загрузке функции их не импортируем
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(blocks))) as pool:
+                fetched = list(pool.map(lambda block: self._fetch_block(points, *block), blocks))
+
+            fresh: Dict[Tuple[Point, Point], float] = {}
+            fallback_rows: Dict[int, List[float]] = {}
+            for (block_sources, block_targets), table in zip(blocks, fetched):
+                if table is None:
+                    self.failed_chunks += 1
+                    for i in block_sources:
+                        if i not in fallback_rows:
+                            fallback_rows[i] = self.fallback.rows(points, [i])[0]
+                        for j in block_targets:
+                            if i != j:
+                                result[i][j] = fallback_rows[i][j]
+                    continue
+                for i, distances_row in zip(block_sources, table):
+                    for j, meters in zip(block_targets, distances_row):
+                        if i == j:
+                            continue
+                        if meters is None:
+                            # Точка не привязалась к дороге — берём запасное значение для пары
+                            if i not in fallback_rows:
+                                fallback_rows[i] = self.fallback.rows(points, [i])[0]
+                            result[i][j] = fallback_rows[i][j]
+                            continue
+                        km = round(meters / 1000, 2)
+                        result[i][j] = km
+                        fresh[(keys[i], keys[j])] = km
+
+            with _road_distance_lock:
+                _road_distance_cache.update(fresh)
+                while len(_road_distance_cache) > ROAD_CACHE_ENTRIES:
+                    _road_distance_cache.popitem(last=False)
+
+        return [result[i] for i in sources]
+
+    def _fetch_block(self, points: List[Point], sources: List[int], targets: List[int]) -> Optional[List[List[Optional[float]]]]:
+        """Один запрос /table: блок источников × блок назначений (в метрах)"""
+        coordinates = list(dict.fromkeys(sources + targets))
+        position = {index: k for k, index in enumerate(coordinates)}
+        coords = ';'.join(f'{points[i][1]},{points[i][0]}' for i in coordinates)
+        url = (
+            f'{self.base_url}/table/v1/driving/{coords}'
+            f'?sources={";".join(str(position[i]) for i in sources)}'
+            f'&destinations={";".join(str(position[j]) for j in targets)}'
+            f'&annotations=distance'
+        )
+        self.requests += 1
+        import urllib.request
+        try:
+            req = urllib.request.Request(url, headers={'User-Agent': 'TransportPlanner/1.0'})
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                data = loads(response.read())
+            if data.get('code') == 'Ok' and data.get('distances'):
+                return data['distances']
+            log.warning('OSRM table error', code=data.get('code'), message=data.get('message', ''))
+        except Exception as e:
+            log.warning('OSRM table error', error=str(e))
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {'requests': self.requests, 'failed_chunks': self.failed_chunks, 'cached_pairs': self.cached_pairs}
+
+
+def provider_from_options(options: Optional[Dict[str, Any]]):
+    """
+    Провайдер расстояний по опции запроса distanceProvider:
+    {"type": "haversine"} (по умолчанию), {"type": "detour", "detourFactor": 1.3},
+    {"type": "osrm", "osrmUrl": "...", "chunkSize": 50, "fallback": "haversine" | "detour"}
+    """
+    options = options or {}
+    if not isinstance(options, dict):
+        raise ValueError('distanceProvider: ожидается объект, например {"type": "osrm"}')
+    kind = options.get('type', 'haversine')
+    factor = float(options.get('detourFactor', DEFAULT_DETOUR_FACTOR))
+
+    if kind == 'haversine':
+        return HaversineProvider()
+    if kind == 'detour':
+        return DetourProvider(factor)
+    if kind == 'osrm':
+        fallback = DetourProvider(factor) if options.get('fallback') == 'detour' else HaversineProvider()
+        return OsrmTableProvider(
+            base_url=options.get('osrmUrl') or OSRM_TABLE_URL,
+            chunk_size=int(options.get('chunkSize', 50)),
+            timeout=float(options.get('timeout', 10)),
+            fallback=fallback
+        )
+    raise ValueError(f"Неизвестный провайдер расстояний: {kind}")
+
+
+class DistanceMatrix:
+    """
+    Матрица расстояний по всем точкам плана.
+    Индексы: сначала предприятия (0..E-1), затем склады (E..E+W-1).
+    Строки предприятий считаются сразу (текущая позиция машины — всегда предприятие).
+    Для симметричных провайдеров строки складов считаются по первому обращению,
+    для несимметричных (дороги) — вся матрица сразу, одним пакетом запросов.
+    evaluations — сколько расстояний посчитал провайдер (для диагностики).
+    """
+
+    def __init__(self, enterprises: List[Dict], warehouses: List[Dict], provider: Optional[Any] = None):
+        self._layout(enterprises, warehouses, provider or HaversineProvider())
+
+        self._rows: List[Optional[Sequence[float]]] = [None] * self.size
+        self._pairs: Dict[Tuple[int, int], float] = {}
+        eager = range(self.enterprise_count) if self.provider.symmetric else range(self.size)
+        for i, row in zip(eager, self.provider.rows(self.points, list(eager))):
+            self._rows[i] = row
+        self.evaluations = len(eager) * self.size
+
+    @classmethod
+    def from_rows(cls, enterprises: List[Dict], warehouses: List[Dict], rows: List[Sequence[float]]) -> 'DistanceMatrix':
+        """Матрица из уже посчитанных строк (например, поверх разделяемой памяти); провайдер не вызывается"""
+        matrix = cls.__new__(cls)
+        matrix._layout(enterprises, warehouses, None)
+        if len(rows) != matrix.size:
+            raise ValueError('Размер матрицы не совпадает с числом точек')
+        matrix._rows = list(rows)
+        matrix._pairs = {}
+        matrix.evaluations = 0
+        return matrix
+
+    def _layout(self, enterprises: List[Dict], warehouses: List[Dict], provider: Optional[Any]) -> None:
+        points: List[Point] = [(e.get('lat'), e.get('lng')) for e in enterprises]
+        points.extend((w.get('lat'), w.get('lng')) for w in warehouses)
+
+        self.provider = provider
+        self.points = points
+        self.enterprise_count = len(enterprises)
+        self.size = len(points)
+        self.enterprise_index: Dict[Any, int] = {}
+        for i, e in enumerate(enterprises):
+            self.enterprise_index.setdefault(e['id'], i)
+        self.warehouse_index: Dict[Any, int] = {}
+        for j, w in enumerate(warehouses):
+            self.warehouse_index.setdefault(w['id'], self.enterprise_count + j)
+
+    def row(self, i: int) -> Sequence[float]:
+        """Строка расстояний от точки i (кэшируется)"""
+        row = self._rows[i]
+        if row is None:
+            row = self._rows[i] = self.provider.rows(self.points, [i])[0]
+            self.evaluations += self.size
+        return row
+
+    def pair(self, i: int, j: int) -> float:
+        """
+        Расстояние от точки i до точки j без расчёта всей строки i, если её ещё нет
+        (редкие обращения склад → склад при догрузке по пути)
+        """
+        row = self._rows[i]
+        if row is not None:
+            return row[j]
+        if self.provider.symmetric and self._rows[j] is not None:
+            return self._rows[j][i]
+        key = (i, j) if i <= j or not self.provider.symmetric else (j, i)
+        distance = self._pairs.get(key)
+        if distance is None:
+            distance = self._pairs[key] = self.provider.rows([self.points[i], self.points[j]], [0])[0][1]
+            self.evaluations += 1
+        return distance
+
+    def between(self, i: int, j: int) -> float:
+        """Расстояние от точки i до точки j по индексам"""
+        row = self._rows[i]
+        if row is not None:
+            return row[j]
+        if self.provider.symmetric and j < self.enterprise_count:
+            return self._rows[j][i]
+        return self.row(i)[j]
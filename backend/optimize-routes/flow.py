@@ -0,0 +1,386 @@
+"""
+Глобальный режим оптимизации (mode="flow").
+1. По каждому товару решается транспортная задача: сколько вести с какого склада
+   на какое предприятие, чтобы суммарный пробег с грузом был минимальным.
+   Сначала закрываются потребности, остаток склада (его всё равно вывозим) уходит
+   на ближайшее предприятие. Решается как поток минимальной стоимости.
+2. Потоки режутся на рейсы по грузоподъёмности и раздаются машинам от мест стоянки:
+   следующий рейс — пара (машина, поток) с наименьшим пробегом на перевезённый кубометр.
+   Остаток потока меньше машины довозится вместе с потоками того же товара с того же склада
+   на соседние предприятия — несколькими точками выгрузки за рейс.
+"""
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+from diagnostics import log, DEBUG
+from distances import DistanceMatrix
+from model import Problem, CompiledVehicle, RouteRecord, CHIPS_SOURCE_NAME
+from scheduler import MAX_DROPS
+
+EPSILON = 1e-6
+# Бонус за закрытие потребности: больше пробега любого пути в сети (даже с отметкой 999999
+# для точек без координат), поэтому поток сначала покрывает потребности и только потом
+# уходит «в излишек». Слишком большой бонус съедает точность потенциалов.
+NEED_BONUS = 1e7
+
+# (склад, предприятие, товар, объём, излишек ли — потребность уже закрыта, везём на ближайшее)
+Flow = Tuple[int, int, int, float, bool]
+
+
+class MinCostFlow:
+    """Поток минимальной стоимости: последовательные кратчайшие пути (Дейкстра с потенциалами)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.adjacency: List[List[int]] = [[] for _ in range(size)]
+        self.to: List[int] = []
+        self.capacity: List[float] = []
+        self.cost: List[float] = []
+
+    def add_edge(self, u: int, v: int, capacity: float, cost: float) -> int:
+        edge = len(self.to)
+        self.adjacency[u].append(edge)
+        self.to.append(v)
+        self.capacity.append(capacity)
+        self.cost.append(cost)
+        self.adjacency[v].append(edge + 1)
+        self.to.append(u)
+        self.capacity.append(0.0)
+        self.cost.append(-cost)
+        return edge
+
+    def solve(self, source: int, sink: int, potential: List[float]) -> float:
+        """
+        Пускает максимальный поток минимальной стоимости.
+        potential — допустимые начальные потенциалы (кратчайшие расстояния от source),
+        нужны, потому что у дуг «закрытия потребности» отрицательная стоимость.
+        """
+        to, capacity, cost, adjacency = self.to, self.capacity, self.cost, self.adjacency
+        total = 0.0
+        infinity = float('inf')
+
+        while True:
+            distance = [infinity] * self.size
+            parent_edge = [-1] * self.size
+            distance[source] = 0.0
+            heap = [(0.0, source)]
+            while heap:
+                d, u = heapq.heappop(heap)
+                if d > distance[u]:
+                    continue
+                pu = potential[u]
+                for edge in adjacency[u]:
+                    if capacity[edge] <= EPSILON:
+                        continue
+                    v = to[edge]
+                    nd = d + cost[edge] + pu - potential[v]
+                    if nd < distance[v] - EPSILON:
+                        distance[v] = nd
+                        parent_edge[v] = edge
+                        heapq.heappush(heap, (nd, v))
+
+            if distance[sink] == infinity:
+                return total
+
+            for v in range(self.size):
+                if distance[v] < infinity:
+                    potential[v] += distance[v]
+
+            # Узкое место пути и проталкивание
+            bottleneck = infinity
+            v = sink
+            while v != source:
+                edge = parent_edge[v]
+                bottleneck = min(bottleneck, capacity[edge])
+                v = to[edge ^ 1]
+            v = sink
+            while v != source:
+                edge = parent_edge[v]
+                capacity[edge] -= bottleneck
+                capacity[edge ^ 1] += bottleneck
+                v = to[edge ^ 1]
+            total += bottleneck
+
+
+def solve_product_flows(problem: Problem, distances: DistanceMatrix, product_id: int, neighbors: int = 8) -> List[Flow]:
+    """
+    Транспортная задача по одному товару.
+    neighbors — сколько ближайших предприятий рассматривать для каждого склада
+    (и ближайших складов для каждого предприятия); 0 — полный перебор пар.
+    """
+    P = problem.product_count
+    offset = distances.enterprise_count
+    warehouses = [w for w in range(len(problem.warehouses)) if problem.stock[w * P + product_id] > EPSILON]
+    enterprises = [e for e in range(len(problem.enterprises)) if problem.need[e * P + product_id] > EPSILON]
+    if not warehouses or not problem.enterprises:
+        return []
+
+    between = distances.between
+    all_enterprises = range(len(problem.enterprises))
+    nearest_enterprise = {w: min(all_enterprises, key=lambda e: (between(offset + w, e), e)) for w in warehouses}
+
+    # Какие пары склад → предприятие войдут в сеть
+    pairs = set()
+    if neighbors <= 0 or len(enterprises) <= neighbors:
+        pairs = {(w, e) for w in warehouses for e in enterprises}
+    else:
+        for w in warehouses:
+            ranked = sorted(enterprises, key=lambda e: (between(offset + w, e), e))
+            pairs.update((w, e) for e in ranked[:neighbors])
+    if neighbors > 0 and len(warehouses) > neighbors:
+        for e in enterprises:
+            ranked = sorted(warehouses, key=lambda w: (between(offset + w, e), w))
+            pairs.update((w, e) for w in ranked[:neighbors])
+    else:
+        pairs.update((w, e) for w in warehouses for e in enterprises)
+
+    # Узлы: источник, склады, предприятия, сток
+    source = 0
+    w_node = {w: 1 + k for k, w in enumerate(warehouses)}
+    e_node = {e: 1 + len(warehouses) + k for k, e in enumerate(enterprises)}
+    sink = 1 + len(warehouses) + len(enterprises)
+    graph = MinCostFlow(sink + 1)
+
+    total_supply = 0.0
+    for w in warehouses:
+        supply = problem.stock[w * P + product_id]
+        total_supply += supply
+        graph.add_edge(source, w_node[w], supply, 0.0)
+
+    pair_edges: Dict[int, Tuple[int, int]] = {}
+    for w, e in sorted(pairs):
+        edge = graph.add_edge(w_node[w], e_node[e], total_supply, between(offset + w, e))
+        pair_edges[edge] = (w, e)
+
+    surplus_edges: Dict[int, int] = {}
+    for w in warehouses:
+        edge = graph.add_edge(w_node[w], sink, total_supply, between(offset + w, nearest_enterprise[w]))
+        surplus_edges[edge] = w
+
+    for e in enterprises:
+        graph.add_edge(e_node[e], sink, problem.need[e * P + product_id], -NEED_BONUS)
+
+    # Начальные потенциалы: сеть без циклов, кратчайшие пути считаются по слоям
+    potential = [0.0] * graph.size
+    cheapest: Dict[int, float] = {}
+    for w, e in pairs:
+        cost = between(offset + w, e)
+        if cost < cheapest.get(e, float('inf')):
+            cheapest[e] = cost
+    for e in enterprises:
+        potential[e_node[e]] = cheapest[e]
+    potential[sink] = min(
+        [potential[e_node[e]] - NEED_BONUS for e in enterprises]
+        + [between(offset + w, nearest_enterprise[w]) for w in warehouses]
+    )
+
+    graph.solve(source, sink, potential)
+
+    flows: List[Flow] = []
+    for edge, (w, e) in pair_edges.items():
+        volume = graph.capacity[edge ^ 1]
+        if volume > EPSILON:
+            flows.append((w, e, product_id, volume, False))
+    for edge, w in surplus_edges.items():
+        volume = graph.capacity[edge ^ 1]
+        if volume > EPSILON:
+            flows.append((w, nearest_enterprise[w], product_id, volume, True))
+    return flows
+
+
+def plan_with_flows(
+    problem: Problem,
+    distances: DistanceMatrix,
+    neighbors: int = 8,
+    max_trips_per_vehicle: int = 1000
+) -> List[RouteRecord]:
+    """Решение потоков по всем товарам, которые может везти хотя бы одна машина, и раздача рейсов"""
+    vehicles = [v for v in problem.vehicles if v.capacity > 0]
+    fleet_mask = 0
+    for vehicle in vehicles:
+        fleet_mask |= vehicle.product_mask
+
+    flows: List[Flow] = []
+    for product_id in range(problem.product_count):
+        if fleet_mask >> product_id & 1:
+            flows.extend(solve_product_flows(problem, distances, product_id, neighbors))
+
+    log.info('Потоки рассчитаны', flows=len(flows))
+    return assign_flows(problem, distances, flows, vehicles, max_trips_per_vehicle)
+
+
+def assign_flows(
+    problem: Problem,
+    distances: DistanceMatrix,
+    flows: List[Flow],
+    vehicles: List[CompiledVehicle],
+    max_trips_per_vehicle: int
+) -> List[RouteRecord]:
+    """
+    Раздача потоков машинам от мест стоянки. Очередной рейс достаётся паре (машина, поток)
+    с наименьшим пробегом на перевезённый кубометр; машина везёт min(грузоподъёмность, остаток потока).
+    """
+    P = problem.product_count
+    offset = distances.enterprise_count
+    remaining = [flow[3] for flow in flows]
+    by_warehouse: Dict[int, List[int]] = {}
+    same_product: Dict[Tuple[int, int], List[int]] = {}
+    pool: Dict[Tuple[int, int], float] = {}  # невывезенный объём товара на складе по всем потокам
+    for k, (w, _, product_id, volume, _) in enumerate(flows):
+        by_warehouse.setdefault(w, []).append(k)
+        same_product.setdefault((w, product_id), []).append(k)
+        pool[(w, product_id)] = pool.get((w, product_id), 0.0) + volume
+    # Для каждой точки — склады с потоками по возрастанию расстояния (лениво)
+    orders: Dict[int, List[int]] = {}
+
+    enterprises = problem.enterprises
+    warehouses = problem.warehouses
+    dok_index = problem.chips_target
+
+    position = {v.ordinal: v.parking for v in vehicles}
+    trips = {v.ordinal: 0 for v in vehicles}
+    records: Dict[int, List[RouteRecord]] = {v.ordinal: [] for v in vehicles}
+    active = list(vehicles)
+    # Лучший поток машины остаётся лучшим, пока она не сдвинулась и не тронут склад этого потока:
+    # остальные потоки со временем только уменьшаются, и их оценка от этого не улучшается
+    cached: Dict[int, Tuple[float, int]] = {}
+
+    def best_flow(vehicle: CompiledVehicle) -> Optional[Tuple[float, int]]:
+        """Поток с наименьшим пробегом на кубометр: (порожний пробег + доставка) / объём рейса"""
+        current = position[vehicle.ordinal]
+        row = distances.row(current)
+        order = orders.get(current)
+        if order is None:
+            order = orders[current] = sorted(by_warehouse, key=lambda w: (row[offset + w], w))
+        best: Optional[Tuple[float, int]] = None
+        dead = 0
+        for w in order:
+            empty_run = row[offset + w]
+            # Дальше по списку пробег на кубометр не может быть меньше empty_run / capacity
+            if best is not None and empty_run / vehicle.capacity >= best[0]:
+                break
+            if w not in by_warehouse:
+                dead += 1
+                continue
+            for k in by_warehouse[w]:
+                if remaining[k] > EPSILON and vehicle.product_mask >> flows[k][2] & 1:
+                    load = min(vehicle.capacity, pool[(w, flows[k][2])])
+                    score = (empty_run + distances.between(offset + w, flows[k][1])) / load
+                    if best is None or score < best[0]:
+                        best = (score, k)
+        # Вывезенные склады убираем из порядка обхода, когда их становится много
+        if dead * 2 > len(order):
+            orders[current] = [w for w in order if w in by_warehouse]
+        return best
+
+    while active:
+        best: Optional[Tuple[float, int, CompiledVehicle]] = None
+        still_active = []
+        for vehicle in active:
+            candidate = cached.get(vehicle.ordinal)
+            if candidate is None:
+                candidate = best_flow(vehicle)
+            if candidate is None:
+                continue  # для этой машины работы больше нет
+            still_active.append(vehicle)
+            cached[vehicle.ordinal] = candidate
+            if best is None or candidate[0] < best[0]:
+                best = (candidate[0], candidate[1], vehicle)
+        active = still_active
+        if best is None:
+            break
+
+        _, chosen, vehicle = best
+        ordinal = vehicle.ordinal
+        current = position[ordinal]
+        w, e, product_id, _, _ = flows[chosen]
+        volume = min(vehicle.capacity, remaining[chosen])
+        remaining[chosen] -= volume
+        # Неполную машину догружаем тем же товаром с этого же склада: сначала потоками на это же предприятие,
+        # потом потоками на ближайшие к нему (следующие точки выгрузки, не больше MAX_DROPS), если заезд
+        # туда короче отдельного рейса со склада. Каждый кубометр едет туда, куда его назначили потоки
+        drops: Dict[int, float] = {e: volume}
+        if volume < vehicle.capacity:
+            row = distances.row(e)
+            for k in sorted(same_product[(w, product_id)], key=lambda k: (row[flows[k][1]], k)):
+                target = flows[k][1]
+                if k == chosen or remaining[k] <= EPSILON:
+                    continue
+                if target not in drops and (
+                        len(drops) >= MAX_DROPS or row[target] > distances.between(offset + w, target)):
+                    continue
+                top_up = min(vehicle.capacity - volume, remaining[k])
+                remaining[k] -= top_up
+                volume += top_up
+                drops[target] = drops.get(target, 0.0) + top_up
+                if volume >= vehicle.capacity - EPSILON:
+                    break
+        pool[(w, product_id)] -= volume
+        by_warehouse[w] = [k for k in by_warehouse[w] if remaining[k] > EPSILON]
+        if not by_warehouse[w]:
+            del by_warehouse[w]
+        for other, (_, k) in list(cached.items()):
+            if other == ordinal or flows[k][0] == w:
+                del cached[other]
+        problem.stock[w * P + product_id] = max(0.0, problem.stock[w * P + product_id] - volume)
+
+        # Точки выгрузки по ближайшему соседу от предприятия основного потока
+        stops = [e]
+        rest = [target for target in drops if target != e]
+        while rest:
+            nearest = min(rest, key=lambda target: (distances.between(stops[-1], target), target))
+            rest.remove(nearest)
+            stops.append(nearest)
+
+        warehouse = warehouses[w]
+        name = problem.stock_name(w, product_id)
+        origin = warehouse
+        for number, target in enumerate(stops):
+            enterprise = enterprises[target]
+            problem.need[target * P + product_id] = max(0.0, problem.need[target * P + product_id] - drops[target])
+            if number == 0:
+                distance, parking_distance, source = (
+                    distances.between(offset + w, target), distances.between(current, offset + w), w
+                )
+            else:
+                distance, parking_distance, source = distances.between(stops[number - 1], target), 0, -1
+            record = RouteRecord(
+                vehicle.number, vehicle.vehicle_type, name, drops[target],
+                origin['name'], origin['lat'], origin['lng'],
+                enterprise['name'], enterprise['lat'], enterprise['lng'],
+                distance, parking_distance,
+                ordinal, source, target, product_id
+            )
+            if len(stops) > 1:
+                record.items = [(product_id, name, drops[target], warehouse['name'])]
+            records[ordinal].append(record)
+            origin = enterprise
+        e = stops[-1]
+        position[ordinal] = e
+
+        # Универсал на Заводе: загружаем щепой и везём на Павловский ДОК
+        if (vehicle.is_universal and dok_index is not None and vehicle.can_carry(problem.chips_product)
+                and enterprise['name'] == CHIPS_SOURCE_NAME):
+            dok_enterprise = enterprises[dok_index]
+            chips_distance = distances.between(e, dok_index)
+            records[ordinal].append(RouteRecord(
+                vehicle.number, vehicle.vehicle_type, 'Щепа', vehicle.capacity,
+                CHIPS_SOURCE_NAME, enterprise['lat'], enterprise['lng'],
+                dok_enterprise['name'], dok_enterprise['lat'], dok_enterprise['lng'],
+                chips_distance, 0,
+                ordinal, -1, dok_index, problem.chips_product
+            ))
+            position[ordinal] = dok_index
+
+        trips[ordinal] += 1
+        if trips[ordinal] >= max_trips_per_vehicle:
+            active.remove(vehicle)
+
+    # Маршруты отдаём по машинам, как и в жадном режиме
+    result: List[RouteRecord] = []
+    verbose = log.enabled(DEBUG)
+    for vehicle in vehicles:
+        result.extend(records[vehicle.ordinal])
+        if verbose and records[vehicle.ordinal]:
+            log.debug('Рейсы машины', vehicle=vehicle.number, trips=trips[vehicle.ordinal])
+    return result
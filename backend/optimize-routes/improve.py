@@ -0,0 +1,352 @@
+"""
+Улучшение готового плана локальным поиском в пределах бюджета времени.
+Единица перестановки — рейс: склад → предприятия выгрузки (у универсала — со щепой на ДОК).
+Пробег самого рейса от перестановок не меняется, поэтому ход меняет два-четыре порожних перегона
+и оценивается за O(1). Ходы: перенос рейса, обмен двух рейсов, обмен хвостами цепочек (2-opt*).
+Ход принимается, если уменьшает общий пробег и ни одна машина не занята дольше,
+чем самая загруженная машина исходного плана.
+"""
+import random
+import time
+from typing import Dict, List, Any, Tuple
+
+from diagnostics import log
+from distances import DistanceMatrix
+from model import Problem, CompiledVehicle, RouteRecord, CHIPS_SOURCE_NAME
+from scheduler import carries_chips, AVERAGE_SPEED_KMH, HANDLING_HOURS
+
+EPSILON = 1e-6
+# Столько ходов подряд без улучшения — план считаем локально оптимальным и выходим раньше срока
+STALL_MOVES = 50000
+# Часы проверяем не на каждом ходе
+CLOCK_CHECK_INTERVAL = 256
+
+
+class Job:
+    """
+    Рейс как единица перестановки: start — склад (индекс в матрице), end — где машина окажется,
+    drop_end — последнее предприятие выгрузки товаров со склада, products и load — что и сколько везёт
+    """
+    __slots__ = ('records', 'start', 'end', 'drop_end', 'inner', 'allowed', 'chips', 'products', 'load')
+
+    def __init__(self, record: RouteRecord, start: int):
+        self.records = [record]
+        self.start = start
+        self.end = self.drop_end = record.enterprise_index
+        self.inner = record.distance
+        self.allowed = 0  # битовая маска машин (по номеру цепочки), которые могут выполнить рейс
+        self.chips = False
+        self.products: List[int] = []
+        self.load = 0.0
+        self._add_items(record)
+
+    def _add_items(self, record: RouteRecord) -> None:
+        if record.items:
+            self.products.extend(product_id for product_id, _, _, _ in record.items)
+        else:
+            self.products.append(record.product_id)
+        self.load += record.volume
+
+    def attach(self, record: RouteRecord, chips: bool) -> None:
+        """
+        Продолжение рейса: следующая точка выгрузки догруженной машины
+        или щепа Завод → ДОК (едет вместе с рейсом, который привёз машину на Завод)
+        """
+        self.records.append(record)
+        self.end = record.enterprise_index
+        self.inner += record.distance
+        if chips:
+            self.chips = True
+        else:
+            self.drop_end = record.enterprise_index
+            self._add_items(record)
+
+
+class LocalSearch:
+    def __init__(self, distances: DistanceMatrix, vehicles: List[CompiledVehicle],
+                 routes: List[List[Job]], seed: int = 0):
+        self.vehicles = vehicles
+        self.routes = routes
+        self.origin = [v.parking for v in vehicles]
+        self.rows = [distances.row(e) for e in range(distances.enterprise_count)]
+        self.rng = random.Random(seed)
+        self.speed = AVERAGE_SPEED_KMH
+        self.handling = HANDLING_HOURS
+
+        # Префиксные суммы по каждой цепочке: пробег и число записей первых k рейсов,
+        # а также маска машин, которым подходят все рейсы начиная с k (для 2-opt*)
+        self.cum: List[List[float]] = [[] for _ in routes]
+        self.count: List[List[int]] = [[] for _ in routes]
+        self.tail_allowed: List[List[int]] = [[] for _ in routes]
+        for r in range(len(routes)):
+            self._refresh(r)
+        self.limit = max((self._busy(self.cum[r][-1], self.count[r][-1]) for r in range(len(routes))), default=0.0)
+        self.limit += EPSILON
+
+        self.evaluated = 0
+        self.applied = 0
+
+    def _busy(self, mileage: float, records: int) -> float:
+        return mileage / self.speed + self.handling * records
+
+    def _refresh(self, r: int) -> None:
+        jobs = self.routes[r]
+        rows = self.rows
+        cum = [0.0]
+        count = [0]
+        position = self.origin[r]
+        for job in jobs:
+            cum.append(cum[-1] + rows[position][job.start] + job.inner)
+            count.append(count[-1] + len(job.records))
+            position = job.end
+        tail = [-1] * (len(jobs) + 1)
+        for k in range(len(jobs) - 1, -1, -1):
+            tail[k] = tail[k + 1] & jobs[k].allowed
+        self.cum[r] = cum
+        self.count[r] = count
+        self.tail_allowed[r] = tail
+
+    def total(self) -> float:
+        return sum(cum[-1] for cum in self.cum)
+
+    def run(self, time_budget_ms: float) -> None:
+        routes = self.routes
+        if not routes:
+            return
+        deadline = time.perf_counter() + time_budget_ms / 1000
+        stall = 0
+        rng = self.rng
+        moves = (self._try_relocate, self._try_swap, self._try_tails)
+
+        while stall < STALL_MOVES:
+            if self.evaluated % CLOCK_CHECK_INTERVAL == 0 and time.perf_counter() >= deadline:
+                break
+            a = rng.randrange(len(routes))
+            if not routes[a]:
+                stall += 1
+                self.evaluated += 1
+                continue
+            self.evaluated += 1
+            if rng.choice(moves)(a, rng.randrange(len(routes))):
+                self.applied += 1
+                stall = 0
+            else:
+                stall += 1
+
+    def _end(self, r: int, k: int) -> int:
+        """Где находится машина перед k-м рейсом цепочки"""
+        return self.origin[r] if k == 0 else self.routes[r][k - 1].end
+
+    def _try_relocate(self, a: int, b: int) -> bool:
+        """Перенос случайного рейса цепочки a на случайное место цепочки b (в том числе той же)"""
+        rows = self.rows
+        A, B = self.routes[a], self.routes[b]
+        i = self.rng.randrange(len(A))
+        job = A[i]
+        if not job.allowed >> b & 1:
+            return False
+
+        before = self._end(a, i)
+        after = A[i + 1].start if i + 1 < len(A) else None
+        removed = rows[before][job.start] + (rows[job.end][after] - rows[before][after] if after is not None else 0.0)
+
+        # Позиция вставки считается в цепочке b уже без переносимого рейса
+        size = len(B) - (1 if a == b else 0)
+        j = self.rng.randrange(size + 1)
+        if a == b and j == i:
+            return False
+
+        def at(k: int) -> Job:
+            return B[k + 1] if a == b and k >= i else B[k]
+
+        prev_end = self.origin[b] if j == 0 else at(j - 1).end
+        following = at(j).start if j < size else None
+        added = rows[prev_end][job.start] + (
+            rows[job.end][following] - rows[prev_end][following] if following is not None else 0.0
+        )
+
+        delta = added - removed
+        if delta >= -EPSILON:
+            return False
+        records = len(job.records)
+        if a != b:
+            if self._busy(self.cum[a][-1] - removed - job.inner, self.count[a][-1] - records) > self.limit:
+                return False
+            if self._busy(self.cum[b][-1] + added + job.inner, self.count[b][-1] + records) > self.limit:
+                return False
+        elif self._busy(self.cum[a][-1] + delta, self.count[a][-1]) > self.limit:
+            return False
+
+        del A[i]
+        B.insert(j, job)
+        self._refresh(a)
+        if a != b:
+            self._refresh(b)
+        return True
+
+    def _try_swap(self, a: int, b: int) -> bool:
+        """Обмен случайных рейсов цепочек a и b"""
+        rows = self.rows
+        A, B = self.routes[a], self.routes[b]
+        if not B:
+            return False
+        i = self.rng.randrange(len(A))
+        j = self.rng.randrange(len(B))
+        if a == b:
+            if i == j:
+                return False
+            i, j = min(i, j), max(i, j)
+        x, y = A[i], B[j]
+        if not (x.allowed >> b & 1 and y.allowed >> a & 1):
+            return False
+
+        def around(r: int, k: int, old: Job, new: Job) -> float:
+            """Изменение двух перегонов вокруг позиции k при замене рейса old на new"""
+            jobs = self.routes[r]
+            before = self._end(r, k)
+            change = rows[before][new.start] - rows[before][old.start]
+            if k + 1 < len(jobs):
+                following = jobs[k + 1].start
+                change += rows[new.end][following] - rows[old.end][following]
+            return change
+
+        if a == b and j == i + 1:
+            # Соседние рейсы: ... → x → y → ...  становится  ... → y → x → ...
+            before = self._end(a, i)
+            following = A[j + 1].start if j + 1 < len(A) else None
+            delta = (rows[before][y.start] + rows[y.end][x.start] - rows[before][x.start] - rows[x.end][y.start])
+            if following is not None:
+                delta += rows[x.end][following] - rows[y.end][following]
+        else:
+            change_a = around(a, i, x, y)
+            change_b = around(b, j, y, x)
+            delta = change_a + change_b
+
+        if delta >= -EPSILON:
+            return False
+        if a != b:
+            inner = y.inner - x.inner
+            records = len(y.records) - len(x.records)
+            if self._busy(self.cum[a][-1] + change_a + inner, self.count[a][-1] + records) > self.limit:
+                return False
+            if self._busy(self.cum[b][-1] + change_b - inner, self.count[b][-1] - records) > self.limit:
+                return False
+        elif self._busy(self.cum[a][-1] + delta, self.count[a][-1]) > self.limit:
+            return False
+
+        A[i], B[j] = y, x
+        self._refresh(a)
+        if a != b:
+            self._refresh(b)
+        return True
+
+    def _try_tails(self, a: int, b: int) -> bool:
+        """2-opt* : цепочки a и b обмениваются хвостами после случайных точек разреза"""
+        if a == b:
+            return False
+        rows = self.rows
+        A, B = self.routes[a], self.routes[b]
+        ka = self.rng.randrange(len(A) + 1)
+        kb = self.rng.randrange(len(B) + 1)
+        if ka == len(A) and kb == len(B):
+            return False
+        if not (self.tail_allowed[b][kb] >> a & 1 and self.tail_allowed[a][ka] >> b & 1):
+            return False
+
+        end_a, end_b = self._end(a, ka), self._end(b, kb)
+        link_a = rows[end_a][A[ka].start] if ka < len(A) else 0.0  # старый перегон к хвосту a
+        link_b = rows[end_b][B[kb].start] if kb < len(B) else 0.0
+        cross_a = rows[end_a][B[kb].start] if kb < len(B) else 0.0  # новый перегон к хвосту b
+        cross_b = rows[end_b][A[ka].start] if ka < len(A) else 0.0
+        delta = cross_a + cross_b - link_a - link_b
+        if delta >= -EPSILON:
+            return False
+
+        tail_a = self.cum[a][-1] - self.cum[a][ka] - link_a
+        tail_b = self.cum[b][-1] - self.cum[b][kb] - link_b
+        count_a = self.count[a][-1] - self.count[a][ka]
+        count_b = self.count[b][-1] - self.count[b][kb]
+        if self._busy(self.cum[a][ka] + cross_a + tail_b, self.count[a][ka] + count_b) > self.limit:
+            return False
+        if self._busy(self.cum[b][kb] + cross_b + tail_a, self.count[b][kb] + count_a) > self.limit:
+            return False
+
+        A[ka:], B[kb:] = B[kb:], A[ka:]
+        self._refresh(a)
+        self._refresh(b)
+        return True
+
+
+def improve_plan(
+    problem: Problem,
+    distances: DistanceMatrix,
+    records: List[RouteRecord],
+    time_budget_ms: float,
+    seed: int = 0
+) -> Tuple[List[RouteRecord], Dict[str, Any]]:
+    """
+    Улучшает план в пределах time_budget_ms. Возвращает маршруты (сгруппированные по машинам)
+    и отчёт: пробег до и после, число оценённых и принятых ходов, ходов в секунду.
+    """
+    started = time.perf_counter()
+    vehicles = [v for v in problem.vehicles if v.capacity > 0]
+    route_of = {v.ordinal: r for r, v in enumerate(vehicles)}
+    offset = distances.enterprise_count
+
+    routes: List[List[Job]] = [[] for _ in vehicles]
+    for record in records:
+        r = route_of.get(record.vehicle_ordinal)
+        if r is None:
+            return records, {'skipped': 'план без привязки к машинам'}
+        if record.warehouse_index >= 0:
+            routes[r].append(Job(record, offset + record.warehouse_index))
+        elif routes[r]:
+            # Продолжение с товарами рейса — следующая точка выгрузки, без них — щепа
+            routes[r][-1].attach(record, chips=not record.items)
+        else:
+            return records, {'skipped': 'план без привязки к машинам'}
+
+    chips_capable = [carries_chips(v, problem) for v in vehicles]
+    for jobs in routes:
+        for job in jobs:
+            at_chips_source = problem.enterprises[job.drop_end]['name'] == CHIPS_SOURCE_NAME
+            for r, vehicle in enumerate(vehicles):
+                if job.load > vehicle.capacity + EPSILON or not all(vehicle.can_carry(p) for p in job.products):
+                    continue
+                # Универсал на Заводе всегда забирает щепу, остальные — никогда
+                if at_chips_source and chips_capable[r] != job.chips:
+                    continue
+                job.allowed |= 1 << r
+
+    search = LocalSearch(distances, vehicles, routes, seed)
+    before = search.total()
+    search.run(time_budget_ms)
+    after = search.total()
+    elapsed = time.perf_counter() - started
+
+    # Перегоны и машины в записях — по новому порядку рейсов
+    result: List[RouteRecord] = []
+    rows = search.rows
+    for r, vehicle in enumerate(vehicles):
+        position = vehicle.parking
+        for job in routes[r]:
+            job.records[0].parkingDistance = rows[position][job.start]
+            for record in job.records:
+                record.vehicle = vehicle.number
+                record.vehicleType = vehicle.vehicle_type
+                record.vehicle_ordinal = vehicle.ordinal
+            if job.chips:
+                job.records[-1].volume = vehicle.capacity
+            result.extend(job.records)
+            position = job.end
+
+    report = {
+        'distance_before': round(before, 1),
+        'distance_after': round(after, 1),
+        'moves_evaluated': search.evaluated,
+        'moves_applied': search.applied,
+        'moves_per_second': round(search.evaluated / elapsed) if elapsed > 0 else 0,
+        'elapsed_ms': round(elapsed * 1000, 1)
+    }
+    log.info('Улучшение плана', **report)
+    return result, report
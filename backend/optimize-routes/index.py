@@ -2,13 +2,43 @@
 Оптимизация маршрутов с полным вывозом товаров и распределением машин.
 Учитывает: стоянку машин, грузоподъёмность, цепочки рейсов для универсалов.
 """
-import json
 import os
+from collections import Counter
 from typing import Dict, List, Any, Optional, Tuple
-import math
+
+from batch import prepare_scenarios, run_batch
+from codec import compress_response, dumps, loads
+from diagnostics import log, Diagnostics, DEBUG
+from distances import DistanceMatrix, provider_from_options
+from flow import plan_with_flows
+from improve import improve_plan
+from model import compile_problem, normalize_product, Problem, RouteRecord
+from plan_cache import (
+    affected_vehicles, apply_changes, cache_from_env, normalize_request, repaired_key, request_key, CachedPlan
+)
+from scheduler import schedule_fleet, FleetState
+from paging import page, page_size_from, parse_cursor, SummaryAccumulator
+from trip_index import TripIndex
+
+# Защита от бесконечного цикла: каждый рейс уменьшает остатки, так что предел не достигается на реальных планах
+MAX_TRIPS_PER_VEHICLE = 1000
+# Верхняя граница бюджета на улучшение плана: функция должна успеть ответить
+MAX_TIME_BUDGET_MS = 20000
+# greedy — ближайшие рейсы машинам по мере их освобождения (scheduler.py), flow — транспортная задача по всем складам сразу
+OPTIMIZATION_MODES = ('greedy', 'flow')
+# Параметры расчёта из запроса: входят в ключ кэша планов
+REQUEST_OPTIONS = ('mode', 'distanceProvider', 'timeBudgetMs')
+
+# Кэш планов между вызовами (plan_cache.py)
+PLAN_CACHE = cache_from_env()
 
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """Точка входа функции: ответ сжимается, если клиент это принимает (codec.py)"""
+    return compress_response(handle_request(event), event)
+
+
+def handle_request(event: Dict[str, Any]) -> Dict[str, Any]:
     method: str = event.get('httpMethod', 'POST')
     
     if method == 'OPTIONS':
@@ -28,361 +58,450 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
+            'body': dumps({'error': 'Method not allowed'}),
             'isBase64Encoded': False
         }
     
-    body_data = json.loads(event.get('body', '{}'))
+    body_data = loads(event.get('body'))
     month = body_data.get('month', '')
-    warehouses = body_data.get('warehouses', [])
-    enterprises = body_data.get('enterprises', [])
-    vehicles = body_data.get('vehicles', [])
     
-    print(f"=== Получен запрос: месяц={month}, складов={len(warehouses)}, предприятий={len(enterprises)}, машин={len(vehicles)}")
+    # Следующая страница уже рассчитанного плана
+    if body_data.get('cursor'):
+        return handle_page(body_data.get('cursor'), body_data.get('pageSize'), month)
+    
+    # Пакет сценариев на общих складах и предприятиях
+    if 'scenarios' in body_data:
+        return handle_scenarios(body_data, month)
+    
+    # Дельта к плану из кэша: basePlanId + changes (см. plan_cache.apply_changes)
+    base: Optional[CachedPlan] = None
+    base_plan_id = body_data.get('basePlanId')
+    if base_plan_id:
+        base = PLAN_CACHE.get(base_plan_id)
+        if base is None:
+            return {
+                'statusCode': 404,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'error': 'План не найден в кэше, отправьте полный запрос'}),
+                'isBase64Encoded': False
+            }
+        try:
+            warehouses, enterprises, vehicles = apply_changes(base, body_data.get('changes') or {})
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': dumps({'error': str(e)}),
+                'isBase64Encoded': False
+            }
+        options = {**base.normalized['options'], **{k: body_data[k] for k in REQUEST_OPTIONS if k in body_data}}
+    else:
+        warehouses = body_data.get('warehouses', [])
+        enterprises = body_data.get('enterprises', [])
+        vehicles = body_data.get('vehicles', [])
+        options = {k: body_data.get(k) for k in REQUEST_OPTIONS}
+    
+    log.info('Получен запрос', month=month, warehouses=len(warehouses), enterprises=len(enterprises), vehicles=len(vehicles))
     
     if not warehouses or not enterprises or not vehicles:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Требуются склады, предприятия и транспорт'}),
+            'body': dumps({'error': 'Требуются склады, предприятия и транспорт'}),
+            'isBase64Encoded': False
+        }
+    
+    mode = options.get('mode') or 'greedy'
+    
+    try:
+        if mode not in OPTIMIZATION_MODES:
+            raise ValueError(f"Неизвестный режим оптимизации: {mode}")
+        distance_provider = provider_from_options(options.get('distanceProvider'))
+        time_budget_ms = float(options.get('timeBudgetMs') or 0)
+        if not 0 <= time_budget_ms <= MAX_TIME_BUDGET_MS:
+            raise ValueError(f"timeBudgetMs: ожидается число от 0 до {MAX_TIME_BUDGET_MS}")
+        page_size = page_size_from(body_data['pageSize']) if body_data.get('pageSize') else None
+    except (ValueError, TypeError) as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
+    
+    # profile: true — замеры фаз и счётчики расчёта в ответе (в журнал они пишутся всегда)
+    profile = bool(body_data.get('profile'))
+    diagnostics = Diagnostics()
+    
+    options = {'mode': mode, 'distanceProvider': options.get('distanceProvider'), 'timeBudgetMs': time_budget_ms}
+    with diagnostics.phase('normalization'):
+        normalized = normalize_request(warehouses, enterprises, vehicles, options)
+        plan_id = request_key(normalized)
+    cached = PLAN_CACHE.get(plan_id)
+    # Полный расчёт того же запроса лучше ремонта; отремонтированный план лежит под своим ключом
+    repairable = cached is None and base is not None and base.normalized['options'] == options
+    if repairable:
+        plan_id = repaired_key(base.plan_id, plan_id)
+        cached = PLAN_CACHE.get(plan_id)
+    report: Dict[str, Any] = {}
+    
+    if cached is not None:
+        plan_source = 'cached'
+        routes, summary = cached.routes, cached.summary
+        report['improvement'] = summary.get('improvement')
+        log.info('План взят из кэша', plan_id=plan_id)
+    elif repairable:
+        plan_source = 'repaired'
+        routes = repair_routes(
+            base, normalized, warehouses, enterprises, vehicles, distance_provider, mode, time_budget_ms, report,
+            diagnostics
+        )
+    else:
+        plan_source = 'fresh'
+        routes = optimize_routes_full(
+            warehouses, enterprises, vehicles, month, distance_provider, mode, time_budget_ms, report, diagnostics
+        )
+    
+    if plan_source != 'cached':
+        with diagnostics.phase('summary'):
+            summary = generate_summary(routes, report.get('improvement'))
+        PLAN_CACHE.put(CachedPlan(plan_id, warehouses, enterprises, vehicles, normalized, routes, summary))
+    log_diagnostics(diagnostics)
+    
+    next_cursor = None
+    if page_size:
+        routes, next_cursor = page(routes, plan_id, 0, page_size)
+    
+    response = {
+        'month': month,
+        'routes': routes,
+        'total_routes': summary.get('trips_count', 0),
+        'summary': summary,
+        'plan_id': plan_id,
+        'plan_source': plan_source
+    }
+    if page_size:
+        response['next_cursor'] = next_cursor
+    if profile:
+        response['diagnostics'] = diagnostics.to_dict()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps(response),
+        'isBase64Encoded': False
+    }
+
+
+def handle_page(cursor: Any, page_size: Any, month: str) -> Dict[str, Any]:
+    """Страница плана из кэша по курсору из предыдущего ответа"""
+    try:
+        plan_id, offset = parse_cursor(cursor)
+        size = page_size_from(page_size)
+    except (ValueError, TypeError) as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
     
-    routes = optimize_routes_full(warehouses, enterprises, vehicles, month)
+    plan = PLAN_CACHE.get(plan_id)
+    if plan is None:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'error': 'План не найден в кэше, отправьте полный запрос'}),
+            'isBase64Encoded': False
+        }
+    
+    routes, next_cursor = page(plan.routes, plan_id, offset, size)
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
+        'body': dumps({
             'month': month,
             'routes': routes,
-            'total_routes': len(routes),
-            'summary': generate_summary(routes)
+            'total_routes': len(plan.routes),
+            'summary': plan.summary,
+            'plan_id': plan_id,
+            'plan_source': 'cached',
+            'next_cursor': next_cursor
         }),
         'isBase64Encoded': False
     }
 
 
-def calculate_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
-    """Расчёт расстояния между двумя точками (км)"""
-    if not all([lat1, lng1, lat2, lng2]):
-        return 999999.0
+def handle_scenarios(body_data: Dict[str, Any], month: str) -> Dict[str, Any]:
+    """Несколько сценариев (месяцы, варианты парка) за один запрос, параллельно по процессам"""
+    warehouses = body_data.get('warehouses', [])
+    enterprises = body_data.get('enterprises', [])
     
-    R = 6371.0
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lng = math.radians(lng2 - lng1)
+    if not warehouses or not enterprises:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'error': 'Требуются склады и предприятия'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        defaults = {
+            'month': month,
+            'mode': body_data.get('mode') or 'greedy',
+            'timeBudgetMs': float(body_data.get('timeBudgetMs') or 0)
+        }
+        scenarios = prepare_scenarios(
+            body_data.get('scenarios'), warehouses, enterprises, body_data.get('vehicles', []), defaults
+        )
+        for scenario in scenarios:
+            options = scenario['options']
+            if options['mode'] not in OPTIMIZATION_MODES:
+                raise ValueError(f"Неизвестный режим оптимизации: {options['mode']}")
+            if not 0 <= options['timeBudgetMs'] <= MAX_TIME_BUDGET_MS:
+                raise ValueError(f"timeBudgetMs: ожидается число от 0 до {MAX_TIME_BUDGET_MS}")
+        distance_provider = provider_from_options(body_data.get('distanceProvider'))
+    except (ValueError, TypeError) as e:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'error': str(e)}),
+            'isBase64Encoded': False
+        }
     
-    a = math.sin(delta_lat / 2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lng / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    results = run_batch(warehouses, enterprises, scenarios, plan_scenario, distance_provider)
     
-    return round(R * c, 2)
-
-
-def normalize_product(name: str) -> str:
-    """Нормализация названий продуктов"""
-    return name.strip().lower()
-
-
-def can_vehicle_carry(vehicle: Dict, product: str) -> bool:
-    """Проверяет, может ли машина везти данный товар"""
-    vehicle_products = [normalize_product(p) for p in vehicle.get('productTypes', [])]
-    return normalize_product(product) in vehicle_products
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({
+            'month': month,
+            'scenarios': results,
+            'total_scenarios': len(results)
+        }),
+        'isBase64Encoded': False
+    }
 
 
-def optimize_routes_full(warehouses: List[Dict], enterprises: List[Dict], vehicles: List[Dict], month: str) -> List[Dict]:
+def optimize_routes_full(
+    warehouses: List[Dict],
+    enterprises: List[Dict],
+    vehicles: List[Dict],
+    month: str,
+    distance_provider: Optional[Any] = None,
+    mode: str = 'greedy',
+    time_budget_ms: Optional[float] = None,
+    report: Optional[Dict[str, Any]] = None,
+    diagnostics: Optional[Diagnostics] = None
+) -> List[Dict]:
     """
-    Полная оптимизация:
-    1. Создаём копию остатков складов
-    2. Для каждой активной машины:
-       - Начинаем от места стоянки
-       - Строим цепочку рейсов до полного вывоза товаров
+    Полная оптимизация (расстояния — от distance_provider, по умолчанию по прямой).
+    Замеры фаз и счётчики расчёта копятся в diagnostics (если передан).
+    mode='flow' — распределение объёмов как транспортная задача, затем раздача рейсов (см. flow.py).
+    time_budget_ms — сколько можно потратить на улучшение готового плана локальным поиском
+    (см. improve.py); отчёт об улучшении кладётся в report['improvement'].
+    Режим greedy:
+    1. Компилируем запрос: товары → id, остатки и потребности → плоские массивы
+    2. Все активные машины выезжают со стоянок одновременно:
+       - Очередной рейс выбирает машина, которая освобождается раньше остальных
+       - Рейсы планируются до полного вывоза товаров
+       - Если основной товар не заполняет кузов, машина догружается другими товарами того же склада
+         и развозит их по пути (маршрут с несколькими точками выгрузки, объёмы по товарам — в products)
        - Для универсалов: Склад→Завод(погрузка)→ДОК→Склад...
     """
-    routes = []
-    
-    # Копия остатков (будем уменьшать по мере вывоза)
-    remaining_stocks = {}
-    for w in warehouses:
-        stocks_normalized = {}
-        for product, volume in w.get('stocks', {}).items():
-            key = normalize_product(product)
-            if volume > 0:
-                stocks_normalized[key] = {
-                    'volume': volume,
-                    'original_name': product
-                }
-        remaining_stocks[w['id']] = stocks_normalized
-    
-    # Копия потребностей (будем уменьшать по мере доставки)
-    remaining_needs = {}
-    for e in enterprises:
-        needs_normalized = {}
-        for product, volume in e.get('needs', {}).items():
-            key = normalize_product(product)
-            if volume > 0:
-                needs_normalized[key] = {
-                    'volume': volume,
-                    'original_name': product
-                }
-        remaining_needs[e['id']] = needs_normalized
-    
-    print(f"=== Начальные остатки: {sum(len(s) for s in remaining_stocks.values())} позиций на складах")
-    print(f"=== Начальные потребности: {sum(len(n) for n in remaining_needs.values())} позиций на предприятиях")
-    
-    # Сортируем машины по грузоподъёмности (большие сначала)
-    active_vehicles = [v for v in vehicles if v.get('status') == 'active']
-    active_vehicles.sort(key=lambda v: v.get('volume', 0), reverse=True)
-    
-    print(f"=== Активных машин: {len(active_vehicles)}")
-    
-    # Логирование для диагностики
-    all_warehouse_products = set()
-    for stocks in remaining_stocks.values():
-        all_warehouse_products.update(stocks.keys())
-    
-    all_vehicle_products = set()
-    for v in active_vehicles:
-        all_vehicle_products.update(normalize_product(p) for p in v.get('productTypes', []))
-    
-    print(f"=== Товары на складах: {sorted(all_warehouse_products)}")
-    print(f"=== Товары, которые везут машины: {sorted(all_vehicle_products)}")
-    
-    # Логирование потребностей предприятий
-    for eid, needs in remaining_needs.items():
-        if needs:
-            enterprise = next((e for e in enterprises if e['id'] == eid), None)
-            if enterprise:
-                print(f"=== Предприятие {enterprise['name']}: нужно {needs}")
-    
-    for vehicle in active_vehicles:
-        vehicle_routes = build_vehicle_routes(
-            vehicle, warehouses, enterprises, remaining_stocks, remaining_needs
-        )
-        routes.extend(vehicle_routes)
-        
-        if vehicle_routes:
-            vehicle_id = vehicle.get('licensePlate') or vehicle.get('number', 'Неизвестно')
-            print(f"=== Машина {vehicle_id}: создано {len(vehicle_routes)} рейсов")
-    
-    # Проверяем, что осталось на складах
-    total_remaining = sum(
-        data['volume'] 
-        for warehouse_stocks in remaining_stocks.values() 
-        for data in warehouse_stocks.values()
-    )
-    
-    if total_remaining > 0:
-        print(f"⚠️ ВНИМАНИЕ: На складах осталось {total_remaining:.1f} м³ товаров")
-        for wid, stocks in remaining_stocks.items():
-            if stocks:
-                warehouse = next((w for w in warehouses if w['id'] == wid), None)
-                print(f"   {warehouse['name'] if warehouse else wid}: {stocks}")
+    diagnostics = diagnostics or Diagnostics()
+    problem, distances = prepare_problem(warehouses, enterprises, vehicles, distance_provider, diagnostics)
+    records = plan_records(problem, distances, mode, time_budget_ms, report, diagnostics)
+    warn_leftovers(problem)
     
-    return routes
+    with diagnostics.phase('serialization'):
+        return [record.to_dict() for record in records]
 
 
-def build_vehicle_routes(
-    vehicle: Dict,
+def prepare_problem(
     warehouses: List[Dict],
     enterprises: List[Dict],
-    remaining_stocks: Dict,
-    remaining_needs: Dict
-) -> List[Dict]:
-    """
-    Строит цепочку рейсов для одной машины:
-    - Начало: место стоянки машины
-    - Цикл: находим ближайший склад с подходящим товаром → везём на нужное предприятие
-    - Для универсалов: если везём доски/брус на Завод, загружаемся щепой и везём на ДОК
-    """
-    vehicle_routes = []
-    vehicle_capacity = vehicle.get('volume', 0)
-    vehicle_number = vehicle.get('licensePlate') or vehicle.get('number', 'Неизвестно')
-    vehicle_products = [normalize_product(p) for p in vehicle.get('productTypes', [])]
-    
-    # Стоянка машины (предприятие)
-    parking_enterprise_name = vehicle.get('enterprise', '')
-    parking_enterprise = next((e for e in enterprises if e['name'] == parking_enterprise_name), None)
-    
-    if not parking_enterprise:
-        if enterprises:
-            parking_enterprise = enterprises[0]
-            print(f"⚠️ Машина {vehicle_number}: предприятие '{parking_enterprise_name}' не найдено, использую {parking_enterprise['name']}")
-        else:
-            print(f"⚠️ Машина {vehicle_number}: нет доступных предприятий")
-            return []
-    
-    current_lat = parking_enterprise['lat']
-    current_lng = parking_enterprise['lng']
-    current_location = parking_enterprise['name']
-    
-    # Флаг: универсал ли?
-    is_universal = 'универсал' in normalize_product(vehicle.get('category', ''))
-    
-    trips_count = 0
-    max_trips = 50  # защита от бесконечного цикла
-    
-    while trips_count < max_trips:
-        # Ищем ближайший склад с товаром, который машина может везти
-        best_trip = find_best_trip(
-            current_lat, current_lng, current_location,
-            vehicle, vehicle_products, vehicle_capacity,
-            warehouses, enterprises,
-            remaining_stocks, remaining_needs
+    vehicles: List[Dict],
+    distance_provider: Optional[Any] = None,
+    diagnostics: Optional[Diagnostics] = None
+) -> Tuple[Problem, DistanceMatrix]:
+    """Компиляция запроса и матрица расстояний (подробности задачи — в журнал на уровне DEBUG)"""
+    diagnostics = diagnostics or Diagnostics()
+    with diagnostics.phase('normalization'):
+        problem = compile_problem(warehouses, enterprises, vehicles)
+    
+    # Матрица расстояний: один раз на запрос, дальше только обращения по индексу
+    with diagnostics.phase('distance_matrix'):
+        distances = DistanceMatrix(enterprises, warehouses, distance_provider)
+    
+    log.info('Задача скомпилирована', products=problem.product_count, vehicles=len(problem.vehicles))
+    
+    # Подробные дампы собираются только при включённом DEBUG: на больших запросах это заметное время
+    if log.enabled(DEBUG):
+        P = problem.product_count
+        log.debug(
+            'Исходные данные',
+            stock_positions=sum(1 for v in problem.stock if v > 0),
+            need_positions=sum(1 for v in problem.need if v > 0),
+            warehouse_products=sorted({problem.product_keys[i % P] for i, volume in enumerate(problem.stock) if volume > 0}),
+            vehicle_products=sorted({problem.product_keys[p] for v in problem.vehicles for p in v.product_ids})
         )
-        
-        if not best_trip:
-            print(f"Машина {vehicle_number}: больше нет подходящих рейсов (сделано {trips_count})")
-            break
-        
-        # Создаём основной маршрут: текущая позиция → склад → предприятие
-        main_route = {
-            'vehicle': vehicle_number,
-            'vehicleType': vehicle.get('category', 'Неизвестно'),
-            'product': best_trip['product_original'],
-            'volume': best_trip['volume'],
-            'from': best_trip['warehouse']['name'],
-            'fromLat': best_trip['warehouse']['lat'],
-            'fromLng': best_trip['warehouse']['lng'],
-            'to': best_trip['enterprise']['name'],
-            'toLat': best_trip['enterprise']['lat'],
-            'toLng': best_trip['enterprise']['lng'],
-            'distance': best_trip['distance_delivery'],
-            'parkingDistance': best_trip['distance_to_warehouse']
-        }
-        
-        vehicle_routes.append(main_route)
-        
-        # Обновляем остатки на складах
-        warehouse_id = best_trip['warehouse']['id']
-        product_key = best_trip['product_key']
-        
-        remaining_stocks[warehouse_id][product_key]['volume'] -= best_trip['volume']
-        if remaining_stocks[warehouse_id][product_key]['volume'] <= 0:
-            del remaining_stocks[warehouse_id][product_key]
-        
-        # Универсал на Заводе: загружаем щепой и везём на Павловский ДОК
-        if is_universal and best_trip['enterprise']['name'] == 'Завод':
-            dok_enterprise = next((e for e in enterprises if 'павловский док' in normalize_product(e['name'])), None)
-            
-            if dok_enterprise and 'щепа' in vehicle_products:
-                chips_volume = vehicle_capacity
-                chips_distance = calculate_distance(
-                    best_trip['enterprise']['lat'], best_trip['enterprise']['lng'],
-                    dok_enterprise['lat'], dok_enterprise['lng']
-                )
-                
-                chips_route = {
-                    'vehicle': vehicle_number,
-                    'vehicleType': vehicle.get('category', 'Универсал'),
-                    'product': 'Щепа',
-                    'volume': chips_volume,
-                    'from': 'Завод',
-                    'fromLat': best_trip['enterprise']['lat'],
-                    'fromLng': best_trip['enterprise']['lng'],
-                    'to': dok_enterprise['name'],
-                    'toLat': dok_enterprise['lat'],
-                    'toLng': dok_enterprise['lng'],
-                    'distance': chips_distance,
-                    'parkingDistance': 0
-                }
-                
-                vehicle_routes.append(chips_route)
-                
-                # Текущая позиция = Павловский ДОК
-                current_lat = dok_enterprise['lat']
-                current_lng = dok_enterprise['lng']
-                current_location = dok_enterprise['name']
-            else:
-                current_lat = best_trip['enterprise']['lat']
-                current_lng = best_trip['enterprise']['lng']
-                current_location = best_trip['enterprise']['name']
+        for e, enterprise in enumerate(enterprises):
+            needs = problem.enterprise_needs(e)
+            if needs:
+                log.debug('Потребности предприятия', enterprise=enterprise['name'], needs=needs)
+    
+    return problem, distances
+
+
+def plan_records(
+    problem: Problem,
+    distances: DistanceMatrix,
+    mode: str,
+    time_budget_ms: Optional[float] = None,
+    report: Optional[Dict[str, Any]] = None,
+    diagnostics: Optional[Diagnostics] = None
+) -> List[RouteRecord]:
+    """Рейсы для всех машин problem.vehicles выбранным режимом, затем улучшение в пределах бюджета"""
+    diagnostics = diagnostics or Diagnostics()
+    trip_index: Optional[TripIndex] = None
+    state: Optional[FleetState] = None
+    with diagnostics.phase('planning'):
+        if mode == 'flow':
+            records = plan_with_flows(problem, distances, max_trips_per_vehicle=MAX_TRIPS_PER_VEHICLE)
         else:
-            current_lat = best_trip['enterprise']['lat']
-            current_lng = best_trip['enterprise']['lng']
-            current_location = best_trip['enterprise']['name']
-        
-        trips_count += 1
+            trip_index = TripIndex(problem, distances)
+            records, state = schedule_fleet(problem, trip_index, MAX_TRIPS_PER_VEHICLE)
+    
+    if time_budget_ms:
+        with diagnostics.phase('improvement'):
+            records, improvement = improve_plan(problem, distances, records, time_budget_ms)
+        if report is not None:
+            report['improvement'] = improvement
+    
+    # Рейс — запись со склада; запись щепы (без склада) продолжает рейс универсала
+    trips = Counter(record.vehicle_ordinal for record in records if record.warehouse_index >= 0)
+    record_counters(diagnostics, problem, distances, trips, trip_index, state)
+    return records
+
+
+def record_counters(
+    diagnostics: Diagnostics,
+    problem: Problem,
+    distances: DistanceMatrix,
+    trips: Dict[int, int],
+    trip_index: Optional[TripIndex] = None,
+    state: Optional[FleetState] = None
+) -> None:
+    """Счётчики расчёта: посчитанные расстояния, поиск рейсов, рейсы и время планирования по машинам"""
+    diagnostics.count('distance_evaluations', distances.evaluations)
+    if trip_index is not None:
+        diagnostics.count('trip_searches', trip_index.searches)
+        diagnostics.count('candidates_scanned', trip_index.scanned)
+    diagnostics.count('trips', sum(trips.values()))
+    for k, vehicle in enumerate(problem.vehicles):
+        diagnostics.vehicle(vehicle.number, trips.get(vehicle.ordinal, 0), state.planning[k] if state else None)
+
+
+def log_diagnostics(diagnostics: Diagnostics) -> None:
+    """Замеры запроса в журнал (без разбивки по машинам)"""
+    summary = diagnostics.to_dict()
+    log.info('Замеры запроса', phases_ms=summary['phases_ms'], counters=summary['counters'])
+
+
+def plan_scenario(problem: Problem, distances: DistanceMatrix, options: Dict[str, Any]) -> Tuple[List[Dict], Dict]:
+    """План одного сценария пакета (вызывается и в процессах-исполнителях, см. batch.py)"""
+    report: Dict[str, Any] = {}
+    records = plan_records(problem, distances, options['mode'], options['timeBudgetMs'], report)
+    warn_leftovers(problem)
+    routes = [record.to_dict() for record in records]
+    return routes, generate_summary(routes, report.get('improvement'))
+
+
+def warn_leftovers(problem: Problem) -> None:
+    """Проверяем, что осталось на складах"""
+    total_remaining = problem.total_stock()
     
-    return vehicle_routes
+    if total_remaining > 0:
+        log.warning('На складах остались товары', volume=round(total_remaining, 1))
+        if log.enabled(DEBUG):
+            for w, warehouse in enumerate(problem.warehouses):
+                stocks = problem.warehouse_stocks(w)
+                if stocks:
+                    log.debug('Остаток склада', warehouse=warehouse['name'], stocks=stocks)
 
 
-def find_best_trip(
-    current_lat: float,
-    current_lng: float,
-    current_location: str,
-    vehicle: Dict,
-    vehicle_products: List[str],
-    vehicle_capacity: float,
+def repair_routes(
+    base: CachedPlan,
+    normalized: Dict[str, Any],
     warehouses: List[Dict],
     enterprises: List[Dict],
-    remaining_stocks: Dict,
-    remaining_needs: Dict
-) -> Optional[Dict]:
+    vehicles: List[Dict],
+    distance_provider: Optional[Any] = None,
+    mode: str = 'greedy',
+    time_budget_ms: Optional[float] = None,
+    report: Optional[Dict[str, Any]] = None,
+    diagnostics: Optional[Diagnostics] = None
+) -> List[Dict]:
     """
-    Находит лучший рейс: ближайший склад с товаром → предприятие с потребностью
-    Возвращает: {warehouse, enterprise, product_key, product_original, volume, distance_to_warehouse, distance_delivery}
+    Ремонт сохранённого плана после дельты: цепочки машин, которых изменения не касаются,
+    остаются как были, их объёмы списываются с остатков и потребностей,
+    а остаток задачи планируется заново только для затронутых машин.
     """
-    best_trip = None
-    best_total_distance = float('inf')
-    
-    for warehouse in warehouses:
-        warehouse_stocks = remaining_stocks.get(warehouse['id'], {})
-        if not warehouse_stocks:
-            continue
-        
-        distance_to_warehouse = calculate_distance(
-            current_lat, current_lng,
-            warehouse['lat'], warehouse['lng']
-        )
-        
-        for product_key, stock_data in warehouse_stocks.items():
-            if product_key not in vehicle_products:
-                continue
-            
-            available_volume = stock_data['volume']
-            if available_volume <= 0:
-                continue
-            
-            # Ищем ближайшее предприятие для доставки
-            for enterprise in enterprises:
-                distance_delivery = calculate_distance(
-                    warehouse['lat'], warehouse['lng'],
-                    enterprise['lat'], enterprise['lng']
-                )
-                
-                total_distance = distance_to_warehouse + distance_delivery
-                
-                if total_distance < best_total_distance:
-                    transport_volume = min(vehicle_capacity, available_volume)
-                    
-                    best_trip = {
-                        'warehouse': warehouse,
-                        'enterprise': enterprise,
-                        'product_key': product_key,
-                        'product_original': stock_data['original_name'],
-                        'volume': transport_volume,
-                        'distance_to_warehouse': distance_to_warehouse,
-                        'distance_delivery': distance_delivery
-                    }
-                    best_total_distance = total_distance
-    
-    return best_trip
+    diagnostics = diagnostics or Diagnostics()
+    with diagnostics.phase('normalization'):
+        affected = affected_vehicles(base.normalized, normalized, base.routes)
+        problem = compile_problem(warehouses, enterprises, vehicles)
+    P = problem.product_count
+    
+    kept: Dict[str, List[Dict]] = {}
+    for route in base.routes:
+        if route['vehicle'] not in affected:
+            kept.setdefault(route['vehicle'], []).append(route)
+    kept = {number: routes for number, routes in kept.items() if any(v.number == number for v in problem.vehicles)}
+    
+    # Вычитаем то, что уже везут оставленные цепочки (рейсы щепы — не со складов, их пропускаем;
+    # у догруженной машины склад погрузки указан у каждого товара в products)
+    warehouse_by_name: Dict[str, int] = {}
+    for w, warehouse in enumerate(warehouses):
+        warehouse_by_name.setdefault(warehouse['name'], w)
+    for routes in kept.values():
+        for route in routes:
+            e = problem.enterprise_by_name.get(route['to'])
+            for item in route.get('products') or [route]:
+                w = warehouse_by_name.get(item['from'])
+                product_id = problem.product_ids.get(normalize_product(item['product']))
+                if w is None or product_id is None:
+                    continue
+                problem.stock[w * P + product_id] = max(0.0, problem.stock[w * P + product_id] - item['volume'])
+                if e is not None:
+                    problem.need[e * P + product_id] = max(0.0, problem.need[e * P + product_id] - item['volume'])
+    
+    fleet = problem.vehicles
+    problem.vehicles = [v for v in fleet if v.number not in kept]
+    log.info('Ремонт плана', plan_id=base.plan_id, rebuilt=len(problem.vehicles), vehicles=len(fleet))
+    
+    with diagnostics.phase('distance_matrix'):
+        distances = DistanceMatrix(enterprises, warehouses, distance_provider)
+    records = plan_records(problem, distances, mode, time_budget_ms, report, diagnostics)
+    warn_leftovers(problem)
+    
+    planned: Dict[str, List[Dict]] = {}
+    for record in records:
+        planned.setdefault(record.vehicle, []).append(record.to_dict())
+    
+    # Маршруты по машинам в том же порядке, что и при полном расчёте
+    routes: List[Dict] = []
+    for vehicle in fleet:
+        routes.extend(kept.get(vehicle.number) or planned.get(vehicle.number, []))
+    return routes
 
 
-def generate_summary(routes: List[Dict]) -> Dict:
-    """Генерирует сводку по маршрутам"""
-    if not routes:
-        return {'total_distance': 0, 'total_volume': 0, 'vehicles_used': 0}
+def generate_summary(routes: List[Dict], improvement: Optional[Dict[str, Any]] = None) -> Dict:
+    """Генерирует сводку по маршрутам (и по улучшению плана, если оно было)"""
+    accumulator = SummaryAccumulator()
+    for route in routes:
+        accumulator.add(route)
     
-    total_distance = sum(r.get('distance', 0) + r.get('parkingDistance', 0) for r in routes)
-    total_volume = sum(r.get('volume', 0) for r in routes)
-    vehicles_used = len(set(r.get('vehicle', '') for r in routes))
-    
-    return {
-        'total_distance': round(total_distance, 1),
-        'total_volume': round(total_volume, 1),
-        'vehicles_used': vehicles_used,
-        'trips_count': len(routes)
-    }
\ No newline at end of file
+    return accumulator.summary(improvement)
@@ -0,0 +1,253 @@
+"""
+Компиляция запроса в компактную модель задачи.
+Названия товаров один раз нормализуются и превращаются в целые id,
+остатки и потребности лежат в плоских массивах [порядковый номер × число товаров + id товара],
+у машины — битовая маска товаров, которые она может везти.
+"""
+from array import array
+from typing import Dict, List, Any, Optional, Tuple
+
+from diagnostics import log
+
+CHIPS_PRODUCT = 'щепа'
+CHIPS_SOURCE_NAME = 'Завод'
+CHIPS_TARGET_MARKER = 'павловский док'
+
+
+def normalize_product(name: str) -> str:
+    """Нормализация названий продуктов"""
+    return name.strip().lower()
+
+
+def vehicle_number(vehicle: Dict) -> str:
+    """Номер машины, под которым она попадает в маршруты"""
+    return vehicle.get('licensePlate') or vehicle.get('number', 'Неизвестно')
+
+
+class CompiledVehicle:
+    """Активная машина: всё, что нужно в цикле рейсов, посчитано заранее"""
+    __slots__ = (
+        'ordinal', 'number', 'vehicle_type', 'capacity', 'product_ids', 'product_mask',
+        'parking', 'is_universal', 'source'
+    )
+
+    def __init__(self, ordinal: int, number: str, vehicle_type: str, capacity: float,
+                 product_ids: Tuple[int, ...], parking: int, is_universal: bool, source: Dict):
+        self.ordinal = ordinal
+        self.number = number
+        self.vehicle_type = vehicle_type
+        self.capacity = capacity
+        self.product_ids = product_ids
+        self.product_mask = 0
+        for product_id in product_ids:
+            self.product_mask |= 1 << product_id
+        self.parking = parking
+        self.is_universal = is_universal
+        self.source = source
+
+    def can_carry(self, product_id: Optional[int]) -> bool:
+        return product_id is not None and bool(self.product_mask >> product_id & 1)
+
+
+class RouteRecord:
+    """
+    Один рейс плана; в JSON превращается только при формировании ответа.
+    vehicle_ordinal, warehouse_index, enterprise_index, product_id — порядковые номера из Problem
+    для последующей обработки плана (в JSON не попадают; у рейса щепы и у следующих точек
+    выгрузки рейса склада нет: -1).
+    items — товары, выгружаемые в точке, если машина везёт несколько товаров сразу:
+    (id товара, название, объём, склад погрузки); в JSON — список products, product и volume — по всем товарам точки.
+    via — склады догрузки между origin и to: (название, широта, долгота); в JSON — список via.
+    """
+    __slots__ = (
+        'vehicle', 'vehicleType', 'product', 'volume', 'origin', 'fromLat', 'fromLng',
+        'to', 'toLat', 'toLng', 'distance', 'parkingDistance',
+        'vehicle_ordinal', 'warehouse_index', 'enterprise_index', 'product_id', 'items', 'via'
+    )
+
+    def __init__(self, vehicle: str, vehicleType: str, product: str, volume: float,
+                 origin: str, fromLat: float, fromLng: float,
+                 to: str, toLat: float, toLng: float,
+                 distance: float, parkingDistance: float,
+                 vehicle_ordinal: int = -1, warehouse_index: int = -1,
+                 enterprise_index: int = -1, product_id: int = -1):
+        self.vehicle = vehicle
+        self.vehicleType = vehicleType
+        self.product = product
+        self.volume = volume
+        self.origin = origin
+        self.fromLat = fromLat
+        self.fromLng = fromLng
+        self.to = to
+        self.toLat = toLat
+        self.toLng = toLng
+        self.distance = distance
+        self.parkingDistance = parkingDistance
+        self.vehicle_ordinal = vehicle_ordinal
+        self.warehouse_index = warehouse_index
+        self.enterprise_index = enterprise_index
+        self.product_id = product_id
+        self.items: Optional[List[Tuple[int, str, float, str]]] = None
+        self.via: Optional[List[Tuple[str, float, float]]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        route = {
+            'vehicle': self.vehicle,
+            'vehicleType': self.vehicleType,
+            'product': self.product,
+            'volume': self.volume,
+            'from': self.origin,
+            'fromLat': self.fromLat,
+            'fromLng': self.fromLng,
+            'to': self.to,
+            'toLat': self.toLat,
+            'toLng': self.toLng,
+            'distance': self.distance,
+            'parkingDistance': self.parkingDistance
+        }
+        if self.items:
+            route['products'] = [
+                {'product': name, 'volume': volume, 'from': warehouse} for _, name, volume, warehouse in self.items
+            ]
+        if self.via:
+            route['via'] = [{'name': name, 'lat': lat, 'lng': lng} for name, lat, lng in self.via]
+        return route
+
+
+class Problem:
+    """
+    Скомпилированный запрос.
+    stock[w * product_count + p] — остаток товара p на складе w (уменьшается по мере вывоза),
+    need[e * product_count + p] — потребность предприятия e (уменьшается по мере доставки).
+    """
+    __slots__ = (
+        'warehouses', 'enterprises', 'vehicles',
+        'product_keys', 'product_ids', 'product_count',
+        'stock', 'need', 'stock_names', 'need_names',
+        'warehouse_by_id', 'enterprise_by_id', 'enterprise_by_name',
+        'chips_product', 'chips_target'
+    )
+
+    def __init__(self, warehouses: List[Dict], enterprises: List[Dict]):
+        self.warehouses = warehouses
+        self.enterprises = enterprises
+        self.vehicles: List[CompiledVehicle] = []
+        self.product_keys: List[str] = []
+        self.product_ids: Dict[str, int] = {}
+        self.product_count = 0
+        self.stock = array('d')
+        self.need = array('d')
+        # Исходные названия товара на конкретном складе/предприятии — для вывода в маршрут
+        self.stock_names: Dict[int, str] = {}
+        self.need_names: Dict[int, str] = {}
+        self.warehouse_by_id: Dict[Any, int] = {}
+        self.enterprise_by_id: Dict[Any, int] = {}
+        self.enterprise_by_name: Dict[str, int] = {}
+        self.chips_product: Optional[int] = None
+        self.chips_target: Optional[int] = None
+
+    def intern(self, name: str) -> int:
+        """id товара по названию (нормализованному)"""
+        key = normalize_product(name)
+        product_id = self.product_ids.get(key)
+        if product_id is None:
+            product_id = self.product_ids[key] = self.product_count
+            self.product_keys.append(key)
+            self.product_count += 1
+        return product_id
+
+    def stock_volume(self, warehouse: int, product_id: int) -> float:
+        return self.stock[warehouse * self.product_count + product_id]
+
+    def need_volume(self, enterprise: int, product_id: int) -> float:
+        return self.need[enterprise * self.product_count + product_id]
+
+    def stock_name(self, warehouse: int, product_id: int) -> str:
+        return self.stock_names.get(warehouse * self.product_count + product_id, self.product_keys[product_id])
+
+    def warehouse_stocks(self, warehouse: int) -> Dict[str, float]:
+        """Ненулевые остатки склада по исходным названиям (для логов и отчётов)"""
+        base = warehouse * self.product_count
+        return {
+            self.stock_name(warehouse, p): self.stock[base + p]
+            for p in range(self.product_count) if self.stock[base + p] > 0
+        }
+
+    def enterprise_needs(self, enterprise: int) -> Dict[str, float]:
+        """Ненулевые потребности предприятия по исходным названиям"""
+        base = enterprise * self.product_count
+        return {
+            self.need_names.get(base + p, self.product_keys[p]): self.need[base + p]
+            for p in range(self.product_count) if self.need[base + p] > 0
+        }
+
+    def total_stock(self) -> float:
+        return sum(v for v in self.stock if v > 0)
+
+
+def compile_problem(warehouses: List[Dict], enterprises: List[Dict], vehicles: List[Dict]) -> Problem:
+    """
+    Один проход по запросу: интернирование товаров, плоские массивы остатков и потребностей,
+    таблицы поиска по id/названию, активные машины (по убыванию грузоподъёмности).
+    """
+    problem = Problem(warehouses, enterprises)
+
+    stock_entries: List[Tuple[int, int, float, str]] = []
+    for w, warehouse in enumerate(warehouses):
+        problem.warehouse_by_id.setdefault(warehouse['id'], w)
+        for product, volume in warehouse.get('stocks', {}).items():
+            if volume > 0:
+                stock_entries.append((w, problem.intern(product), volume, product))
+
+    need_entries: List[Tuple[int, int, float, str]] = []
+    for e, enterprise in enumerate(enterprises):
+        problem.enterprise_by_id.setdefault(enterprise['id'], e)
+        problem.enterprise_by_name.setdefault(enterprise['name'], e)
+        if problem.chips_target is None and CHIPS_TARGET_MARKER in normalize_product(enterprise['name']):
+            problem.chips_target = e
+        for product, volume in enterprise.get('needs', {}).items():
+            if volume > 0:
+                need_entries.append((e, problem.intern(product), volume, product))
+
+    active = [v for v in vehicles if v.get('status') == 'active']
+    active.sort(key=lambda v: v.get('volume', 0), reverse=True)
+    vehicle_products = [
+        tuple(dict.fromkeys(problem.intern(p) for p in v.get('productTypes', [])))
+        for v in active
+    ]
+    problem.chips_product = problem.product_ids.get(CHIPS_PRODUCT)
+
+    # Товары интернированы — теперь известен размер плоских массивов
+    P = problem.product_count
+    problem.stock = array('d', bytes(8 * len(warehouses) * P))
+    problem.need = array('d', bytes(8 * len(enterprises) * P))
+    for w, product_id, volume, name in stock_entries:
+        problem.stock[w * P + product_id] = volume
+        problem.stock_names[w * P + product_id] = name
+    for e, product_id, volume, name in need_entries:
+        problem.need[e * P + product_id] = volume
+        problem.need_names[e * P + product_id] = name
+
+    for ordinal, (vehicle, product_ids) in enumerate(zip(active, vehicle_products)):
+        number = vehicle_number(vehicle)
+        parking_name = vehicle.get('enterprise', '')
+        parking = problem.enterprise_by_name.get(parking_name)
+        if parking is None:
+            if not enterprises:
+                log.warning('Машина без стоянки: нет доступных предприятий', vehicle=number)
+                continue
+            parking = 0
+            log.warning('Стоянка не найдена, машина ставится на первое предприятие',
+                        vehicle=number, parking=parking_name, used=enterprises[0]['name'])
+        problem.vehicles.append(CompiledVehicle(
+            ordinal=ordinal,
+            number=number,
+            vehicle_type=vehicle.get('category', 'Неизвестно'),
+            capacity=vehicle.get('volume', 0),
+            product_ids=product_ids,
+            parking=parking,
+            is_universal='универсал' in normalize_product(vehicle.get('category', '')),
+            source=vehicle
+        ))
+
+    return problem
@@ -0,0 +1,67 @@
+"""
+Постраничная выдача больших планов: среда функций отдаёт тело ответа целиком после расчёта,
+поэтому большой план клиент забирает частями. План лежит в кэше планов, курсор — «id плана:смещение».
+Сводка плана считается по одному маршруту за раз (SummaryAccumulator).
+"""
+from typing import Dict, List, Any, Optional, Tuple
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+
+class SummaryAccumulator:
+    """Сводка по маршрутам, которая считается по одному маршруту за раз"""
+    __slots__ = ('total_distance', 'total_volume', 'vehicles', 'trips_count')
+
+    def __init__(self):
+        self.total_distance = 0.0
+        self.total_volume = 0.0
+        self.vehicles = set()
+        self.trips_count = 0
+
+    def add(self, route: Dict) -> None:
+        self.total_distance += route.get('distance', 0) + route.get('parkingDistance', 0)
+        self.total_volume += route.get('volume', 0)
+        self.vehicles.add(route.get('vehicle', ''))
+        self.trips_count += 1
+
+    def summary(self, improvement: Optional[Dict[str, Any]] = None) -> Dict:
+        if not self.trips_count:
+            return {'total_distance': 0, 'total_volume': 0, 'vehicles_used': 0}
+
+        summary = {
+            'total_distance': round(self.total_distance, 1),
+            'total_volume': round(self.total_volume, 1),
+            'vehicles_used': len(self.vehicles),
+            'trips_count': self.trips_count
+        }
+        if improvement:
+            summary['improvement'] = improvement
+        return summary
+
+
+def make_cursor(plan_id: str, offset: int) -> str:
+    return f'{plan_id}:{offset}'
+
+
+def parse_cursor(cursor: Any) -> Tuple[str, int]:
+    """(id плана, смещение); ValueError, если курсор не наш"""
+    if not isinstance(cursor, str) or ':' not in cursor:
+        raise ValueError('cursor: неверный формат')
+    plan_id, offset = cursor.rsplit(':', 1)
+    if not plan_id or not offset.isdigit():
+        raise ValueError('cursor: неверный формат')
+    return plan_id, int(offset)
+
+
+def page_size_from(value: Any) -> int:
+    size = int(value or DEFAULT_PAGE_SIZE)
+    if not 0 < size <= MAX_PAGE_SIZE:
+        raise ValueError(f"pageSize: ожидается число от 1 до {MAX_PAGE_SIZE}")
+    return size
+
+
+def page(routes: List[Dict], plan_id: str, offset: int, size: int) -> Tuple[List[Dict], Optional[str]]:
+    """Страница маршрутов и курсор следующей (None — страниц больше нет)"""
+    end = offset + size
+    return routes[offset:end], make_cursor(plan_id, end) if end < len(routes) else None
@@ -0,0 +1,257 @@
+"""
+Кэш готовых планов между вызовами функции и данные для их ремонта.
+Ключ плана — хэш нормализованного запроса: только то, что читает оптимизатор,
+без нулевых остатков/потребностей и неактивных машин, с упорядоченными ключами.
+По сохранённому запросу и маршрутам можно принять дельту (изменённые склады, предприятия,
+машины) и перестроить только цепочки машин, которых изменения касаются.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+from model import normalize_product, vehicle_number
+
+NODE_FIELDS = ('id', 'name', 'lat', 'lng')
+VEHICLE_FIELDS = ('category', 'volume', 'enterprise')
+
+
+def _volumes(values: Dict[str, float]) -> Dict[str, float]:
+    return {name: volume for name, volume in sorted(values.items()) if volume > 0}
+
+
+def normalize_request(
+    warehouses: List[Dict],
+    enterprises: List[Dict],
+    vehicles: List[Dict],
+    options: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Каноническое представление запроса: одинаковые по смыслу запросы дают одинаковый хэш"""
+    return {
+        'warehouses': [
+            {**{k: w.get(k) for k in NODE_FIELDS}, 'stocks': _volumes(w.get('stocks', {}))} for w in warehouses
+        ],
+        'enterprises': [
+            {**{k: e.get(k) for k in NODE_FIELDS}, 'needs': _volumes(e.get('needs', {}))} for e in enterprises
+        ],
+        'vehicles': [
+            {
+                'number': vehicle_number(v),
+                **{k: v.get(k) for k in VEHICLE_FIELDS},
+                'productTypes': list(v.get('productTypes', []))
+            }
+            for v in vehicles if v.get('status') == 'active'
+        ],
+        'options': options
+    }
+
+
+def request_key(normalized: Dict[str, Any]) -> str:
+    payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def repaired_key(base_plan_id: str, plan_id: str) -> str:
+    """
+    Ключ плана, отремонтированного из base_plan_id: ремонт не равен полному расчёту,
+    поэтому под ключом полного запроса (plan_id) он не хранится
+    """
+    return request_key({'repaired_from': base_plan_id, 'plan_id': plan_id})
+
+
+class CachedPlan:
+    """Запрос (как его прислали, для применения дельт), его нормализованный вид и готовый ответ"""
+    __slots__ = ('plan_id', 'warehouses', 'enterprises', 'vehicles', 'normalized', 'routes', 'summary')
+
+    def __init__(self, plan_id: str, warehouses: List[Dict], enterprises: List[Dict], vehicles: List[Dict],
+                 normalized: Dict[str, Any], routes: List[Dict], summary: Dict[str, Any]):
+        self.plan_id = plan_id
+        self.warehouses = warehouses
+        self.enterprises = enterprises
+        self.vehicles = vehicles
+        self.normalized = normalized
+        self.routes = routes
+        self.summary = summary
+
+
+class PlanCache:
+    """LRU по числу планов с ограничением срока жизни"""
+
+    def __init__(self, max_entries: int = 64, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[float, CachedPlan]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+    def get(self, plan_id: str) -> Optional[CachedPlan]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(plan_id)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(plan_id)
+                    self.counters['hits'] += 1
+                    return entry[1]
+                del self._entries[plan_id]
+            self.counters['misses'] += 1
+            return None
+
+    def put(self, plan: CachedPlan) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[plan.plan_id] = (time.time() + self.ttl, plan)
+            self._entries.move_to_end(plan.plan_id)
+            self.counters['stores'] += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evictions'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.counters, 'size': len(self._entries)}
+
+
+def cache_from_env() -> PlanCache:
+    """Настройки кэша из переменных окружения функции"""
+    return PlanCache(
+        max_entries=int(os.environ.get('PLAN_CACHE_ENTRIES', '64')),
+        ttl=float(os.environ.get('PLAN_CACHE_TTL', '3600'))
+    )
+
+
+def apply_changes(plan: CachedPlan, changes: Dict[str, Any]) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """Запрос плана с применённой дельтой (см. merge_changes)"""
+    return merge_changes(plan.warehouses, plan.enterprises, plan.vehicles, changes)
+
+
+def merge_changes(
+    warehouses: List[Dict],
+    enterprises: List[Dict],
+    vehicles: List[Dict],
+    changes: Dict[str, Any]
+) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    """
+    changes: {"warehouses": [...], "enterprises": [...], "vehicles": [...]},
+    элемент с известным id обновляет поля объекта, с "removed": true — удаляет его, с новым id — добавляется.
+    Машины, как и в маршрутах, определяются номером (id подходит, если он у машины есть).
+    ValueError, если изменение не к чему привязать или номер машины повторяется.
+    """
+    result = []
+    for section, items in (('warehouses', warehouses), ('enterprises', enterprises)):
+        updated = {item['id']: item for item in items}
+        for change in changes.get(section) or []:
+            if not isinstance(change, dict) or 'id' not in change:
+                raise ValueError(f"changes.{section}: у каждого изменения должен быть id")
+            if change.get('removed'):
+                updated.pop(change['id'], None)
+            else:
+                updated[change['id']] = {**updated.get(change['id'], {}), **change}
+        result.append(list(updated.values()))
+    return result[0], result[1], _merge_vehicles(vehicles, changes.get('vehicles') or [])
+
+
+def _merge_vehicles(vehicles: List[Dict], changes: List[Any]) -> List[Dict]:
+    """Машины по номеру с применёнными изменениями (см. merge_changes)"""
+    updated: Dict[str, Dict] = {}
+    for vehicle in vehicles:
+        number = vehicle_number(vehicle)
+        if number in updated:
+            raise ValueError(f"vehicles: номер {number} повторяется")
+        updated[number] = vehicle
+    by_id = {vehicle['id']: number for number, vehicle in updated.items() if vehicle.get('id') is not None}
+
+    for change in changes:
+        if not isinstance(change, dict):
+            raise ValueError("changes.vehicles: ожидается объект")
+        number = by_id.get(change.get('id'))
+        if number is None:
+            if not (change.get('licensePlate') or change.get('number')):
+                raise ValueError("changes.vehicles: у каждого изменения должен быть номер машины или её id")
+            number = vehicle_number(change)
+        if change.get('removed'):
+            updated.pop(number, None)
+        else:
+            updated[number] = {**updated.get(number, {}), **change}
+    return list(updated.values())
+
+
+def _changed_nodes(old: List[Dict], new: List[Dict], volumes: str) -> Tuple[Set[str], Dict[str, Set[str]]]:
+    """Названия изменившихся точек и товары (нормализованные), которых изменения касаются, по точкам"""
+    old_by_id = {node['id']: node for node in old}
+    new_by_id = {node['id']: node for node in new}
+    names: Set[str] = set()
+    products: Dict[str, Set[str]] = {}
+    for node_id in old_by_id.keys() | new_by_id.keys():
+        before, after = old_by_id.get(node_id), new_by_id.get(node_id)
+        if before == after:
+            continue
+        before_volumes = before[volumes] if before else {}
+        after_volumes = after[volumes] if after else {}
+        moved = not before or not after or any(before[k] != after[k] for k in NODE_FIELDS)
+        touched = {
+            normalize_product(name) for name in before_volumes.keys() | after_volumes.keys()
+            if moved or before_volumes.get(name) != after_volumes.get(name)
+        }
+        for node in (before, after):
+            if node:
+                names.add(node['name'])
+                products.setdefault(node['name'], set()).update(touched)
+    return names, products
+
+
+def affected_vehicles(old: Dict[str, Any], new: Dict[str, Any], routes: List[Dict]) -> Set[str]:
+    """
+    Номера машин, чьи цепочки рейсов нужно перестроить:
+    изменённые и новые машины, машины без рейсов, машины, которые заезжают в изменившиеся точки
+    (или стоят на них), а если изменилась точка, куда не заезжает никто, — все машины,
+    которые могут везти затронутые товары. Груз удалённой или выведенной из работы машины
+    остаётся невывезенным, поэтому перестраиваются все машины, которые могут везти её товары.
+    """
+    old_vehicles = {v['number']: v for v in old['vehicles']}
+    new_vehicles = {v['number']: v for v in new['vehicles']}
+
+    visited: Dict[str, Set[str]] = {number: {v.get('enterprise')} for number, v in new_vehicles.items()}
+    for route in routes:
+        if route['vehicle'] in visited:
+            visited[route['vehicle']].update((route['from'], route['to']))
+
+    planned = {route['vehicle'] for route in routes}
+    affected = {number for number, v in new_vehicles.items() if old_vehicles.get(number) != v or number not in planned}
+
+    dropped_products: Set[str] = set()
+    for number, v in old_vehicles.items():
+        if number not in new_vehicles:
+            dropped_products.update(normalize_product(p) for p in v['productTypes'])
+    if dropped_products:
+        affected.update(
+            number for number, v in new_vehicles.items()
+            if dropped_products & {normalize_product(p) for p in v['productTypes']}
+        )
+
+    warehouse_names, warehouse_products = _changed_nodes(old['warehouses'], new['warehouses'], 'stocks')
+    enterprise_names, enterprise_products = _changed_nodes(old['enterprises'], new['enterprises'], 'needs')
+    changed = warehouse_names | enterprise_names
+    if not changed:
+        return affected
+
+    all_visited: Set[str] = set()
+    for number, names in visited.items():
+        all_visited |= names
+        if names & changed:
+            affected.add(number)
+
+    unvisited_products: Set[str] = set()
+    for name, products in list(warehouse_products.items()) + list(enterprise_products.items()):
+        if name not in all_visited:
+            unvisited_products |= products
+    if unvisited_products:
+        affected.update(
+            number for number, v in new_vehicles.items()
+            if unvisited_products & {normalize_product(p) for p in v['productTypes']}
+        )
+    return affected
@@ -0,0 +1,355 @@
+"""
+Событийный планировщик парка.
+Все машины выезжают со своих стоянок одновременно; очередной рейс выбирает та машина,
+которая освобождается раньше остальных (куча по времени освобождения).
+Время рейса — пробег / средняя скорость + погрузка и выгрузка.
+Так работа делится между машинами по мере их освобождения, а не «первая машина забирает всё ближнее».
+Если основной товар не заполняет кузов, машина догружается другими своими товарами с того же склада
+и остатками склада по пути (см. pack_load) и развозит их — до MAX_DROPS точек выгрузки за рейс.
+"""
+import heapq
+import time
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from diagnostics import log, DEBUG
+from model import Problem, CompiledVehicle, RouteRecord, CHIPS_SOURCE_NAME
+from trip_index import TripIndex
+
+AVERAGE_SPEED_KMH = 50.0
+HANDLING_HOURS = 0.5  # погрузка + выгрузка за рейс
+# Сколько предприятий может объехать машина за рейс с догрузкой
+MAX_DROPS = 3
+# Свободное место меньше этого (м³) не догружаем
+MIN_FREE_VOLUME = 1e-6
+# Сколько ближайших к предприятию складов смотреть в поисках догрузки по пути
+MAX_PICKUP_SCAN = 32
+
+# (склад, товар, предприятие, объём, расстояние до склада, расстояние доставки)
+Trip = Tuple[int, int, int, float, float, float]
+# (склад, товар, объём) — что погружено
+Load = Tuple[int, int, float]
+# (предприятие, [погрузки]) — точка выгрузки рейса
+Drop = Tuple[int, List[Load]]
+
+
+class FleetState:
+    """
+    Состояние машин по порядковым номерам в problem.vehicles:
+    текущая точка (предприятие), время освобождения (ч), пробег (км), число рейсов
+    и время, потраченное на планирование рейсов машины (с)
+    """
+    __slots__ = ('position', 'clock', 'mileage', 'trips', 'planning')
+
+    def __init__(self, vehicles: List[CompiledVehicle]):
+        count = len(vehicles)
+        self.position = array('i', (v.parking for v in vehicles))
+        self.clock = array('d', bytes(8 * count))
+        self.mileage = array('d', bytes(8 * count))
+        self.trips = array('i', bytes(4 * count))
+        self.planning = array('d', bytes(8 * count))
+
+    def makespan(self) -> float:
+        return max(self.clock, default=0.0)
+
+
+def find_best_trip(
+    current_index: int,
+    vehicle: CompiledVehicle,
+    problem: Problem,
+    trip_index: TripIndex
+) -> Optional[Trip]:
+    """
+    Находит лучший рейс: ближайший склад с товаром → ближайшее предприятие, которому этот товар нужен
+    (если товар уже никому не нужен — ближайшее предприятие, чтобы склад всё равно был вывезен).
+    current_index — порядковый номер текущего предприятия.
+    Возвращает: (склад, товар, предприятие, объём, расстояние до склада, расстояние доставки)
+    """
+    candidate = trip_index.best_candidate(current_index, vehicle.product_ids)
+    if candidate is None:
+        return None
+
+    warehouse_index, product_id, enterprise_index, distance_to_warehouse, distance_delivery = candidate
+    volume = min(vehicle.capacity, problem.stock_volume(warehouse_index, product_id))
+
+    return warehouse_index, product_id, enterprise_index, volume, distance_to_warehouse, distance_delivery
+
+
+def carries_chips(vehicle: CompiledVehicle, problem: Problem) -> bool:
+    """Универсал, который после выгрузки на Заводе везёт щепу на Павловский ДОК"""
+    return vehicle.is_universal and problem.chips_target is not None and vehicle.can_carry(problem.chips_product)
+
+
+def pack_load(trip: Trip, vehicle: CompiledVehicle, problem: Problem, trip_index: TripIndex) -> Tuple[List[int], List[Drop]]:
+    """
+    Загрузка машины на рейс: основной товар рейса, затем свободное место догружается.
+    1. Другими товарами, которые машина может везти, с того же склада. Объёмы делимы, поэтому
+       упаковка жадная: сначала товары, нужные тому же предприятию (лишней точки нет), затем —
+       с ближайшим заездом к предприятию, которому товар нужен; при равном заезде — больший остаток.
+       Заезд берётся, только если он не длиннее отдельного рейса со склада к тому же предприятию.
+    2. Если место осталось — товарами ещё одного склада по пути к первому предприятию,
+       если крюк короче отдельной доставки с этого склада (см. find_pickup).
+    Догружается не больше, чем нужно предприятию: лишнее не закрыло бы ничью потребность.
+    Универсал, везущий щепу (carries_chips), выгружается на Заводе последним: щепу грузят в пустой кузов.
+    Поэтому у рейса на Завод других точек выгрузки нет, а Завод среди догрузки объезжается в конце.
+    Возвращает: склады догрузки по пути и точки выгрузки в порядке объезда
+    (первая — предприятие основного товара).
+    """
+    warehouse_index, product_id, enterprise_index, volume, _, distance_delivery = trip
+    free = vehicle.capacity - volume
+    drops: Dict[int, List[Load]] = {enterprise_index: [(warehouse_index, product_id, volume)]}
+    pickups: List[int] = []
+    if free <= MIN_FREE_VOLUME:
+        return pickups, list(drops.items())
+
+    P = problem.product_count
+    between = trip_index.distances.between
+    enterprises = problem.enterprises
+    chips_last = carries_chips(vehicle, problem)
+    single_drop = chips_last and enterprises[enterprise_index]['name'] == CHIPS_SOURCE_NAME
+    candidates: List[Tuple[float, float, int, int]] = []
+    for other in vehicle.product_ids:
+        available = problem.stock_volume(warehouse_index, other) if other != product_id else 0.0
+        if available <= 0:
+            continue
+        need = problem.need_volume(enterprise_index, other)
+        if need > 0:
+            candidates.append((0.0, -min(available, need), other, enterprise_index))
+            continue
+        target = trip_index.best_enterprise[warehouse_index * P + other]
+        if target < 0:
+            continue
+        detour = between(enterprise_index, target)
+        if detour <= trip_index.delivery_distance[warehouse_index * P + other]:
+            # Товар нужен target — везём не больше потребности; не нужен никому — сколько есть
+            need = problem.need_volume(target, other)
+            candidates.append((detour, -(min(available, need) if need > 0 else available), other, target))
+
+    for _, wanted, other, target in sorted(candidates):
+        if free <= MIN_FREE_VOLUME:
+            break
+        if target not in drops and (single_drop or len(drops) >= MAX_DROPS):
+            continue
+        load = min(free, -wanted)
+        drops.setdefault(target, []).append((warehouse_index, other, load))
+        free -= load
+
+    if free > MIN_FREE_VOLUME:
+        pickup = find_pickup(warehouse_index, enterprise_index, distance_delivery, free, vehicle, problem, trip_index)
+        if pickup is not None:
+            pickup_index, loads = pickup
+            pickups.append(pickup_index)
+            drops[enterprise_index].extend(loads)
+
+    # Объезд дополнительных точек — каждый раз в ближайшую из оставшихся (Завод универсала — в конце)
+    route = [(enterprise_index, drops.pop(enterprise_index))]
+    while drops:
+        nearest = min(drops, key=lambda e: (
+            chips_last and enterprises[e]['name'] == CHIPS_SOURCE_NAME, between(route[-1][0], e), e
+        ))
+        route.append((nearest, drops.pop(nearest)))
+    return pickups, route
+
+
+def find_pickup(
+    warehouse_index: int,
+    enterprise_index: int,
+    distance_delivery: float,
+    free: float,
+    vehicle: CompiledVehicle,
+    problem: Problem,
+    trip_index: TripIndex
+) -> Optional[Tuple[int, List[Load]]]:
+    """
+    Склад по пути склад → предприятие, с которого можно догрузить товары, нужные предприятию.
+    Склады смотрятся по близости к предприятию: крюк через склад w2 не меньше 2 × (d(w2, e) − d(w, e)),
+    а окупается, только если не длиннее доставки d(w2, e), поэтому дальше 2 × d(w, e) искать незачем.
+    Товары склада укладываются по убыванию объёма (как «наибольший первым» в упаковке по контейнерам);
+    берётся склад, который заполнит кузов больше всех, при равенстве — с меньшим крюком.
+    """
+    P = problem.product_count
+    offset = trip_index.offset
+    best: Optional[Tuple[float, float, int, List[Load]]] = None
+    for scanned, (other_warehouse, to_enterprise) in enumerate(trip_index.warehouses_near(enterprise_index)):
+        if scanned >= MAX_PICKUP_SCAN or to_enterprise > 2 * distance_delivery:
+            break
+        if other_warehouse == warehouse_index:
+            continue
+        fitting = []
+        for other in vehicle.product_ids:
+            wanted = min(problem.stock_volume(other_warehouse, other), problem.need_volume(enterprise_index, other))
+            if wanted > 0:
+                fitting.append((wanted, other))
+        if not fitting:
+            continue
+        loads: List[Load] = []
+        room = free
+        for wanted, other in sorted(fitting, reverse=True):
+            if room <= MIN_FREE_VOLUME:
+                break
+            load = min(wanted, room)
+            loads.append((other_warehouse, other, load))
+            room -= load
+        # Крюк не меньше нижней оценки: точное расстояние склад → склад считаем, только если склад может победить
+        if best is not None and (room, max(0.0, 2 * (to_enterprise - distance_delivery))) >= best[:2]:
+            continue
+        detour = trip_index.distances.pair(offset + warehouse_index, offset + other_warehouse) + to_enterprise - distance_delivery
+        if detour > min(trip_index.delivery_distance[other_warehouse * P + other] for _, other, _ in loads):
+            continue
+        if best is None or (room, detour) < best[:2]:
+            best = (room, detour, other_warehouse, loads)
+    return (best[2], best[3]) if best else None
+
+
+def plan_trip(
+    current_index: int,
+    vehicle: CompiledVehicle,
+    problem: Problem,
+    trip_index: TripIndex
+) -> Optional[Tuple[List[RouteRecord], int, float]]:
+    """
+    Один рейс машины из текущего предприятия: склад (→ склад догрузки) → предприятие
+    (→ следующие предприятия, если машина догружена другими товарами), для универсала на Заводе —
+    ещё щепа на Павловский ДОК. Списывает остатки и потребности.
+    Возвращает: (записи рейса, новая позиция, пробег) или None, если подходящих рейсов нет.
+    """
+    best_trip = find_best_trip(current_index, vehicle, problem, trip_index)
+    if not best_trip:
+        return None
+
+    warehouse_index, _, _, _, distance_to_warehouse, distance_delivery = best_trip
+    warehouses = problem.warehouses
+    warehouse = warehouses[warehouse_index]
+    pickups, drops = pack_load(best_trip, vehicle, problem, trip_index)
+    packed = len(drops) > 1 or len(drops[0][1]) > 1
+    offset = trip_index.offset
+    between = trip_index.distances.between
+
+    # Основной маршрут: текущая позиция → склад (→ склад догрузки) → предприятие; следующие точки — от предыдущей
+    records: List[RouteRecord] = []
+    origin, previous = warehouse, None
+    mileage = distance_to_warehouse
+    for enterprise_index, loads in drops:
+        enterprise = problem.enterprises[enterprise_index]
+        if previous is not None:
+            distance, parking_distance, source = between(previous, enterprise_index), 0, -1
+        elif pickups:
+            stops = [offset + warehouse_index] + [offset + w for w in pickups]
+            distance = sum(trip_index.distances.pair(a, b) for a, b in zip(stops, stops[1:]))
+            distance = round(distance + between(stops[-1], enterprise_index), 2)
+            parking_distance, source = distance_to_warehouse, warehouse_index
+        else:
+            distance, parking_distance, source = distance_delivery, distance_to_warehouse, warehouse_index
+        names = [problem.stock_name(w, other) for w, other, _ in loads]
+        record = RouteRecord(
+            vehicle.number, vehicle.vehicle_type, ', '.join(dict.fromkeys(names)), sum(load for _, _, load in loads),
+            origin['name'], origin['lat'], origin['lng'],
+            enterprise['name'], enterprise['lat'], enterprise['lng'],
+            distance, parking_distance,
+            vehicle.ordinal, source, enterprise_index, loads[0][1]
+        )
+        if packed:
+            record.items = [
+                (other, name, load, warehouses[w]['name']) for (w, other, load), name in zip(loads, names)
+            ]
+        if previous is None and pickups:
+            record.via = [(warehouses[w]['name'], warehouses[w]['lat'], warehouses[w]['lng']) for w in pickups]
+        records.append(record)
+        for w, other, load in loads:
+            trip_index.consume_stock(w, other, load)
+            trip_index.deliver(enterprise_index, other, load)
+        origin, previous = enterprise, enterprise_index
+        mileage += distance
+
+    position = enterprise_index
+
+    # Универсал на Заводе: загружаем щепой и везём на Павловский ДОК.
+    # Если Завод среди точек рейса, pack_load ставит его последним — достаточно проверить последнюю точку
+    dok_index = problem.chips_target
+    if enterprise['name'] == CHIPS_SOURCE_NAME and carries_chips(vehicle, problem):
+        dok_enterprise = problem.enterprises[dok_index]
+        chips_distance = trip_index.distances.between(enterprise_index, dok_index)
+        records.append(RouteRecord(
+            vehicle.number, vehicle.vehicle_type, 'Щепа', vehicle.capacity,
+            CHIPS_SOURCE_NAME, enterprise['lat'], enterprise['lng'],
+            dok_enterprise['name'], dok_enterprise['lat'], dok_enterprise['lng'],
+            chips_distance, 0,
+            vehicle.ordinal, -1, dok_index, problem.chips_product
+        ))
+        position = dok_index
+        mileage += chips_distance
+
+    return records, position, mileage
+
+
+def iter_fleet_trips(
+    problem: Problem,
+    trip_index: TripIndex,
+    state: FleetState,
+    max_trips_per_vehicle: int = 1000,
+    speed_kmh: float = AVERAGE_SPEED_KMH,
+    handling_hours: float = HANDLING_HOURS
+) -> Iterator[Tuple[int, List[RouteRecord]]]:
+    """
+    Раздача рейсов по событиям: из кучи берётся машина с наименьшим временем освобождения,
+    ей планируется один рейс из её текущей точки, и она возвращается в кучу с новым временем.
+    Машина выбывает, когда для неё нет рейсов или исчерпан лимит.
+    При равном времени первой выбирает машина, идущая раньше в problem.vehicles (большая грузоподъёмность).
+    Рейсы отдаются сразу, как только спланированы: (номер машины в problem.vehicles, записи рейса).
+    """
+    vehicles = problem.vehicles
+    queue: List[Tuple[float, int]] = []
+    for k, vehicle in enumerate(vehicles):
+        if vehicle.capacity <= 0:
+            log.warning('Не указана грузоподъёмность', vehicle=vehicle.number)
+            continue
+        queue.append((state.clock[k], k))
+    heapq.heapify(queue)
+
+    perf_counter = time.perf_counter
+    while queue:
+        clock, k = heapq.heappop(queue)
+        vehicle = vehicles[k]
+        started = perf_counter()
+        planned = plan_trip(state.position[k], vehicle, problem, trip_index)
+        state.planning[k] += perf_counter() - started
+        if planned is None:
+            log.debug('Больше нет подходящих рейсов', vehicle=vehicle.number, trips=state.trips[k])
+            continue
+
+        trip_records, position, mileage = planned
+        state.position[k] = position
+        state.mileage[k] += mileage
+        state.clock[k] = clock + mileage / speed_kmh + handling_hours * len(trip_records)
+        state.trips[k] += 1
+        if state.trips[k] < max_trips_per_vehicle:
+            heapq.heappush(queue, (state.clock[k], k))
+        yield k, trip_records
+
+
+def schedule_fleet(
+    problem: Problem,
+    trip_index: TripIndex,
+    max_trips_per_vehicle: int = 1000,
+    speed_kmh: float = AVERAGE_SPEED_KMH,
+    handling_hours: float = HANDLING_HOURS
+) -> Tuple[List[RouteRecord], FleetState]:
+    """Весь план событийного планировщика; маршруты сгруппированы по машинам"""
+    vehicles = problem.vehicles
+    state = FleetState(vehicles)
+    records: List[List[RouteRecord]] = [[] for _ in vehicles]
+
+    for k, trip_records in iter_fleet_trips(
+        problem, trip_index, state, max_trips_per_vehicle, speed_kmh, handling_hours
+    ):
+        records[k].extend(trip_records)
+
+    result: List[RouteRecord] = []
+    verbose = log.enabled(DEBUG)
+    for k, vehicle in enumerate(vehicles):
+        result.extend(records[k])
+        if verbose and records[k]:
+            log.debug('Рейсы машины', vehicle=vehicle.number, trips=state.trips[k],
+                      mileage_km=round(state.mileage[k], 1), busy_hours=round(state.clock[k], 1))
+    log.info('Все рейсы спланированы', makespan_hours=round(state.makespan(), 1))
+    return result, state
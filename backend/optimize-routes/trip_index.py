@@ -0,0 +1,223 @@
+"""
+Индекс кандидатов для поиска рейса.
+По каждому товару хранит склады, где он ещё есть, и предприятия, которым он ещё нужен,
+а также лучшее предприятие доставки для каждой пары (склад, товар).
+Индекс обновляется по мере вывоза и доставки, поэтому поиск рейса не перебирает
+все склады × товары × предприятия.
+"""
+import heapq
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple, Set, Iterable
+
+from distances import DistanceMatrix
+from model import Problem
+
+# (склад, товар, предприятие, расстояние до склада, расстояние доставки)
+Candidate = Tuple[int, int, int, float, float]
+
+
+class TripIndex:
+    """
+    Склады и предприятия — порядковые номера из Problem, товары — id товаров.
+    Остатки и потребности меняются только через consume_stock/deliver,
+    которые обновляют и массивы Problem.stock/Problem.need.
+    searches и scanned — число поисков рейса и просмотренных в них складов (для диагностики).
+    """
+
+    def __init__(self, problem: Problem, distances: DistanceMatrix):
+        self.problem = problem
+        self.distances = distances
+        self.offset = distances.enterprise_count  # индекс склада w в матрице = offset + w
+        self.searches = 0
+        self.scanned = 0
+
+        P = problem.product_count
+        W = len(problem.warehouses)
+        E = len(problem.enterprises)
+
+        # товар → склады с остатком / предприятия с потребностью
+        self.stock_warehouses: List[Set[int]] = [set() for _ in range(P)]
+        self.need_enterprises: List[Set[int]] = [set() for _ in range(P)]
+        self.warehouse_products = array('i', bytes(4 * W))  # сколько товаров ещё лежит на складе
+        for w in range(W):
+            for p in range(P):
+                if problem.stock[w * P + p] > 0:
+                    self.stock_warehouses[p].add(w)
+                    self.warehouse_products[w] += 1
+        for e in range(E):
+            for p in range(P):
+                if problem.need[e * P + p] > 0:
+                    self.need_enterprises[p].add(e)
+
+        # Порядок обхода по расстоянию строится лениво, один раз на точку
+        self._enterprises_by_distance: Dict[int, List[int]] = {}
+        self._warehouses_by_distance: Dict[int, List[int]] = {}
+
+        # [w * P + p] → лучшее предприятие и расстояние доставки до него
+        self.best_enterprise = array('i', [-1]) * (W * P)
+        self.delivery_distance = array('d', bytes(8 * W * P))
+        # e * P + p → склады, для которых предприятие сейчас лучшее
+        self._dependents: Dict[int, Set[int]] = {}
+        # товар → куча (расстояние доставки, склад) для нижней оценки рейса
+        self._delivery_heaps: List[List[Tuple[float, int]]] = [[] for _ in range(P)]
+
+        for p, warehouses in enumerate(self.stock_warehouses):
+            heap = self._delivery_heaps[p]
+            for w in warehouses:
+                self._assign_enterprise(w, p)
+                heap.append((self.delivery_distance[w * P + p], w))
+            heapq.heapify(heap)
+
+    def _enterprise_order(self, w: int) -> List[int]:
+        order = self._enterprises_by_distance.get(w)
+        if order is None:
+            source = self.offset + w
+            between = self.distances.between
+            order = sorted(range(len(self.problem.enterprises)), key=lambda e: (between(source, e), e))
+            self._enterprises_by_distance[w] = order
+        return order
+
+    def _warehouse_order(self, e: int) -> List[int]:
+        order = self._warehouses_by_distance.get(e)
+        if order is None:
+            row = self.distances.row(e)
+            offset = self.offset
+            order = sorted(range(len(self.problem.warehouses)), key=lambda w: (row[offset + w], w))
+            self._warehouses_by_distance[e] = order
+        return order
+
+    def _assign_enterprise(self, w: int, p: int) -> None:
+        """
+        Лучшее предприятие для (склад, товар): ближайшее из тех, кому товар ещё нужен.
+        Если товар не нужен никому — ближайшее предприятие (склад всё равно вывозим полностью).
+        """
+        order = self._enterprise_order(w)
+        if not order:
+            return
+        P = self.problem.product_count
+        needing = self.need_enterprises[p]
+        chosen = order[0]
+        if needing:
+            chosen = next((e for e in order if e in needing), chosen)
+            self._dependents.setdefault(chosen * P + p, set()).add(w)
+        self.best_enterprise[w * P + p] = chosen
+        self.delivery_distance[w * P + p] = self.distances.between(self.offset + w, chosen)
+
+    def _reassign(self, warehouses: Iterable[int], p: int) -> None:
+        P = self.problem.product_count
+        stock = self.stock_warehouses[p]
+        heap = self._delivery_heaps[p]
+        for w in warehouses:
+            if w not in stock:
+                continue
+            self._assign_enterprise(w, p)
+            heapq.heappush(heap, (self.delivery_distance[w * P + p], w))
+
+    def _lower_bound(self, p: int) -> float:
+        """Минимальное расстояние доставки по товару (устаревшие записи кучи выбрасываются)"""
+        P = self.problem.product_count
+        heap = self._delivery_heaps[p]
+        stock = self.stock_warehouses[p]
+        while heap:
+            distance, w = heap[0]
+            if w in stock and self.delivery_distance[w * P + p] == distance:
+                return distance
+            heapq.heappop(heap)
+        return float('inf')
+
+    def has_stock(self, product_ids: Iterable[int]) -> bool:
+        return any(self.stock_warehouses[p] for p in product_ids)
+
+    def best_candidate(self, current: int, product_ids: Iterable[int]) -> Optional[Candidate]:
+        """
+        Лучший рейс из текущего предприятия для заданных товаров.
+        Склады обходятся по возрастанию расстояния от текущей точки; обход прекращается,
+        как только расстояние до склада плюс минимальная доставка не может улучшить найденное.
+        """
+        self.searches += 1
+        products = [p for p in product_ids if self.stock_warehouses[p]]
+        if not products:
+            return None
+
+        lower_bound = min(self._lower_bound(p) for p in products)
+        if lower_bound == float('inf'):
+            return None
+
+        P = self.problem.product_count
+        row = self.distances.row(current)
+        offset = self.offset
+        stock_warehouses = self.stock_warehouses
+        delivery_distance = self.delivery_distance
+        order = self._warehouse_order(current)
+        best: Optional[Candidate] = None
+        best_total = float('inf')
+        dead = 0
+        scanned = 0
+
+        for w in order:
+            scanned += 1
+            distance_to_warehouse = row[offset + w]
+            if distance_to_warehouse + lower_bound >= best_total:
+                break
+            if not self.warehouse_products[w]:
+                dead += 1
+                continue
+            for p in products:
+                if w not in stock_warehouses[p]:
+                    continue
+                total = distance_to_warehouse + delivery_distance[w * P + p]
+                if total < best_total:
+                    best_total = total
+                    best = (w, p, self.best_enterprise[w * P + p], distance_to_warehouse, delivery_distance[w * P + p])
+
+        self.scanned += scanned
+
+        # Опустевшие склады убираем из порядка обхода, когда их становится много
+        if dead * 2 > len(order):
+            self._warehouses_by_distance[current] = [w for w in order if self.warehouse_products[w]]
+
+        return best
+
+    def warehouses_near(self, e: int) -> Iterator[Tuple[int, float]]:
+        """Склады, где ещё что-то лежит, по возрастанию расстояния до предприятия e: (склад, расстояние)"""
+        row = self.distances.row(e)
+        offset = self.offset
+        for w in self._warehouse_order(e):
+            if self.warehouse_products[w]:
+                yield w, row[offset + w]
+
+    def consume_stock(self, w: int, p: int, volume: float) -> None:
+        """Списывает вывезенный объём со склада"""
+        P = self.problem.product_count
+        stock = self.problem.stock
+        stock[w * P + p] -= volume
+        if stock[w * P + p] > 0:
+            return
+        stock[w * P + p] = 0.0
+        self.stock_warehouses[p].discard(w)
+        self.warehouse_products[w] -= 1
+        chosen = self.best_enterprise[w * P + p]
+        if chosen >= 0:
+            self._dependents.get(chosen * P + p, set()).discard(w)
+        self.best_enterprise[w * P + p] = -1
+
+    def deliver(self, e: int, p: int, volume: float) -> None:
+        """Уменьшает потребность предприятия; закрытая потребность перестраивает зависящие склады"""
+        P = self.problem.product_count
+        need = self.problem.need
+        if need[e * P + p] <= 0:
+            return
+        need[e * P + p] -= volume
+        if need[e * P + p] > 0:
+            return
+
+        need[e * P + p] = 0.0
+        needing = self.need_enterprises[p]
+        needing.discard(e)
+        if needing:
+            self._reassign(self._dependents.pop(e * P + p, set()), p)
+        else:
+            # Товар больше никому не нужен: все склады с ним переходят на ближайшее предприятие
+            for key in [k for k in self._dependents if k % P == p]:
+                del self._dependents[key]
+            self._reassign(list(self.stock_warehouses[p]), p)
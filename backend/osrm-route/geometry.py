@@ -0,0 +1,151 @@
+'''
+Геометрия маршрута для ответа: упрощение и кодирование.
+Внутри (и в кэше) линия хранится столбцами lats / lngs: из GeoJSON OSRM ([lng, lat])
+их даёт одно транспонирование zip(*...), без построения пар на каждую точку.
+Упрощение — Дуглас–Пекер в метрах (равнопромежуточная проекция около линии) с допуском
+в полпикселя на заданном масштабе карты: на этом масштабе отличие от полной линии не видно.
+Перед ним — отбрасывание точек ближе допуска к предыдущей оставленной (дешёвый проход,
+который убирает большую часть точек на длинных прямых).
+Кодирование — Google Encoded Polyline с точностью 5 или 6 знаков.
+'''
+from math import cos, radians
+from typing import List, Sequence, Tuple
+
+EARTH_RADIUS_M = 6371008.8
+# Метров в пикселе на экваторе при масштабе 0 (тайлы 256 px)
+METERS_PER_PIXEL_Z0 = 156543.03392
+SIMPLIFY_PIXELS = 0.5
+MAX_ZOOM = 22
+
+
+def columns_from_geojson(coordinates: Sequence[Sequence[float]]) -> Tuple[List[float], List[float]]:
+    '''[[lng, lat], ...] → (lats, lngs) одним проходом'''
+    if not coordinates:
+        return [], []
+    lngs, lats = zip(*coordinates)
+    return list(lats), list(lngs)
+
+
+def columns_from_pairs(coordinates: Sequence[Sequence[float]]) -> Tuple[List[float], List[float]]:
+    '''[[lat, lng], ...] → (lats, lngs): так хранились маршруты в кэше раньше'''
+    if not coordinates:
+        return [], []
+    lats, lngs = zip(*coordinates)
+    return list(lats), list(lngs)
+
+
+def pairs(lats: Sequence[float], lngs: Sequence[float]) -> List[List[float]]:
+    '''Столбцы → [[lat, lng], ...] (формат coordinates для Leaflet)'''
+    return list(map(list, zip(lats, lngs)))
+
+
+def tolerance_for_zoom(zoom: float, latitude: float) -> float:
+    '''Допуск упрощения (м): полпикселя на масштабе zoom на широте latitude'''
+    return SIMPLIFY_PIXELS * METERS_PER_PIXEL_Z0 * cos(radians(latitude)) / 2 ** zoom
+
+
+def simplify(lats: Sequence[float], lngs: Sequence[float], tolerance: float) -> Tuple[List[float], List[float]]:
+    '''Упрощённая линия: ни одна выброшенная точка не дальше tolerance метров от результата'''
+    count = len(lats)
+    if count <= 2 or tolerance <= 0:
+        return list(lats), list(lngs)
+
+    # Проекция в метры около средней широты линии
+    scale_y = radians(1) * EARTH_RADIUS_M
+    scale_x = scale_y * cos(radians((min(lats) + max(lats)) / 2))
+    xs = [lng * scale_x for lng in lngs]
+    ys = [lat * scale_y for lat in lats]
+    tolerance_sq = tolerance * tolerance
+
+    # Радиальный проход: точки ближе допуска к последней оставленной не меняют картину
+    kept = [0]
+    last_x, last_y = xs[0], ys[0]
+    for i in range(1, count - 1):
+        dx = xs[i] - last_x
+        dy = ys[i] - last_y
+        if dx * dx + dy * dy > tolerance_sq:
+            kept.append(i)
+            last_x, last_y = xs[i], ys[i]
+    kept.append(count - 1)
+
+    # Дуглас–Пекер по оставшимся точкам, без рекурсии
+    size = len(kept)
+    marked = bytearray(size)
+    marked[0] = marked[size - 1] = 1
+    stack = [(0, size - 1)]
+    while stack:
+        first, last = stack.pop()
+        ax, ay = xs[kept[first]], ys[kept[first]]
+        bx, by = xs[kept[last]], ys[kept[last]]
+        dx, dy = bx - ax, by - ay
+        length_sq = dx * dx + dy * dy
+        farthest = -1
+        farthest_sq = tolerance_sq
+        for k in range(first + 1, last):
+            i = kept[k]
+            px, py = xs[i] - ax, ys[i] - ay
+            if length_sq > 0:
+                t = (px * dx + py * dy) / length_sq
+                if t < 0:
+                    t = 0.0
+                elif t > 1:
+                    t = 1.0
+                px -= t * dx
+                py -= t * dy
+            distance_sq = px * px + py * py
+            if distance_sq > farthest_sq:
+                farthest, farthest_sq = k, distance_sq
+        if farthest >= 0:
+            marked[farthest] = 1
+            if farthest - first > 1:
+                stack.append((first, farthest))
+            if last - farthest > 1:
+                stack.append((farthest, last))
+
+    indices = [kept[k] for k in range(size) if marked[k]]
+    return [lats[i] for i in indices], [lngs[i] for i in indices]
+
+
+def encode_polyline(lats: Sequence[float], lngs: Sequence[float], precision: int = 5) -> str:
+    '''Google Encoded Polyline: разности целых координат × 10^precision, по 5 бит на символ'''
+    factor = 10 ** precision
+    chunks: List[str] = []
+    append = chunks.append
+    previous_lat = previous_lng = 0
+    for lat, lng in zip(lats, lngs):
+        current_lat = int(round(lat * factor))
+        current_lng = int(round(lng * factor))
+        for delta in (current_lat - previous_lat, current_lng - previous_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            append(chr(value + 63))
+        previous_lat, previous_lng = current_lat, current_lng
+    return ''.join(chunks)
+
+
+def decode_polyline(encoded: str, precision: int = 5) -> Tuple[List[float], List[float]]:
+    '''Обратное к encode_polyline (для проверки и бенчмарков)'''
+    factor = 10 ** precision
+    lats: List[float] = []
+    lngs: List[float] = []
+    index = lat = lng = 0
+    length = len(encoded)
+    while index < length:
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(encoded[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        lats.append(lat / factor)
+        lngs.append(lng / factor)
+    return lats, lngs
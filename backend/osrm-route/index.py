@@ -1,12 +1,53 @@
-import json
-import urllib.request
-from typing import Dict, Any
+import os
+from math import atan2, cos, radians, sin, sqrt
+from typing import Dict, Any, Optional, Tuple
+
+from codec import compress_response, dumps, loads
+from geometry import (
+    columns_from_geojson, columns_from_pairs, encode_polyline, pairs, simplify, tolerance_for_zoom, MAX_ZOOM
+)
+from road_graph import load_from_env
+from route_cache import cache_from_env
+from upstream import BreakerOpen, client_from_env
+
+DEFAULT_OSRM_URL = 'https://router.project-osrm.org/route/v1/driving'
+MAX_BATCH_LEGS = 2000
+MAX_CONCURRENT_FETCHES = 8
+# Формат геометрии в ответе → точность кодирования (None — массив [lat, lng])
+GEOMETRY_FORMATS = {'coordinates': None, 'polyline': 5, 'polyline6': 6}
+
+Leg = Tuple[float, float, float, float]
+# (формат геометрии, масштаб карты, допуск упрощения в метрах)
+GeometryOptions = Tuple[str, Optional[float], Optional[float]]
+DEFAULT_GEOMETRY: GeometryOptions = ('coordinates', None, None)
+# Ключ маршрута по локальному графу среди представлений кэша (см. offline_route)
+LOCAL_ROUTE = 'local'
+
+# Средняя скорость для времени в пути по локальному графу (в графе скоростей нет)
+LOCAL_SPEED_KMH = 50.0
+# ROAD_GRAPH_FIRST=1 — сначала локальный граф, OSRM только там, где граф не нашёл пути
+ROAD_GRAPH_FIRST = os.environ.get('ROAD_GRAPH_FIRST', '') == '1'
+
+# Кэш маршрутов между вызовами (route_cache.py) и клиент OSRM с пулом соединений (upstream.py)
+ROUTE_CACHE = cache_from_env()
+UPSTREAM = client_from_env(DEFAULT_OSRM_URL)
+# Дорожный граф региона (ROAD_GRAPH_PATH, road_graph.py); None — графа нет
+ROAD_GRAPH = load_from_env()
+
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''Точка входа функции: ответ сжимается, если клиент это принимает (codec.py)'''
+    return compress_response(handle_request(event), event)
+
+
+def handle_request(event: Dict[str, Any]) -> Dict[str, Any]:
     '''
-    Прокси для OSRM с fallback на прямые линии
+    Прокси для OSRM с fallback на локальный дорожный граф (если он есть) и на прямые линии
     Принимает: fromLat, fromLng, toLat, toLng
-    Возвращает: координаты маршрута, расстояние, время
+    или пакет: legs — список объектов {fromLat, fromLng, toLat, toLng}
+    Необязательно: zoom — масштаб карты, под который упростить линию (или tolerance в метрах),
+    format — coordinates (по умолчанию), polyline или polyline6 (закодированная линия)
+    Возвращает: координаты маршрута, расстояние, время (для пакета — legs в том же порядке)
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -27,52 +68,262 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Method not allowed'}),
+            'body': dumps({'error': 'Method not allowed'}),
             'isBase64Encoded': False
         }
     
-    body_data = json.loads(event.get('body', '{}'))
-    from_lat = body_data.get('fromLat')
-    from_lng = body_data.get('fromLng')
-    to_lat = body_data.get('toLat')
-    to_lng = body_data.get('toLng')
+    body_data = loads(event.get('body'))
     
-    if not all([from_lat, from_lng, to_lat, to_lng]):
+    try:
+        geometry = parse_geometry_options(body_data)
+    except (ValueError, TypeError) as e:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Missing coordinates'}),
+            'body': dumps({'error': str(e)}),
             'isBase64Encoded': False
         }
     
-    # Пробуем OSRM
-    url = f'https://router.project-osrm.org/route/v1/driving/{from_lng},{from_lat};{to_lng},{to_lat}?overview=full&geometries=geojson'
+    if 'legs' in body_data:
+        return handle_batch(body_data.get('legs'), geometry)
+    
+    leg = parse_leg(body_data)
+    
+    if leg is None:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'error': 'Missing coordinates'}),
+            'isBase64Encoded': False
+        }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps(build_view(leg, geometry)),
+        'isBase64Encoded': False
+    }
+
+
+def handle_batch(legs: Any, geometry: GeometryOptions) -> Dict[str, Any]:
+    '''
+    Пакетный режим: одинаковые отрезки запрашиваются один раз,
+    уникальные — параллельно, с ограниченным числом потоков
+    '''
+    if not isinstance(legs, list) or not legs or len(legs) > MAX_BATCH_LEGS:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': dumps({'error': f'legs: ожидается непустой список до {MAX_BATCH_LEGS} отрезков'}),
+            'isBase64Encoded': False
+        }
+    
+    parsed = [parse_leg(leg) if isinstance(leg, dict) else None for leg in legs]
+    unique = list(dict.fromkeys(leg for leg in parsed if leg is not None))
+    
+    results: Dict[Leg, Dict[str, Any]] = {}
+    if unique:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_FETCHES, len(unique))) as pool:
+            for leg, route in zip(unique, pool.map(lambda leg: build_leg_view(leg, geometry), unique)):
+                results[leg] = route
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dumps({
+            'legs': [results[leg] if leg is not None else {'error': 'Missing coordinates'} for leg in parsed],
+            'total_legs': len(parsed),
+            'unique_legs': len(unique),
+            'cache': ROUTE_CACHE.stats(),
+            'upstream': UPSTREAM.stats()
+        }),
+        'isBase64Encoded': False
+    }
+
+
+def build_leg_view(leg: Leg, geometry: GeometryOptions) -> Dict[str, Any]:
+    '''Маршрут отрезка пакета; ошибка на одном отрезке попадает в его ячейку, а не роняет весь пакет'''
+    try:
+        return build_view(leg, geometry)
+    except Exception as e:
+        print(f'Leg {leg} error: {str(e)}')
+        return {'error': str(e)}
+
+
+def parse_leg(data: Dict[str, Any]) -> Optional[Leg]:
+    '''Координаты отрезка или None, если какая-то из них не задана или не число (0 — обычная координата)'''
+    leg = (data.get('fromLat'), data.get('fromLng'), data.get('toLat'), data.get('toLng'))
+    for value in leg:
+        if value is None or isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+    return leg
+
+
+def parse_geometry_options(data: Dict[str, Any]) -> GeometryOptions:
+    '''Формат и упрощение геометрии из запроса; ValueError, если значения неверные'''
+    output_format = data.get('format') or 'coordinates'
+    if output_format not in GEOMETRY_FORMATS:
+        raise ValueError(f'format: ожидается одно из {", ".join(GEOMETRY_FORMATS)}')
+    
+    zoom = data.get('zoom')
+    if zoom is not None:
+        zoom = float(zoom)
+        if not 0 <= zoom <= MAX_ZOOM:
+            raise ValueError(f'zoom: ожидается число от 0 до {MAX_ZOOM}')
+    
+    tolerance = data.get('tolerance')
+    if tolerance is not None:
+        tolerance = float(tolerance)
+        if tolerance < 0:
+            raise ValueError('tolerance: ожидается неотрицательное число метров')
+    
+    return output_format, zoom, tolerance
+
+
+def render_route(route: Dict[str, Any], geometry: GeometryOptions) -> Dict[str, Any]:
+    '''
+    Маршрут для ответа: линия упрощается под масштаб карты и отдаётся
+    массивом [lat, lng] или закодированной строкой
+    '''
+    output_format, zoom, tolerance = geometry
+    if 'lats' in route:
+        lats, lngs = route['lats'], route['lngs']
+    else:
+        # Запасная линия и записи кэша старого формата: пары [lat, lng]
+        lats, lngs = columns_from_pairs(route.get('coordinates', []))
+    
+    if tolerance is None and zoom is not None and lats:
+        tolerance = tolerance_for_zoom(zoom, lats[0])
+    if tolerance:
+        lats, lngs = simplify(lats, lngs, tolerance)
+    
+    result: Dict[str, Any] = {}
+    precision = GEOMETRY_FORMATS[output_format]
+    if precision is None:
+        result['coordinates'] = pairs(lats, lngs)
+    else:
+        result['polyline'] = encode_polyline(lats, lngs, precision)
+        result['precision'] = precision
+    result.update(distance=route['distance'], duration=route['duration'], fallback=route['fallback'])
+    if 'engine' in route:
+        result['engine'] = route['engine']
+    return result
+
+
+def build_view(leg: Leg, geometry: GeometryOptions) -> Dict[str, Any]:
+    '''
+    Маршрут в запрошенном виде. Упрощённые и закодированные линии по дорогам кэшируются в памяти:
+    карта запрашивает одни и те же отрезки на одном масштабе
+    '''
+    if geometry == DEFAULT_GEOMETRY:
+        return render_route(build_route(leg), geometry)
+    
+    view = ROUTE_CACHE.get_view(leg, geometry)
+    if view is None:
+        view = render_route(build_route(leg), geometry)
+        # Маршрут по графу вместо OSRM нужен, пока OSRM недоступен, — его вид запоминаем ненадолго;
+        # запасную линию не запоминаем вовсе
+        if view.get('engine') == 'local' and not ROAD_GRAPH_FIRST:
+            ROUTE_CACHE.put_view(leg, geometry, view, ttl=ROUTE_CACHE.local_ttl)
+        elif not view['fallback']:
+            ROUTE_CACHE.put_view(leg, geometry, view)
+    return view
+
+
+def build_route(leg: Leg) -> Dict[str, Any]:
+    '''Маршрут по дорогам: из кэша, через OSRM или по локальному графу, если нигде нет — примерный'''
+    cached = ROUTE_CACHE.get(leg)
+    if cached is not None:
+        return offline_route(leg) if cached.get('failed') else cached
+    
+    if ROAD_GRAPH_FIRST:
+        route = local_route(leg)
+        if route is not None:
+            ROUTE_CACHE.put(leg, route)
+            return route
+    
+    # Выключатель разомкнут на всех серверах: не ждём таймаут и не запоминаем отказ — OSRM не спрашивали
+    if not UPSTREAM.available():
+        return offline_route(leg)
+    
+    try:
+        route = fetch_osrm_route(leg)
+    except BreakerOpen:
+        # Пробный запрос после паузы уже занят другим потоком: OSRM не спрашивали — отказ не запоминаем
+        return offline_route(leg)
+    if route is None:
+        ROUTE_CACHE.put_failure(leg)
+        return offline_route(leg)
+    
+    ROUTE_CACHE.put(leg, route)
+    return route
+
+
+def offline_route(leg: Leg) -> Dict[str, Any]:
+    '''
+    Маршрут без OSRM: по локальному графу, если он есть и точки к нему привязываются, иначе примерный.
+    Маршрут по графу запоминается в памяти на local_ttl, отдельно от ответов OSRM: пока OSRM недоступен,
+    поиск по графу для того же отрезка не повторяется (примерная линия дешевле поиска в кэше)
+    '''
+    if ROAD_GRAPH is None:
+        return fallback_route(leg)
+    route = ROUTE_CACHE.get_view(leg, LOCAL_ROUTE)
+    if route is None:
+        route = local_route(leg)
+        if route is None:
+            return fallback_route(leg)
+        ROUTE_CACHE.put_view(leg, LOCAL_ROUTE, route, ttl=ROUTE_CACHE.local_ttl)
+    return route
+
+
+def local_route(leg: Leg) -> Optional[Dict[str, Any]]:
+    '''Маршрут по локальному дорожному графу (см. road_graph.py)'''
+    if ROAD_GRAPH is None:
+        return None
+    found = ROAD_GRAPH.route(*leg)
+    if found is None:
+        return None
+    return {
+        'lats': found['lats'],
+        'lngs': found['lngs'],
+        'distance': round(found['meters'] / 1000, 1),
+        'duration': round(found['meters'] / 1000 / LOCAL_SPEED_KMH * 60),
+        'fallback': False,
+        'engine': 'local'
+    }
+
+
+def fetch_osrm_route(leg: Leg) -> Optional[Dict[str, Any]]:
+    '''Маршрут OSRM; None, если сервер ответил ошибкой или без маршрута, BreakerOpen — если его не спрашивали'''
+    from_lat, from_lng, to_lat, to_lng = leg
+    path = f'/{from_lng},{from_lat};{to_lng},{to_lat}?overview=full&geometries=geojson'
     
     try:
-        req = urllib.request.Request(url, headers={'User-Agent': 'TransportPlanner/1.0'})
-        with urllib.request.urlopen(req, timeout=5) as response:
-            data = json.loads(response.read().decode())
+        data = UPSTREAM.fetch(path)
         
         if data.get('code') == 'Ok' and data.get('routes'):
             route = data['routes'][0]
-            coords = [[c[1], c[0]] for c in route['geometry']['coordinates']]
+            lats, lngs = columns_from_geojson(route['geometry']['coordinates'])
             
             return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
-                    'coordinates': coords,
-                    'distance': round(route['distance'] / 1000, 1),
-                    'duration': round(route['duration'] / 60),
-                    'fallback': False
-                }),
-                'isBase64Encoded': False
+                'lats': lats,
+                'lngs': lngs,
+                'distance': round(route['distance'] / 1000, 1),
+                'duration': round(route['duration'] / 60),
+                'fallback': False
             }
+    except BreakerOpen:
+        raise
     except Exception as e:
         print(f'OSRM error: {str(e)}')
     
-    # Fallback: изогнутая линия с примерным расчётом
-    from math import radians, sin, cos, sqrt, atan2
+    return None
+
+
+def fallback_route(leg: Leg) -> Dict[str, Any]:
+    '''Fallback: изогнутая линия с примерным расчётом'''
+    from_lat, from_lng, to_lat, to_lng = leg
     
     R = 6371
     lat1, lon1 = radians(from_lat), radians(from_lng)
@@ -101,13 +352,8 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         curve_coords.append([mid_lat, mid_lng])
     
     return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({
-            'coordinates': curve_coords,
-            'distance': round(distance * 1.3, 1),
-            'duration': round(distance * 1.3 / 60 * 60),
-            'fallback': True
-        }),
-        'isBase64Encoded': False
-    }
\ No newline at end of file
+        'coordinates': curve_coords,
+        'distance': round(distance * 1.3, 1),
+        'duration': round(distance * 1.3 / 60 * 60),
+        'fallback': True
+    }
@@ -0,0 +1,265 @@
+'''
+Локальный поиск маршрутов по дорожному графу региона — запасной вариант, когда OSRM недоступен.
+Граф готовится заранее (scripts/build_road_graph.py из выгрузки OSM) и лежит в одном бинарном файле,
+который отображается в память (mmap): массивы CSR читаются прямо из файла, без разбора и копирования.
+
+Формат файла (little-endian):
+  заголовок HEADER: сигнатура, число узлов n, число дуг m, сетка для привязки точек
+  (строк, столбцов, широта и долгота угла, размер ячейки в градусах);
+  lat[n], lng[n] — int32, микроградусы;
+  прямой граф: offsets[n + 1], targets[m] — uint32, weights[m] — float32, метры;
+  обратный граф (те же дуги, развёрнутые) — в том же виде;
+  cell_offsets[строк × столбцов + 1] — uint32: узлы пронумерованы по ячейкам сетки,
+  узлы ячейки c — это offsets[c]..offsets[c + 1] - 1.
+
+Поиск — двунаправленный A* с согласованными потенциалами (полусумма оценок до цели и от старта);
+оценка — расстояние в равнопромежуточной проекции с косинусом крайней широты графа,
+поэтому она не больше длины любой дороги.
+'''
+import heapq
+import math
+import mmap
+import os
+import struct
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+MAGIC = b'RGRAPH01'
+HEADER = struct.Struct('<8sIIIIddd')
+MICRODEGREES = 1_000_000
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.radians(1) * EARTH_RADIUS_M
+# Запас к оценке A*: проекция и округление координат не должны сделать её больше реального пути
+HEURISTIC_SLACK = 0.995
+# Дальше этого от ближайшего узла точку к графу не привязываем (м)
+MAX_SNAP_DISTANCE = 5000.0
+DEFAULT_CELL_SIZE = 0.02
+
+INF = float('inf')
+
+
+class RoadGraph:
+    '''Граф из файла: узлы, прямые и обратные дуги, сетка для привязки точек'''
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.node_count, self.edge_count, self.grid_rows, self.grid_cols,
+         self.grid_lat0, self.grid_lng0, self.cell_size) = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: не файл дорожного графа')
+
+        view = memoryview(self._mmap)
+        position = HEADER.size
+        n, m = self.node_count, self.edge_count
+
+        def take(fmt: str, count: int) -> memoryview:
+            nonlocal position
+            size = 4 * count
+            chunk = view[position:position + size].cast(fmt)
+            position += size
+            return chunk
+
+        self.lat = take('i', n)
+        self.lng = take('i', n)
+        self.forward = (take('I', n + 1), take('I', m), take('f', m))
+        self.backward = (take('I', n + 1), take('I', m), take('f', m))
+        self.cell_offsets = take('I', self.grid_rows * self.grid_cols + 1)
+
+        # Метров в микроградусе с запасом: по долготе — на крайней широте графа
+        extreme_lat = max(abs(self.grid_lat0), abs(self.grid_lat0 + self.grid_rows * self.cell_size))
+        self._ky = METERS_PER_DEGREE / MICRODEGREES * HEURISTIC_SLACK
+        self._kx = self._ky * math.cos(math.radians(min(extreme_lat, 89.0)))
+
+    def close(self) -> None:
+        for name in ('lat', 'lng', 'cell_offsets'):
+            getattr(self, name).release()
+        for arrays in (self.forward, self.backward):
+            for chunk in arrays:
+                chunk.release()
+        self._mmap.close()
+
+    def nearest_node(self, lat: float, lng: float, max_distance: float = MAX_SNAP_DISTANCE) -> Optional[Tuple[int, float]]:
+        '''Ближайший узел и расстояние до него (м): обход колец ячеек сетки вокруг точки'''
+        row = int((lat - self.grid_lat0) // self.cell_size)
+        col = int((lng - self.grid_lng0) // self.cell_size)
+        # Ширина ячейки по долготе — самая узкая сторона, по ней считаем, сколько колец смотреть
+        cos_lat = math.cos(math.radians(lat))
+        cell_meters = self.cell_size * METERS_PER_DEGREE * cos_lat
+        max_ring = int(max_distance // max(cell_meters, 1.0)) + 1
+
+        # Расстояние до узла — в равнопромежуточной проекции около точки, прямо в микроградусах файла
+        scale_y = METERS_PER_DEGREE / MICRODEGREES
+        scale_x = scale_y * cos_lat
+        lat_e6, lng_e6 = lat * MICRODEGREES, lng * MICRODEGREES
+        lats, lngs, hypot = self.lat, self.lng, math.hypot
+
+        best, best_distance = -1, max_distance
+        offsets = self.cell_offsets
+        for ring in range(max_ring + 1):
+            # Все узлы дальше ring - 1 ячеек: если найденный ближе, дальше искать незачем
+            if best >= 0 and (ring - 1) * cell_meters > best_distance:
+                break
+            for r in range(row - ring, row + ring + 1):
+                if not 0 <= r < self.grid_rows:
+                    continue
+                edge = r in (row - ring, row + ring)
+                for c in range(col - ring, col + ring + 1) if edge else (col - ring, col + ring):
+                    if not 0 <= c < self.grid_cols:
+                        continue
+                    cell = r * self.grid_cols + c
+                    for v in range(offsets[cell], offsets[cell + 1]):
+                        distance = hypot((lngs[v] - lng_e6) * scale_x, (lats[v] - lat_e6) * scale_y)
+                        if distance < best_distance:
+                            best, best_distance = v, distance
+        return (best, best_distance) if best >= 0 else None
+
+    def shortest_path(self, source: int, target: int) -> Optional[Tuple[float, List[int]]]:
+        '''Длина кратчайшего пути (м) и узлы пути; None, если узлы не связаны'''
+        if source == target:
+            return 0.0, [source]
+
+        lat, lng, kx, ky = self.lat, self.lng, self._kx, self._ky
+        sx, sy = lng[source] * kx, lat[source] * ky
+        tx, ty = lng[target] * kx, lat[target] * ky
+        hypot = math.hypot
+        potentials: Dict[int, float] = {}
+
+        def potential(v: int) -> float:
+            p = potentials.get(v)
+            if p is None:
+                x, y = lng[v] * kx, lat[v] * ky
+                p = potentials[v] = (hypot(x - tx, y - ty) - hypot(x - sx, y - sy)) / 2
+            return p
+
+        # Ключ в прямой очереди — d + p(v), в обратной — d - p(v); остановка, когда сумма вершин очередей ≥ лучшего пути
+        dist = ({source: 0.0}, {target: 0.0})
+        parent = ({source: -1}, {target: -1})
+        heaps = ([(potential(source), source)], [(-potential(target), target)])
+        graphs = (self.forward, self.backward)
+        signs = (1.0, -1.0)
+        best, meeting = INF, -1
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            heap, own, other, own_parent = heaps[side], dist[side], dist[1 - side], parent[side]
+            sign = signs[side]
+            key, u = heapq.heappop(heap)
+            d = own[u]
+            if key > d + sign * potential(u) + 1e-9:
+                continue  # устаревшая запись очереди
+            offsets, targets, weights = graphs[side]
+            for e in range(offsets[u], offsets[u + 1]):
+                v = targets[e]
+                nd = d + weights[e]
+                if nd < own.get(v, INF):
+                    own[v] = nd
+                    own_parent[v] = u
+                    heapq.heappush(heap, (nd + sign * potential(v), v))
+                    through = nd + other.get(v, INF)
+                    if through < best:
+                        best, meeting = through, v
+
+        if meeting < 0:
+            return None
+
+        path: List[int] = []
+        v = meeting
+        while v >= 0:
+            path.append(v)
+            v = parent[0][v]
+        path.reverse()
+        v = parent[1][meeting]
+        while v >= 0:
+            path.append(v)
+            v = parent[1][v]
+        return best, path
+
+    def route(self, from_lat: float, from_lng: float, to_lat: float, to_lng: float) -> Optional[Dict]:
+        '''
+        Маршрут между точками: (lats, lngs, метры). Точки привязываются к ближайшим узлам,
+        подъезды до них — по прямой. None, если точку не к чему привязать или пути нет.
+        '''
+        start = self.nearest_node(from_lat, from_lng)
+        end = self.nearest_node(to_lat, to_lng)
+        if start is None or end is None:
+            return None
+        found = self.shortest_path(start[0], end[0])
+        if found is None:
+            return None
+
+        length, path = found
+        lats = [from_lat]
+        lngs = [from_lng]
+        lats.extend(self.lat[v] / MICRODEGREES for v in path)
+        lngs.extend(self.lng[v] / MICRODEGREES for v in path)
+        lats.append(to_lat)
+        lngs.append(to_lng)
+        return {'lats': lats, 'lngs': lngs, 'meters': length + start[1] + end[1]}
+
+
+def load_from_env() -> Optional[RoadGraph]:
+    '''Граф по пути из ROAD_GRAPH_PATH; None, если путь не задан или файл не читается'''
+    path = os.environ.get('ROAD_GRAPH_PATH', '')
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return RoadGraph(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f'Road graph: файл {path} не загружен ({e})')
+        return None
+
+
+def write_graph(
+    path: str,
+    lats: Sequence[float],
+    lngs: Sequence[float],
+    edges: Sequence[Tuple[int, int, float]],
+    cell_size: float = DEFAULT_CELL_SIZE
+) -> Tuple[int, int]:
+    '''
+    Запись графа в файл: lats/lngs — координаты узлов, edges — направленные дуги (откуда, куда, метры).
+    Узлы перенумеровываются по ячейкам сетки. Возвращает (узлов, дуг).
+    '''
+    n = len(lats)
+    # floor(x / cell) * cell может выйти чуть больше x (83.70 → 83.70000000000002) — узел попал бы в ячейку -1
+    lat0 = min(min(lats), math.floor(min(lats) / cell_size) * cell_size) if n else 0.0
+    lng0 = min(min(lngs), math.floor(min(lngs) / cell_size) * cell_size) if n else 0.0
+    rows = int((max(lats) - lat0) // cell_size) + 1 if n else 1
+    cols = int((max(lngs) - lng0) // cell_size) + 1 if n else 1
+
+    cells = [int((lats[v] - lat0) // cell_size) * cols + int((lngs[v] - lng0) // cell_size) for v in range(n)]
+    order = sorted(range(n), key=lambda v: (cells[v], v))
+    renumber = array('I', bytes(4 * n))
+    for new, old in enumerate(order):
+        renumber[old] = new
+
+    cell_offsets = array('I', bytes(4 * (rows * cols + 1)))
+    for cell in cells:
+        cell_offsets[cell + 1] += 1
+    for c in range(rows * cols):
+        cell_offsets[c + 1] += cell_offsets[c]
+
+    def csr(pairs: List[Tuple[int, int, float]]) -> Tuple[array, array, array]:
+        pairs.sort()
+        offsets = array('I', bytes(4 * (n + 1)))
+        for u, _, _ in pairs:
+            offsets[u + 1] += 1
+        for v in range(n):
+            offsets[v + 1] += offsets[v]
+        return offsets, array('I', (v for _, v, _ in pairs)), array('f', (w for _, _, w in pairs))
+
+    forward = csr([(renumber[u], renumber[v], w) for u, v, w in edges])
+    backward = csr([(renumber[v], renumber[u], w) for u, v, w in edges])
+
+    with open(path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, n, len(edges), rows, cols, lat0, lng0, cell_size))
+        for values in (
+            array('i', (round(lats[v] * MICRODEGREES) for v in order)),
+            array('i', (round(lngs[v] * MICRODEGREES) for v in order)),
+            *forward, *backward, cell_offsets
+        ):
+            values.tofile(f)
+    return n, len(edges)
@@ -0,0 +1,218 @@
+'''
+Кэш геометрии маршрутов между вызовами функции.
+Два уровня: LRU в памяти процесса (живёт, пока функция «тёплая») и SQLite-файл
+(переживает перезапуск процесса). Ключ — координаты отрезка, округлённые до precision знаков.
+Неудачные запросы к OSRM тоже кэшируются (на меньший срок), чтобы не ждать таймаут повторно.
+Отдельно в памяти хранятся готовые представления маршрута (упрощённая под масштаб,
+закодированная линия): повторный запрос карты не упрощает линию заново.
+Маршруты, построенные по локальному графу вместо OSRM, и их представления
+тоже хранятся только в памяти и недолго (local_ttl): пока OSRM недоступен, поиск по графу
+не повторяется на каждый отрезок, а после восстановления OSRM снова спрашивается.
+Память и SQLite защищены разными блокировками: потоки пакета, попадающие в память,
+не ждут, пока другой поток читает или пишет файл.
+'''
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Hashable, Optional, Tuple
+
+from codec import dumps, loads
+
+# Отметка «OSRM не ответил» для отрицательного кэширования
+FAILED = {'failed': True}
+
+
+class RouteCache:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        precision: int = 5,
+        ttl: float = 7 * 24 * 3600,
+        negative_ttl: float = 600,
+        local_ttl: float = 120,
+        memory_entries: int = 2000,
+        disk_entries: int = 50000
+    ):
+        self.precision = precision
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.local_ttl = local_ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+
+        self._memory: 'OrderedDict[str, Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._views: 'OrderedDict[Tuple[str, Hashable], Tuple[float, Dict[str, Any]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        # Соединение SQLite одно на процесс; запросы к нему — только под _db_lock, без _lock
+        self._db_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_writes = 0
+        self.counters = {
+            'memory_hits': 0, 'disk_hits': 0, 'negative_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0,
+            'view_hits': 0
+        }
+
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+                self._db.execute('PRAGMA journal_mode=WAL')
+                self._db.execute('PRAGMA synchronous=NORMAL')
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS routes ('
+                    'key TEXT PRIMARY KEY, expires REAL NOT NULL, stored REAL NOT NULL, payload TEXT NOT NULL)'
+                )
+                self._db.execute('CREATE INDEX IF NOT EXISTS routes_stored ON routes (stored)')
+            except sqlite3.Error as e:
+                print(f'Route cache: SQLite недоступен ({e}), работаем только в памяти')
+                self._db = None
+
+    def key(self, leg: Tuple[float, float, float, float]) -> str:
+        return ','.join(f'{round(float(c), self.precision):.{self.precision}f}' for c in leg)
+
+    def get(self, leg: Tuple[float, float, float, float]) -> Optional[Dict[str, Any]]:
+        '''Маршрут из кэша, FAILED для отрезков, где OSRM недавно не ответил, иначе None'''
+        key = self.key(leg)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    return self._hit('memory_hits', entry[1])
+                del self._memory[key]
+            if self._db is None:
+                self.counters['misses'] += 1
+                return None
+
+        row = None
+        with self._db_lock:
+            try:
+                row = self._db.execute('SELECT expires, payload FROM routes WHERE key = ?', (key,)).fetchone()
+            except sqlite3.Error as e:
+                print(f'Route cache read error: {e}')
+        payload = loads(row[1]) if row is not None and row[0] > now else None
+
+        with self._lock:
+            # Пока читали диск, другой поток мог записать отрезок заново — его запись свежее
+            entry = self._memory.get(key)
+            if entry is not None and entry[0] > now:
+                return self._hit('memory_hits', entry[1])
+            if payload is None:
+                self.counters['misses'] += 1
+                return None
+            self._remember(key, row[0], payload)
+            return self._hit('disk_hits', payload)
+
+    def put(self, leg: Tuple[float, float, float, float], route: Dict[str, Any]) -> None:
+        self._store(self.key(leg), route, self.ttl)
+
+    def put_failure(self, leg: Tuple[float, float, float, float]) -> None:
+        self._store(self.key(leg), FAILED, self.negative_ttl)
+
+    def get_view(self, leg: Tuple[float, float, float, float], view: Hashable) -> Optional[Dict[str, Any]]:
+        '''Готовое представление маршрута (только память процесса)'''
+        key = (self.key(leg), view)
+        with self._lock:
+            entry = self._views.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._views[key]
+                return None
+            self._views.move_to_end(key)
+            self.counters['view_hits'] += 1
+            return entry[1]
+
+    def put_view(
+        self,
+        leg: Tuple[float, float, float, float],
+        view: Hashable,
+        payload: Dict[str, Any],
+        ttl: Optional[float] = None
+    ) -> None:
+        with self._lock:
+            key = (self.key(leg), view)
+            self._views[key] = (time.time() + (self.ttl if ttl is None else ttl), payload)
+            self._views.move_to_end(key)
+            while len(self._views) > self.memory_entries:
+                self._views.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.counters['memory_hits'] + self.counters['disk_hits'] + self.counters['misses']
+            hits = lookups - self.counters['misses']
+            return {
+                **self.counters,
+                'hit_rate': round(hits / lookups, 3) if lookups else 0.0,
+                'memory_size': len(self._memory),
+                'view_size': len(self._views),
+                'persistent': self._db is not None
+            }
+
+    def _hit(self, counter: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        self.counters[counter] += 1
+        if payload.get('failed'):
+            self.counters['negative_hits'] += 1
+        return payload
+
+    def _remember(self, key: str, expires: float, payload: Dict[str, Any]) -> None:
+        self._memory[key] = (expires, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.counters['evictions'] += 1
+
+    def _store(self, key: str, payload: Dict[str, Any], ttl: float) -> None:
+        now = time.time()
+        expires = now + ttl
+        with self._lock:
+            self._remember(key, expires, payload)
+            self.counters['stores'] += 1
+        if self._db is None:
+            return
+
+        data = dumps(payload)
+        evicted = 0
+        with self._db_lock:
+            try:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO routes (key, expires, stored, payload) VALUES (?, ?, ?, ?)',
+                    (key, expires, now, data)
+                )
+                self._disk_writes += 1
+                # Чистку диска делаем не на каждую запись
+                if self._disk_writes % 200 == 0:
+                    evicted = self._evict_disk(now)
+            except sqlite3.Error as e:
+                print(f'Route cache write error: {e}')
+        if evicted:
+            with self._lock:
+                self.counters['evictions'] += evicted
+
+    def _evict_disk(self, now: float) -> int:
+        '''Удаляет просроченные и самые старые записи сверх disk_entries; вызывается под _db_lock'''
+        self._db.execute('DELETE FROM routes WHERE expires <= ?', (now,))
+        count = self._db.execute('SELECT COUNT(*) FROM routes').fetchone()[0]
+        if count <= self.disk_entries:
+            return 0
+        self._db.execute(
+            'DELETE FROM routes WHERE key IN (SELECT key FROM routes ORDER BY stored LIMIT ?)',
+            (count - self.disk_entries,)
+        )
+        return count - self.disk_entries
+
+
+def cache_from_env() -> RouteCache:
+    '''Настройки кэша из переменных окружения функции'''
+    return RouteCache(
+        path=os.environ.get('ROUTE_CACHE_PATH', '/tmp/osrm-route-cache.sqlite3') or None,
+        precision=int(os.environ.get('ROUTE_CACHE_PRECISION', '5')),
+        ttl=float(os.environ.get('ROUTE_CACHE_TTL', str(7 * 24 * 3600))),
+        negative_ttl=float(os.environ.get('ROUTE_CACHE_NEGATIVE_TTL', '600')),
+        local_ttl=float(os.environ.get('ROUTE_CACHE_LOCAL_TTL', '120')),
+        memory_entries=int(os.environ.get('ROUTE_CACHE_MEMORY_ENTRIES', '2000')),
+        disk_entries=int(os.environ.get('ROUTE_CACHE_DISK_ENTRIES', '50000'))
+    )
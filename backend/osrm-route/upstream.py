@@ -0,0 +1,357 @@
+'''
+Клиент OSRM: постоянные соединения, таймауты по наблюдаемой задержке, дублирующий запрос
+на запасной сервер и автоматический выключатель (circuit breaker).
+
+Соединения (http.client, HTTP/1.1 keep-alive) лежат в пуле на уровне модуля и переживают
+«тёплые» вызовы функции: повторный запрос не платит за TCP и TLS. Сам http.client (с ssl и email
+он стоит ~25 мс холодного старта) импортируется при первом запросе к серверу.
+Таймаут — p99 последних ответов сервера × TIMEOUT_FACTOR в пределах [min_timeout, max_timeout];
+пока ответов мало, действует max_timeout.
+Если основной сервер не ответил за p90 своей задержки, но не дольше hedge_delay (или сразу вернул ошибку),
+тот же запрос уходит на запасной (OSRM_SECONDARY_URL); берётся первый удачный ответ. Когда медиана
+запасного стала меньше, чем у основного, они меняются ролями.
+После failure_threshold неудач подряд выключатель размыкается: cooldown секунд сервер не опрашивается
+вовсе, маршрут сразу строится запасным способом. Потом пропускается один пробный запрос:
+удачный замыкает выключатель, неудачный размыкает его снова.
+'''
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from codec import loads
+
+USER_AGENT = 'TransportPlanner/1.0'
+LATENCY_WINDOW = 200
+# Сколько ответов нужно, чтобы доверять перцентилям
+MIN_SAMPLES = 10
+TIMEOUT_FACTOR = 3.0
+MAX_IDLE_CONNECTIONS = 8
+HEDGE_WORKERS = 32
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class BreakerOpen(UpstreamError):
+    '''Запрос не отправлен: выключатель разомкнут или пробный запрос уже занят другим потоком'''
+
+
+def http_client() -> Any:
+    '''Модуль http.client; ответам из кэша маршрутов он не нужен'''
+    import http.client
+    return http.client
+
+
+def stale_connection_errors() -> Tuple[type, ...]:
+    '''Ошибки, после которых запрос по соединению из пула стоит повторить по свежему: сервер закрыл его первым'''
+    client = http_client()
+    return client.RemoteDisconnected, client.CannotSendRequest, BrokenPipeError, ConnectionResetError
+
+
+class ConnectionPool:
+    '''Свободные соединения по (схема, хост, порт); занятое соединение в пуле не лежит'''
+
+    def __init__(self, max_idle: int = MAX_IDLE_CONNECTIONS):
+        self.max_idle = max_idle
+        self._idle: Dict[Tuple[str, str, int], List[Any]] = {}
+        self._lock = threading.Lock()
+        self.counters = {'opened': 0, 'reused': 0}
+
+    def _acquire(self, origin: Tuple[str, str, int], timeout: float) -> Tuple[Any, bool]:
+        with self._lock:
+            idle = self._idle.get(origin)
+            if idle:
+                self.counters['reused'] += 1
+                return idle.pop(), True
+            self.counters['opened'] += 1
+        scheme, host, port = origin
+        client = http_client()
+        connection_class = client.HTTPSConnection if scheme == 'https' else client.HTTPConnection
+        return connection_class(host, port, timeout=timeout), False
+
+    def _release(self, origin: Tuple[str, str, int], connection: Any) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(origin, [])
+            if len(idle) < self.max_idle:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def get(self, url: str, timeout: float) -> Tuple[int, bytes]:
+        '''GET url: (статус, тело). Соединение из пула, закрытое сервером, заменяется свежим один раз'''
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        origin = (scheme, parts.hostname or '', parts.port or (443 if scheme == 'https' else 80))
+        target = parts.path + ('?' + parts.query if parts.query else '')
+
+        while True:
+            connection, reused = self._acquire(origin, timeout)
+            try:
+                connection.timeout = timeout
+                if connection.sock is not None:
+                    connection.sock.settimeout(timeout)
+                connection.request('GET', target, headers={'User-Agent': USER_AGENT})
+                response = connection.getresponse()
+                body = response.read()
+            except stale_connection_errors():
+                connection.close()
+                if reused:
+                    continue
+                raise
+            except BaseException:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(origin, connection)
+            return response.status, body
+
+    def close(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+
+class LatencyTracker:
+    '''Задержки последних window удачных ответов и производные от них таймаут и порог дублирования'''
+
+    def __init__(self, min_timeout: float, max_timeout: float, window: int = LATENCY_WINDOW):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._samples: 'deque[float]' = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def timeout(self) -> float:
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, p99 * TIMEOUT_FACTOR))
+
+    def hedge_delay(self, limit: float) -> float:
+        '''Сколько ждать основной сервер, прежде чем спросить запасной: p90, но не дольше limit'''
+        p90 = self.percentile(0.9)
+        return limit if p90 is None else min(p90, limit)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = len(self._samples)
+        latency = {name: self.percentile(q) for name, q in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))}
+        return {
+            'samples': samples,
+            'latency_ms': {name: round(value * 1000, 1) for name, value in latency.items() if value is not None},
+            'timeout_s': round(self.timeout(), 3)
+        }
+
+
+class CircuitBreaker:
+    '''Выключатель: closed → (threshold неудач подряд) → open → (cooldown) → half_open → один пробный запрос'''
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def available(self) -> bool:
+        '''Будет ли запрос пропущен — без занятия места пробного'''
+        with self._lock:
+            if self.state == OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return self.state == CLOSED or not self._probing
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.trips += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = {
+                'state': self.state, 'consecutive_failures': self.consecutive_failures, 'trips': self.trips
+            }
+            if self.state == OPEN:
+                stats['retry_in_s'] = round(max(0.0, self.cooldown - (time.monotonic() - self.opened_at)), 1)
+        return stats
+
+
+class Endpoint:
+    '''Один сервер OSRM: базовый URL, его задержки, выключатель и счётчики'''
+
+    def __init__(self, url: str, pool: ConnectionPool, min_timeout: float, max_timeout: float,
+                 failure_threshold: int, cooldown: float):
+        self.url = url.rstrip('/')
+        self.pool = pool
+        self.latency = LatencyTracker(min_timeout, max_timeout)
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        self.counters = {'requests': 0, 'failures': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counters[name] += 1
+
+    def fetch(self, path: str) -> Dict[str, Any]:
+        '''JSON ответа на GET url + path; BreakerOpen, если выключатель разомкнут, UpstreamError, если ответ плохой'''
+        if not self.breaker.allow():
+            self._count('rejected')
+            raise BreakerOpen(f'{self.url}: выключатель разомкнут')
+        self._count('requests')
+        started = time.perf_counter()
+        try:
+            status, body = self.pool.get(self.url + path, self.latency.timeout())
+            data = self._answer(status, body)
+        except Exception:
+            self._count('failures')
+            self.breaker.record_failure()
+            raise
+        self.latency.add(time.perf_counter() - started)
+        self.breaker.record_success()
+        return data
+
+    def _answer(self, status: int, body: bytes) -> Dict[str, Any]:
+        '''
+        JSON ответа. 4xx с полем code (NoRoute, InvalidQuery…) — сервер ответил про сам запрос,
+        это не сбой сервера: выключатель такие ответы не считает
+        '''
+        if status == 200:
+            return loads(body)
+        if 400 <= status < 500:
+            try:
+                data = loads(body)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and data.get('code'):
+                return data
+        raise UpstreamError(f'{self.url}: HTTP {status}')
+
+    def stats(self) -> Dict[str, Any]:
+        return {'url': self.url, 'breaker': self.breaker.stats(), **self.latency.stats(), **self.counters}
+
+
+class UpstreamClient:
+    '''Основной и необязательный запасной сервер OSRM с дублированием медленных запросов'''
+
+    def __init__(self, endpoints: List[Endpoint], hedge_delay: float = 1.0, max_workers: int = HEDGE_WORKERS):
+        self.endpoints = endpoints
+        self.hedge_delay = hedge_delay
+        self.hedges = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='osrm-upstream')
+
+    def available(self) -> bool:
+        '''Есть ли сервер, который сейчас можно спросить; если нет — сразу запасной маршрут'''
+        return any(endpoint.breaker.available() for endpoint in self.endpoints)
+
+    def fetch(self, path: str) -> Dict[str, Any]:
+        '''
+        Первый удачный ответ. Запасной сервер спрашивается, если основной ответил ошибкой или
+        молчит дольше своего p90. Проигравший запрос доживает в фоне: его задержка и исход
+        тоже учитываются в статистике сервера.
+        BreakerOpen — только если ни один сервер так и не спросили (в том числе если их нет вовсе).
+        '''
+        if not self.endpoints:
+            raise BreakerOpen('серверы OSRM не настроены')
+        if len(self.endpoints) == 1:
+            return self.endpoints[0].fetch(path)
+
+        primary, secondary = self.endpoints[0], self.endpoints[1]
+        primary_median, secondary_median = primary.latency.percentile(0.5), secondary.latency.percentile(0.5)
+        if primary_median is not None and secondary_median is not None and secondary_median < primary_median:
+            primary, secondary = secondary, primary
+        pending: List[Future] = []
+        if primary.breaker.available():
+            pending.append(self._executor.submit(primary.fetch, path))
+            done, _ = wait(pending, timeout=primary.latency.hedge_delay(self.hedge_delay))
+            if done and pending[0].exception() is None:
+                return pending[0].result()
+        if secondary.breaker.available():
+            with self._lock:
+                self.hedges += 1
+            pending.append(self._executor.submit(secondary.fetch, path))
+
+        error: Optional[BaseException] = None
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                if future.exception() is None:
+                    return future.result()
+                # Настоящий отказ сервера важнее отказа выключателя
+                if error is None or isinstance(error, BreakerOpen):
+                    error = future.exception()
+        raise error or BreakerOpen('нет доступных серверов OSRM')
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'endpoints': [endpoint.stats() for endpoint in self.endpoints],
+            'hedges': self.hedges,
+            'connections': dict(self.endpoints[0].pool.counters) if self.endpoints else {}
+        }
+
+
+def client_from_env(default_url: str) -> UpstreamClient:
+    '''
+    Клиент по переменным окружения: OSRM_URL (основной), OSRM_SECONDARY_URL (запасной),
+    OSRM_TIMEOUT (предел таймаута, с), OSRM_MIN_TIMEOUT, OSRM_HEDGE_DELAY (предел ожидания основного
+    перед запросом к запасному, с), OSRM_BREAKER_FAILURES, OSRM_BREAKER_COOLDOWN
+    '''
+    pool = ConnectionPool()
+    settings = dict(
+        min_timeout=float(os.environ.get('OSRM_MIN_TIMEOUT', '0.5')),
+        max_timeout=float(os.environ.get('OSRM_TIMEOUT', '5')),
+        failure_threshold=int(os.environ.get('OSRM_BREAKER_FAILURES', '3')),
+        cooldown=float(os.environ.get('OSRM_BREAKER_COOLDOWN', '30'))
+    )
+    urls = [os.environ.get('OSRM_URL', default_url), os.environ.get('OSRM_SECONDARY_URL', '')]
+    return UpstreamClient(
+        [Endpoint(url, pool, **settings) for url in urls if url],
+        hedge_delay=float(os.environ.get('OSRM_HEDGE_DELAY', '1'))
+    )
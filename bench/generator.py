@@ -0,0 +1,121 @@
+"""
+Генератор воспроизводимых тестовых задач для optimize-routes и osrm-route.
+Одинаковый seed и параметры дают одинаковый запрос: точки разбросаны по региону вокруг Барнаула
+кучками (лесные склады тянутся к районам заготовки), остатки и потребности по каждому товару
+сбалансированы, среди предприятий есть пара «Завод» / «Павловский ДОК» для рейсов щепы.
+"""
+import random
+from typing import Dict, List, Any, Optional, Sequence
+
+REGION_CENTER = (53.35, 83.77)
+REGION_SPREAD = (1.2, 2.0)  # градусы по широте и долготе
+
+WOOD_PRODUCTS = ('Доски', 'Брус', 'Горбыль', 'Пиловочник', 'Дрова', 'Опил')
+CHIPS = 'Щепа'
+VEHICLE_TYPES = (
+    ('Лесовоз', (30, 40, 45), 2),
+    ('Самосвал', (20, 25), 2),
+    ('Универсал', (25, 30, 35), 1),
+)
+
+
+def _point(rng: random.Random, clusters: Sequence[Sequence[float]]) -> Dict[str, float]:
+    lat, lng = rng.choice(clusters)
+    return {
+        'lat': round(lat + rng.gauss(0, 0.15), 6),
+        'lng': round(lng + rng.gauss(0, 0.25), 6)
+    }
+
+
+def generate(
+    seed: int = 0,
+    warehouses: int = 30,
+    enterprises: int = 10,
+    vehicles: int = 8,
+    products: int = 4,
+    universal_share: float = 0.25,
+    repair_share: float = 0.1,
+    clusters: int = 6,
+    month: str = 'Январь 2025'
+) -> Dict[str, Any]:
+    """Тело запроса optimize-routes: month, warehouses, enterprises, vehicles"""
+    rng = random.Random(seed)
+    product_names = list(WOOD_PRODUCTS[:max(1, min(products, len(WOOD_PRODUCTS)))])
+    centers = [
+        (REGION_CENTER[0] + rng.uniform(-1, 1) * REGION_SPREAD[0], REGION_CENTER[1] + rng.uniform(-1, 1) * REGION_SPREAD[1])
+        for _ in range(max(1, clusters))
+    ]
+
+    enterprise_names = ['Завод', 'Павловский ДОК'] + [f'Предприятие {k}' for k in range(1, max(0, enterprises - 2) + 1)]
+    enterprise_list: List[Dict[str, Any]] = []
+    for k, name in enumerate(enterprise_names[:max(2, enterprises)]):
+        wanted = rng.sample(product_names, rng.randint(1, min(3, len(product_names))))
+        enterprise_list.append({'id': k + 1, 'name': name, **_point(rng, centers), 'needs': {p: 0 for p in wanted}})
+    # Павловский ДОК принимает щепу, Завод — доски и брус (на него едут универсалы)
+    enterprise_list[1]['needs'][CHIPS] = 0
+    enterprise_list[0]['needs'].setdefault(product_names[0], 0)
+
+    warehouse_list: List[Dict[str, Any]] = []
+    for k in range(warehouses):
+        stocked = rng.sample(product_names, rng.randint(1, min(2, len(product_names))))
+        warehouse_list.append({
+            'id': 1000 + k,
+            'name': f'Склад {k + 1}',
+            **_point(rng, centers),
+            'stocks': {p: rng.choice((30, 45, 60, 90, 120, 200)) for p in stocked}
+        })
+
+    # Потребности делим пропорционально случайным весам так, чтобы по каждому товару
+    # их сумма совпадала с суммой остатков
+    for product in product_names:
+        total = sum(w['stocks'].get(product, 0) for w in warehouse_list)
+        takers = [e for e in enterprise_list if product in e['needs']] or [enterprise_list[0]]
+        weights = [rng.uniform(0.5, 2) for _ in takers]
+        scale = sum(weights)
+        assigned = 0
+        for enterprise, weight in zip(takers, weights):
+            share = int(total * weight / scale)
+            enterprise['needs'][product] = share
+            assigned += share
+        takers[0]['needs'][product] += total - assigned
+    for enterprise in enterprise_list:
+        enterprise['needs'] = {p: v for p, v in enterprise['needs'].items() if v > 0 or p == CHIPS}
+    enterprise_list[1]['needs'][CHIPS] = 500
+
+    vehicle_list: List[Dict[str, Any]] = []
+    regular_types = [t for t in VEHICLE_TYPES if t[0] != 'Универсал' for _ in range(t[2])]
+    for k in range(vehicles):
+        universal = rng.random() < universal_share
+        category, volumes, _ = VEHICLE_TYPES[2] if universal else rng.choice(regular_types)
+        carried = rng.sample(product_names, rng.randint(1, min(3, len(product_names))))
+        if universal:
+            carried = list(dict.fromkeys([product_names[0]] + carried + [CHIPS]))
+        vehicle_list.append({
+            'id': k + 1,
+            'licensePlate': f'{rng.choice("АВЕКМНОРСТУХ")}{100 + k}{rng.choice("АВЕКМН")}{rng.choice("АВЕКМН")}',
+            'category': category,
+            'volume': rng.choice(volumes),
+            'status': 'repair' if rng.random() < repair_share else 'active',
+            'enterprise': rng.choice(enterprise_list)['name'],
+            'productTypes': carried
+        })
+
+    return {'month': month, 'warehouses': warehouse_list, 'enterprises': enterprise_list, 'vehicles': vehicle_list}
+
+
+def generate_legs(seed: int = 0, count: int = 100, repeat_share: float = 0.3, request: Optional[Dict] = None) -> List[Dict]:
+    """
+    Отрезки для пакетного режима osrm-route: как их шлёт карта (склад → предприятие),
+    repeat_share отрезков повторяют уже встречавшиеся
+    """
+    rng = random.Random(seed)
+    request = request or generate(seed, warehouses=max(10, count // 4), enterprises=max(4, count // 20))
+    points = request['warehouses'] + request['enterprises']
+    legs: List[Dict] = []
+    for _ in range(count):
+        if legs and rng.random() < repeat_share:
+            legs.append(dict(rng.choice(legs)))
+            continue
+        a, b = rng.sample(points, 2)
+        legs.append({'fromLat': a['lat'], 'fromLng': a['lng'], 'toLat': b['lat'], 'toLng': b['lng']})
+    return legs
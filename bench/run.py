@@ -0,0 +1,337 @@
+"""
+Бенчмарки optimize-routes и osrm-route на сгенерированных задачах (см. generator.py).
+
+    python bench/run.py                       # быстрый набор, сравнение с bench/baseline.json
+    python bench/run.py --suite full --repeat 7
+    python bench/run.py --save-baseline       # записать текущие результаты как эталон
+
+Для каждой точки кривой масштабирования меряются время (p50/p90/p99), пиковая память
+(отдельный прогон под tracemalloc) и качество плана: суммарный пробег, число рейсов,
+невывезенные остатки. osrm-route гоняется в пакетном режиме против локальной заглушки OSRM
+(холодный кэш маршрутов и тёплый) и против «зависшей» заглушки — так выглядит карта, когда OSRM лежит.
+cold_start/* — холодный вызов функции в новом процессе (импорт index и первый запрос) и следующий, тёплый.
+Выход с кодом 1, если время или память выросли больше, чем на --threshold, или план стал хуже.
+"""
+import argparse
+import base64
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Any, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'backend')
+sys.path.insert(0, BENCH_DIR)
+
+from generator import generate, generate_legs  # noqa: E402
+import stub_osrm  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# (склады, предприятия, машины)
+SUITES = {
+    'quick': [(30, 10, 8), (100, 20, 20), (300, 40, 50)],
+    'full': [(30, 10, 8), (100, 20, 20), (300, 40, 50), (1000, 80, 120), (2000, 150, 250)],
+}
+LEG_COUNTS = {'quick': [50, 200], 'full': [50, 200, 1000]}
+STUB_LATENCY = 0.005
+MAP_GEOMETRY = {'zoom': 13, 'format': 'polyline6'}
+# «Зависший» OSRM: отвечает дольше любого таймаута
+HUNG_LATENCY = 60.0
+DEGRADED_TIMEOUT = '1'
+
+# Как отвечает браузеру: тело сжато
+GZIP_HEADERS = {'Accept-Encoding': 'gzip, deflate'}
+
+# Новый процесс: импорт index, холодный вызов, тёплый вызов с тем же запросом; секунды — последней строкой
+COLD_START_SCRIPT = '''
+import contextlib, io, json, sys, time
+event = json.loads(sys.stdin.read())
+with contextlib.redirect_stdout(io.StringIO()):
+    started = time.perf_counter()
+    import index
+    imported = time.perf_counter()
+    index.handler(event, None)
+    cold = time.perf_counter()
+    index.handler(event, None)
+    warm = time.perf_counter()
+print(json.dumps({'import': imported - started, 'cold': cold - started, 'warm': warm - cold}))
+'''
+
+# Качество не зависит от машины, поэтому допускаем только шум округления
+QUALITY_TOLERANCE = 1e-3
+
+
+def load_function(name: str, module_name: str):
+    """index.py функции под уникальным именем: у обеих функций модуль называется index"""
+    function_dir = os.path.join(BACKEND_DIR, name)
+    if function_dir not in sys.path:
+        sys.path.insert(0, function_dir)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(function_dir, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    with contextlib.redirect_stdout(io.StringIO()):
+        spec.loader.exec_module(module)
+    return module
+
+
+def quiet(fn: Callable, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fn(*args, **kwargs)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * q
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """Время repeat вызовов (мс) после одного прогревочного и пиковая память отдельного вызова (КБ)"""
+    quiet(fn)
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        quiet(fn)
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        quiet(fn)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(statistics.median(samples), 3),
+        'p90_ms': round(percentile(samples, 0.9), 3),
+        'p99_ms': round(percentile(samples, 0.99), 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def measure_cold_start(name: str, event: Dict[str, Any], repeat: int, env: Dict[str, str]) -> Dict[str, float]:
+    """Медианы по repeat новым процессам (мс): импорт, холодный вызов вместе с импортом, тёплый вызов"""
+    samples: Dict[str, List[float]] = {}
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, '-c', COLD_START_SCRIPT], input=json.dumps(event), cwd=os.path.join(BACKEND_DIR, name),
+            env={**os.environ, **env}, capture_output=True, text=True, check=True
+        )
+        for key, seconds in json.loads(completed.stdout.splitlines()[-1]).items():
+            samples.setdefault(key, []).append(seconds * 1000)
+    return {f'p50_{key}_ms': round(statistics.median(values), 3) for key, values in samples.items()}
+
+
+def plan_quality(optimizer, request: Dict[str, Any]) -> Dict[str, float]:
+    problem, distances = quiet(
+        optimizer.prepare_problem, request['warehouses'], request['enterprises'], request['vehicles']
+    )
+    records = quiet(optimizer.plan_records, problem, distances, 'greedy')
+    routes = [record.to_dict() for record in records]
+    return {
+        'total_distance': round(sum(r['distance'] + r.get('parkingDistance', 0) for r in routes), 1),
+        # Рейс начинается на складе; щепа и следующие точки выгрузки его продолжают
+        'trips': sum(1 for record in records if record.warehouse_index >= 0),
+        'leftover_stock': round(sum(problem.stock), 1),
+        'leftover_need': round(sum(problem.need), 1),
+    }
+
+
+def bench_optimizer(optimizer, scheduler, trip_index_module, suite: str, repeat: int, seed: int) -> Dict[str, Dict]:
+    # Холодный старт заметен на небольших планах: меряем на самом маленьком, без кэша планов
+    warehouses, enterprises, vehicles = SUITES[suite][0]
+    request = generate(seed, warehouses=warehouses, enterprises=enterprises, vehicles=vehicles)
+    results = {
+        'cold_start/optimize-routes': measure_cold_start(
+            'optimize-routes', {'httpMethod': 'POST', 'body': json.dumps(request)}, repeat, {'PLAN_CACHE_ENTRIES': '0'}
+        )
+    }
+    for warehouses, enterprises, vehicles in SUITES[suite]:
+        request = generate(seed, warehouses=warehouses, enterprises=enterprises, vehicles=vehicles)
+        size = f'{warehouses}x{enterprises}x{vehicles}'
+        event = {'httpMethod': 'POST', 'body': json.dumps(request)}
+
+        results[f'optimize_routes_full/{size}'] = {
+            **measure(lambda: optimizer.optimize_routes_full(
+                request['warehouses'], request['enterprises'], request['vehicles'], request['month']
+            ), repeat),
+            **plan_quality(optimizer, request),
+        }
+
+        # Кэш планов отдал бы повторный запрос без расчёта — меряем именно расчёт
+        def call_handler():
+            optimizer.PLAN_CACHE.max_entries = 0
+            return optimizer.handler(event, None)
+        results[f'handler/{size}'] = measure(call_handler, repeat)
+
+        # find_best_trip: по одному выбору рейса от стоянки каждой машины на нетронутой задаче
+        problem, distances = quiet(
+            optimizer.prepare_problem, request['warehouses'], request['enterprises'], request['vehicles']
+        )
+        index = trip_index_module.TripIndex(problem, distances)
+        calls = max(1, len(problem.vehicles))
+
+        def pick_trips():
+            for vehicle in problem.vehicles:
+                scheduler.find_best_trip(vehicle.parking, vehicle, problem, index)
+        timing = measure(pick_trips, repeat)
+        results[f'find_best_trip/{size}'] = {
+            'p50_us_per_call': round(timing['p50_ms'] * 1000 / calls, 3),
+            'p90_us_per_call': round(timing['p90_ms'] * 1000 / calls, 3),
+            'p99_us_per_call': round(timing['p99_ms'] * 1000 / calls, 3),
+        }
+    return results
+
+
+def bench_osrm_route(router, suite: str, repeat: int, seed: int) -> Dict[str, Dict]:
+    # Тёплый вызов того же пакета отвечает из кэша маршрутов процесса
+    first = {'httpMethod': 'POST', 'body': json.dumps({'legs': generate_legs(seed, LEG_COUNTS[suite][0])})}
+    results = {'cold_start/osrm-route': measure_cold_start('osrm-route', first, repeat, {'ROUTE_CACHE_PATH': ''})}
+    hung, hung_url = stub_osrm.start(latency=HUNG_LATENCY)
+    healthy = router.UPSTREAM
+    for count in LEG_COUNTS[suite]:
+        event = {'httpMethod': 'POST', 'body': json.dumps({'legs': generate_legs(seed, count)})}
+
+        def cold():
+            router.ROUTE_CACHE = router.cache_from_env()
+            return router.handler(event, None)
+        results[f'osrm_batch_cold/{count}'] = measure(cold, repeat)
+
+        quiet(router.handler, event, None)
+        results[f'osrm_batch_warm/{count}'] = {
+            **measure(lambda: router.handler(event, None), repeat),
+            'body_kb': round(len(quiet(router.handler, event, None)['body']) / 1024, 1),
+        }
+
+        # Как запрашивает карта: упрощение под масштаб и закодированная линия
+        encoded = {'httpMethod': 'POST', 'body': json.dumps({**json.loads(event['body']), **MAP_GEOMETRY})}
+        results[f'osrm_batch_polyline/{count}'] = {
+            **measure(lambda: router.handler(encoded, None), repeat),
+            'body_kb': round(len(quiet(router.handler, encoded, None)['body']) / 1024, 1),
+        }
+
+        compressed = {**encoded, 'headers': GZIP_HEADERS}
+        results[f'osrm_batch_gzip/{count}'] = {
+            **measure(lambda: router.handler(compressed, None), repeat),
+            'body_kb': round(len(base64.b64decode(quiet(router.handler, compressed, None)['body'])) / 1024, 1),
+        }
+
+        # OSRM не отвечает: таймаут платят только первые запросы (прогрев), дальше выключатель разомкнут
+        os.environ['OSRM_URL'] = f'{hung_url}/route/v1/driving'
+        os.environ['OSRM_TIMEOUT'] = DEGRADED_TIMEOUT
+        router.UPSTREAM = router.client_from_env(router.DEFAULT_OSRM_URL)
+
+        def degraded():
+            router.ROUTE_CACHE = router.cache_from_env()
+            return router.handler(event, None)
+        try:
+            results[f'osrm_batch_degraded/{count}'] = measure(degraded, repeat)
+        finally:
+            router.UPSTREAM = healthy
+    hung.shutdown()
+    return results
+
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    """Регрессии относительно эталона: время и память — с порогом threshold, качество — строго"""
+    regressions = []
+    for case, metrics in sorted(results.items()):
+        reference = baseline.get(case)
+        if not reference:
+            continue
+        for metric, value in metrics.items():
+            before = reference.get(metric)
+            if before is None:
+                continue
+            if metric.startswith('p') or metric == 'peak_kb':
+                # p90/p99 шумят сильнее медианы, их не проверяем
+                if metric.startswith(('p90', 'p99')):
+                    continue
+                limit = before * (1 + threshold)
+            else:
+                limit = before * (1 + QUALITY_TOLERANCE) + QUALITY_TOLERANCE
+            if value > limit:
+                regressions.append(f'{case} {metric}: {before} → {value}')
+    return regressions
+
+
+def print_table(results: Dict[str, Dict], baseline: Dict[str, Dict]) -> None:
+    for case, metrics in results.items():
+        reference = baseline.get(case, {})
+        parts = []
+        for metric, value in metrics.items():
+            before = reference.get(metric)
+            change = f' ({(value / before - 1) * 100:+.0f}%)' if before else ''
+            parts.append(f'{metric}={value}{change}')
+        print(f'{case:<36} ' + '  '.join(parts))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Бенчмарки optimize-routes и osrm-route')
+    parser.add_argument('--suite', choices=sorted(SUITES), default='quick')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', choices=('optimize', 'osrm'), help='только одна из функций')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float, default=0.25, help='допустимый рост времени и памяти (доля)')
+    parser.add_argument('--json', dest='json_path', help='записать результаты в файл')
+    args = parser.parse_args(argv)
+
+    results: Dict[str, Dict] = {}
+    if args.only != 'osrm':
+        optimizer = load_function('optimize-routes', 'optimize_routes_index')
+        import scheduler
+        import trip_index
+        results.update(bench_optimizer(optimizer, scheduler, trip_index, args.suite, args.repeat, args.seed))
+
+    if args.only != 'optimize':
+        server, url = stub_osrm.start(latency=STUB_LATENCY)
+        os.environ['ROUTE_CACHE_PATH'] = ''
+        os.environ['OSRM_URL'] = f'{url}/route/v1/driving'
+        try:
+            router = load_function('osrm-route', 'osrm_route_index')
+            results.update(bench_osrm_route(router, args.suite, args.repeat, args.seed))
+        finally:
+            server.shutdown()
+
+    baseline: Dict[str, Dict] = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    print_table(results, baseline)
+    report = {
+        'suite': args.suite,
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'Эталон записан: {args.baseline}')
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for line in regressions:
+        print(f'РЕГРЕССИЯ {line}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""
+Локальная заглушка OSRM для бенчмарков: /route/v1/driving и /table/v1/driving.
+Расстояние — по прямой × 1.25, геометрия — points точек вдоль прямой с извивами,
+как у дороги (одинаковая для одинаковых координат).
+latency добавляет задержку на каждый запрос, fail_rate — долю ответов 503.
+Соединения keep-alive (HTTP/1.1), как у настоящего OSRM за nginx.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+ROAD_FACTOR = 1.25
+
+
+def _meters(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """a, b — (lng, lat), как в URL OSRM"""
+    lat1, lat2 = math.radians(a[1]), math.radians(b[1])
+    h = math.sin((lat2 - lat1) / 2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(math.radians(b[0] - a[0]) / 2)**2
+    return 2 * 6371000 * math.asin(math.sqrt(h)) * ROAD_FACTOR
+
+
+def _coordinates(path: str) -> List[Tuple[float, float]]:
+    return [tuple(map(float, c.split(','))) for c in path.split(';')]
+
+
+def _road_geometry(a: Tuple[float, float], b: Tuple[float, float], points: int) -> List[List[float]]:
+    rng = random.Random(hash((a, b)))
+    wiggle = 0.0
+    geometry = []
+    for k in range(points + 1):
+        t = k / points
+        wiggle = 0.9 * wiggle + rng.gauss(0, 0.0004) if 0 < k < points else 0.0
+        bend = math.sin(t * math.pi * 3) * 0.01 * (0 < k < points)
+        geometry.append([a[0] + (b[0] - a[0]) * t + wiggle, a[1] + (b[1] - a[1]) * t + bend + wiggle])
+    return geometry
+
+
+class StubOsrmHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными записями: без TCP_NODELAY каждый ответ ждал бы отложенный ACK
+    disable_nagle_algorithm = True
+    latency = 0.0
+    fail_rate = 0.0
+    points = 200
+    requests = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        url = urlsplit(self.path)
+        route = re.match(r'/route/v1/driving/([^/]+)$', url.path)
+        table = re.match(r'/table/v1/driving/([^/]+)$', url.path)
+        if route:
+            a, b = _coordinates(route.group(1))[:2]
+            geometry = _road_geometry(a, b, self.points)
+            distance = _meters(a, b)
+            body = {'code': 'Ok', 'routes': [{'distance': distance, 'duration': distance / 15, 'geometry': {
+                'type': 'LineString', 'coordinates': geometry
+            }}]}
+        elif table:
+            coords = _coordinates(table.group(1))
+            query = parse_qs(url.query)
+            sources = [int(x) for x in query['sources'][0].split(';')] if 'sources' in query else range(len(coords))
+            targets = [int(x) for x in query['destinations'][0].split(';')] if 'destinations' in query else range(len(coords))
+            body = {'code': 'Ok', 'distances': [[_meters(coords[s], coords[t]) for t in targets] for s in sources]}
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Клиент не дождался медленного ответа и закрыл соединение — для заглушки это норма
+        pass
+
+
+def start(port: int = 0, latency: float = 0.0, fail_rate: float = 0.0, points: int = 200) -> Tuple[ThreadingHTTPServer, str]:
+    """Запускает заглушку в фоновом потоке; возвращает сервер и базовый URL"""
+    handler = type('StubOsrm', (StubOsrmHandler,), {'latency': latency, 'fail_rate': fail_rate, 'points': points})
+    server = StubServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Заглушка OSRM')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка ответа, с')
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server, url = start(args.port, args.latency, args.fail_rate)
+    print(f'Заглушка OSRM: {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,184 @@
+"""
+Сборка файла дорожного графа для osrm-route (см. backend/osrm-route/road_graph.py)
+из выгрузки OpenStreetMap в формате XML (.osm, .osm.gz, .osm.bz2).
+
+    python scripts/build_road_graph.py altai.osm.bz2 backend/osrm-route/road_graph.bin
+    python scripts/build_road_graph.py region.osm graph.bin --bbox 51.0,78.0,54.5,87.5
+
+Берутся дороги, по которым ездит грузовой транспорт (DRIVABLE), с учётом одностороннего движения.
+Остаётся только самая большая связная компонента: точка, привязанная к оторванному куску
+(двор, парковка), не дала бы маршрута. PBF нужно заранее перевести в XML (osmium cat, osmconvert).
+"""
+import argparse
+import bz2
+import gzip
+import math
+import os
+import sys
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend', 'osrm-route'))
+
+from road_graph import write_graph, DEFAULT_CELL_SIZE, EARTH_RADIUS_M  # noqa: E402
+
+DRIVABLE = {
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link',
+    'secondary', 'secondary_link', 'tertiary', 'tertiary_link', 'unclassified',
+    'residential', 'living_street', 'service', 'road', 'track'
+}
+ONEWAY_BY_DEFAULT = {'motorway', 'motorway_link'}
+
+BBox = Tuple[float, float, float, float]
+
+
+def open_extract(path: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    h = math.sin((p2 - p1) / 2)**2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2)**2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(h))
+
+
+def read_extract(path: str, bbox: Optional[BBox]) -> Tuple[Dict[int, Tuple[float, float]], List[Tuple[List[int], int]]]:
+    """
+    Узлы (id → широта, долгота) и дороги: (узлы по порядку, направление: 1 — по ходу, -1 — против, 0 — обе стороны).
+    В OSM XML узлы идут до дорог, поэтому координаты известны к моменту разбора дороги.
+    Разобранные элементы верхнего уровня удаляются из корня: иначе iterparse держит в памяти всё дерево.
+    """
+    nodes: Dict[int, Tuple[float, float]] = {}
+    ways: List[Tuple[List[int], int]] = []
+    refs: List[int] = []
+    tags: Dict[str, str] = {}
+    root = None
+
+    with open_extract(path) as f:
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if root is None:
+                    root = element
+                elif tag == 'way':
+                    refs, tags = [], {}
+                continue
+            if tag == 'node':
+                lat, lng = float(element.get('lat')), float(element.get('lon'))
+                if bbox is None or (bbox[0] <= lat <= bbox[2] and bbox[1] <= lng <= bbox[3]):
+                    nodes[int(element.get('id'))] = (lat, lng)
+                element.clear()
+                root.clear()
+            elif tag == 'nd':
+                refs.append(int(element.get('ref')))
+            elif tag == 'tag':
+                tags[element.get('k')] = element.get('v')
+            elif tag == 'way':
+                highway = tags.get('highway')
+                if highway in DRIVABLE and tags.get('access') not in ('no', 'private'):
+                    oneway = tags.get('oneway')
+                    if oneway in ('yes', '1', 'true') or (oneway is None and (
+                            highway in ONEWAY_BY_DEFAULT or tags.get('junction') == 'roundabout')):
+                        direction = 1
+                    elif oneway == '-1':
+                        direction = -1
+                    else:
+                        direction = 0
+                    ways.append((refs, direction))
+                element.clear()
+                root.clear()
+            elif tag == 'relation':
+                element.clear()
+                root.clear()
+    return nodes, ways
+
+
+def largest_component(count: int, edges: List[Tuple[int, int, float]]) -> List[bool]:
+    """Узлы самой большой слабо связной компоненты (система непересекающихся множеств)"""
+    parent = list(range(count))
+
+    def find(v: int) -> int:
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    for u, v, _ in edges:
+        ru, rv = find(u), find(v)
+        if ru != rv:
+            parent[ru] = rv
+
+    sizes: Dict[int, int] = {}
+    for v in range(count):
+        root = find(v)
+        sizes[root] = sizes.get(root, 0) + 1
+    biggest = max(sizes, key=sizes.get) if sizes else -1
+    return [find(v) == biggest for v in range(count)]
+
+
+def build(path: str, output: str, bbox: Optional[BBox] = None, cell_size: float = DEFAULT_CELL_SIZE) -> Tuple[int, int]:
+    started = time.time()
+    nodes, ways = read_extract(path, bbox)
+    print(f'Прочитано: {len(nodes)} узлов, {len(ways)} дорог ({time.time() - started:.1f} с)')
+
+    index: Dict[int, int] = {}
+    lats: List[float] = []
+    lngs: List[float] = []
+    edges: List[Tuple[int, int, float]] = []
+    for refs, direction in ways:
+        previous = None
+        for ref in refs:
+            point = nodes.get(ref)
+            if point is None:
+                previous = None  # дорога выходит за границы выгрузки
+                continue
+            v = index.get(ref)
+            if v is None:
+                v = index[ref] = len(lats)
+                lats.append(point[0])
+                lngs.append(point[1])
+            if previous is not None and previous != v:
+                length = haversine(lats[previous], lngs[previous], lats[v], lngs[v])
+                if direction >= 0:
+                    edges.append((previous, v, length))
+                if direction <= 0:
+                    edges.append((v, previous, length))
+            previous = v
+
+    keep = largest_component(len(lats), edges)
+    renumber: Dict[int, int] = {}
+    kept_lats: List[float] = []
+    kept_lngs: List[float] = []
+    for v, ok in enumerate(keep):
+        if ok:
+            renumber[v] = len(kept_lats)
+            kept_lats.append(lats[v])
+            kept_lngs.append(lngs[v])
+    kept_edges = [(renumber[u], renumber[v], w) for u, v, w in edges if keep[u]]
+
+    count, edge_count = write_graph(output, kept_lats, kept_lngs, kept_edges, cell_size)
+    size = os.path.getsize(output) / 1024 / 1024
+    print(f'Граф: {count} узлов, {edge_count} дуг, {size:.1f} МБ → {output} ({time.time() - started:.1f} с)')
+    return count, edge_count
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Сборка дорожного графа для osrm-route из выгрузки OSM')
+    parser.add_argument('extract', help='выгрузка OSM XML (.osm, .osm.gz, .osm.bz2)')
+    parser.add_argument('output', help='файл графа (ROAD_GRAPH_PATH функции osrm-route)')
+    parser.add_argument('--bbox', help='юг,запад,север,восток — обрезать выгрузку')
+    parser.add_argument('--cell-size', type=float, default=DEFAULT_CELL_SIZE, help='размер ячейки сетки, градусы')
+    args = parser.parse_args(argv)
+
+    bbox = tuple(float(x) for x in args.bbox.split(',')) if args.bbox else None
+    build(args.extract, args.output, bbox, args.cell_size)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,10 @@
 import { useEffect, useRef, useState } from 'react';
 import L from 'leaflet';
 import 'leaflet/dist/leaflet.css';
+import { decodePolyline } from '@/lib/polyline';
+
+// Не больше отрезков в одном запросе к osrm-route (MAX_BATCH_LEGS на сервере)
+const MAX_BATCH_LEGS = 2000;
 
 export default function MapView() {
   const mapRef = useRef<HTMLDivElement>(null);
@@ -105,62 +109,121 @@ export default function MapView() {
       markersRef.current.push(marker);
     });
 
-    // Добавляем маршруты (polylines)
+    // Добавляем маршруты (polylines): отрезки пакетными запросами
     const colors = ['#e74c3c', '#3498db', '#2ecc71', '#f39c12', '#9b59b6'];
-    routes.forEach((r, i) => {
-      if (r.fromLat && r.fromLng && r.toLat && r.toLng) {
-        console.log(`MapView: строим OSRM маршрут ${i + 1}:`, r);
-        fetch('https://functions.poehali.dev/8c14fdf7-df73-472b-acb5-44da8dd5152b', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            fromLat: r.fromLat,
-            fromLng: r.fromLng,
-            toLat: r.toLat,
-            toLng: r.toLng
-          })
-        })
-          .then(res => res.json())
-          .then(data => {
-            console.log(`MapView: OSRM маршрут ${i + 1} получен:`, data);
-            const isRealRoute = !data.fallback;
-            
-            const polyline = L.polyline(data.coordinates, {
-              color: colors[i % colors.length],
-              weight: isRealRoute ? 4 : 3,
-              opacity: isRealRoute ? 0.8 : 0.6,
-              dashArray: isRealRoute ? undefined : '10, 10'
-            }).addTo(map).bindPopup(
-              `<strong>${r.from} → ${r.to}</strong><br/>` +
-              (r.vehicle ? `Машина: ${r.vehicle} (${r.vehicleType})<br/>` : '') +
-              `Продукт: ${r.product}<br/>` +
-              `Объём: ${r.volume} м³<br/>` +
-              `Расстояние: ${data.distance || r.distance} км<br/>` +
-              (r.parkingDistance ? `Пробег от стоянки: ${r.parkingDistance} км<br/>` : '') +
-              (data.duration ? `Время: ~${data.duration} мин<br/>` : '') +
-              `<small>${data.fallback ? '⚠️ Примерный маршрут' : '✓ Маршрут по дорогам'}</small>`
-            );
-            
-            polylinesRef.current.push(polyline);
-          })
-          .catch(() => {
-            const polyline = L.polyline(
-              [[r.fromLat, r.fromLng], [r.toLat, r.toLng]],
-              {
-                color: colors[i % colors.length],
-                weight: 3,
-                opacity: 0.6,
-                dashArray: '10, 10'
-              }
-            ).addTo(map).bindPopup(
-              `<strong>${r.from} → ${r.to}</strong><br/>` +
-              `Объём: ${r.volume} м³`
-            );
-            
-            polylinesRef.current.push(polyline);
-          });
+    const drawable = routes
+      .map((r, i) => ({ r, i }))
+      .filter(({ r }) => r.fromLat && r.fromLng && r.toLat && r.toLng);
+
+    // Точки рейса: склад, склады догрузки по пути (via), предприятие
+    const stopsOf = (r: any): [number, number][] => [
+      [r.fromLat, r.fromLng],
+      ...(r.via || []).map((v: any) => [v.lat, v.lng] as [number, number]),
+      [r.toLat, r.toLng]
+    ];
+
+    const addFallbackLine = (r: any, i: number) => {
+      const polyline = L.polyline(
+        stopsOf(r),
+        {
+          color: colors[i % colors.length],
+          weight: 3,
+          opacity: 0.6,
+          dashArray: '10, 10'
+        }
+      ).addTo(map).bindPopup(
+        `<strong>${r.from} → ${r.to}</strong><br/>` +
+        `Объём: ${r.volume} м³`
+      );
+
+      polylinesRef.current.push(polyline);
+    };
+
+    if (drawable.length === 0) return;
+
+    // Каждый рейс — несколько отрезков подряд: legStart[k] — номер его первого отрезка в пакете
+    const legs: any[] = [];
+    const legStart: number[] = [];
+    drawable.forEach(({ r }) => {
+      const stops = stopsOf(r);
+      legStart.push(legs.length);
+      for (let s = 1; s < stops.length; s++) {
+        legs.push({
+          fromLat: stops[s - 1][0],
+          fromLng: stops[s - 1][1],
+          toLat: stops[s][0],
+          toLng: stops[s][1]
+        });
       }
     });
+
+    // Большой план — несколькими пакетами по MAX_BATCH_LEGS отрезков; ответы склеиваются по порядку,
+    // поэтому legStart остаётся верным. Неудачный пакет даёт примерные линии только своим рейсам
+    const fetchChunk = (chunk: any[]): Promise<any[]> =>
+      fetch('https://functions.poehali.dev/8c14fdf7-df73-472b-acb5-44da8dd5152b', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          // Линии упрощаются с запасом в 3 уровня масштаба: при приближении разницы не видно
+          zoom: Math.min(map.getZoom() + 3, 18),
+          format: 'polyline6',
+          legs: chunk
+        })
+      })
+        .then(res => res.ok ? res.json() : Promise.reject(new Error(`HTTP ${res.status}`)))
+        .then(batch => {
+          const received = batch.legs || [];
+          return chunk.map((_, j) => received[j] ?? null);
+        })
+        .catch(() => chunk.map(() => null));
+
+    const chunks: any[][] = [];
+    for (let start = 0; start < legs.length; start += MAX_BATCH_LEGS) {
+      chunks.push(legs.slice(start, start + MAX_BATCH_LEGS));
+    }
+
+    console.log(`MapView: строим OSRM маршруты пакетами: ${drawable.length} рейсов, ${chunks.length} запросов`);
+    Promise.all(chunks.map(fetchChunk))
+      .then(results => {
+        const batchLegs = results.flat();
+        console.log(`MapView: OSRM маршруты получены (отрезков: ${batchLegs.filter(Boolean).length})`);
+        drawable.forEach(({ r, i }, k) => {
+          const parts = batchLegs.slice(legStart[k], legStart[k] + stopsOf(r).length - 1);
+          const pieces = parts.map((leg: any) => leg?.polyline ? decodePolyline(leg.polyline, leg.precision) : leg?.coordinates);
+          if (parts.length === 0 || pieces.some((piece: any) => !piece)) {
+            addFallbackLine(r, i);
+            return;
+          }
+          const coordinates = pieces.flat();
+          const data = {
+            distance: Math.round(parts.reduce((sum: number, leg: any) => sum + (leg.distance || 0), 0) * 10) / 10,
+            duration: Math.round(parts.reduce((sum: number, leg: any) => sum + (leg.duration || 0), 0)),
+            fallback: parts.some((leg: any) => leg.fallback)
+          };
+          const isRealRoute = !data.fallback;
+
+          const polyline = L.polyline(coordinates, {
+            color: colors[i % colors.length],
+            weight: isRealRoute ? 4 : 3,
+            opacity: isRealRoute ? 0.8 : 0.6,
+            dashArray: isRealRoute ? undefined : '10, 10'
+          }).addTo(map).bindPopup(
+            `<strong>${[r.from, ...(r.via || []).map((v: any) => v.name), r.to].join(' → ')}</strong><br/>` +
+            (r.vehicle ? `Машина: ${r.vehicle} (${r.vehicleType})<br/>` : '') +
+            `Продукт: ${r.product}<br/>` +
+            `Объём: ${r.volume} м³<br/>` +
+            `Расстояние: ${data.distance || r.distance} км<br/>` +
+            (r.parkingDistance ? `Пробег от стоянки: ${r.parkingDistance} км<br/>` : '') +
+            (data.duration ? `Время: ~${data.duration} мин<br/>` : '') +
+            `<small>${data.fallback ? '⚠️ Примерный маршрут' : '✓ Маршрут по дорогам'}</small>`
+          );
+
+          polylinesRef.current.push(polyline);
+        });
+      })
+      .catch(() => {
+        drawable.forEach(({ r, i }) => addFallbackLine(r, i));
+      });
   }, [locations, routes]);
 
   return <div ref={mapRef} className="h-full w-full" />;
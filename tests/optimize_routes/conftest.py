@@ -0,0 +1,12 @@
+"""
+Модули функции optimize-routes импортируются по имени, как в среде функций.
+index и codec есть в обеих функциях: их версии из другой функции выгружаются.
+"""
+import os
+import sys
+
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'backend', 'optimize-routes'))
+
+sys.path.insert(0, FUNCTION_DIR)
+for name in ('index', 'codec'):
+    sys.modules.pop(name, None)
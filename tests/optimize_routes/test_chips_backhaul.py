@@ -0,0 +1,64 @@
+"""Щепа с Завода на Павловский ДОК: универсал, догруженный на несколько точек, выгружается на Заводе последним"""
+import json
+
+import index
+
+
+def universal(parking, products):
+    return {
+        'number': 'У111УУ', 'category': 'Универсал', 'volume': 30, 'status': 'active',
+        'enterprise': parking, 'productTypes': products + ['Щепа']
+    }
+
+
+DOK = {'id': 9, 'name': 'Павловский ДОК', 'lat': 53.25, 'lng': 83.60, 'needs': {}}
+
+
+def call(body):
+    index.PLAN_CACHE._entries.clear()
+    response = index.handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    return json.loads(response['body'])['routes']
+
+
+def legs(routes):
+    return [(route['from'], route['to'], route['product']) for route in routes]
+
+
+def test_factory_drop_is_moved_last_and_gets_chips():
+    # Ближайшая к Котельной точка — Завод, но после него в кузове была бы ещё рейка для Школы
+    routes = call({
+        'month': 'Январь 2025',
+        'warehouses': [{'id': 1, 'name': 'Склад', 'lat': 53.40, 'lng': 83.70,
+                        'stocks': {'Брус': 10, 'Доски': 10, 'Рейка': 10}}],
+        'enterprises': [
+            {'id': 1, 'name': 'Котельная', 'lat': 53.395, 'lng': 83.705, 'needs': {'Брус': 10}},
+            {'id': 2, 'name': 'Завод', 'lat': 53.385, 'lng': 83.712, 'needs': {'Доски': 10}},
+            {'id': 3, 'name': 'Школа', 'lat': 53.382, 'lng': 83.730, 'needs': {'Рейка': 10}},
+            DOK
+        ],
+        'vehicles': [universal('Котельная', ['Брус', 'Доски', 'Рейка'])]
+    })
+    assert legs(routes) == [
+        ('Склад', 'Котельная', 'Брус'),
+        ('Котельная', 'Школа', 'Рейка'),
+        ('Школа', 'Завод', 'Доски'),
+        ('Завод', 'Павловский ДОК', 'Щепа')
+    ]
+
+
+def test_trip_to_factory_has_no_other_drops():
+    routes = call({
+        'month': 'Январь 2025',
+        'warehouses': [{'id': 1, 'name': 'Склад', 'lat': 53.40, 'lng': 83.70, 'stocks': {'Брус': 20, 'Доски': 10}}],
+        'enterprises': [
+            {'id': 1, 'name': 'Завод', 'lat': 53.34, 'lng': 83.76, 'needs': {'Брус': 20}},
+            {'id': 2, 'name': 'Котельная', 'lat': 53.36, 'lng': 83.80, 'needs': {'Доски': 10}},
+            DOK
+        ],
+        'vehicles': [universal('Завод', ['Брус', 'Доски'])]
+    })
+    assert legs(routes) == [
+        ('Склад', 'Завод', 'Брус'),
+        ('Завод', 'Павловский ДОК', 'Щепа'),
+        ('Склад', 'Котельная', 'Доски')
+    ]
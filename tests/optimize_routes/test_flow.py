@@ -0,0 +1,48 @@
+"""Режим flow против жадного: тот же объём, меньший пробег"""
+import json
+
+import pytest
+
+import index
+
+# Жадный план везёт ближний склад на ближний завод, и к дальнему заводу машина едет с дальнего склада
+REQUEST = {
+    'month': 'Январь 2025',
+    'warehouses': [
+        {'id': 1, 'name': 'Склад А', 'lat': 53.454, 'lng': 83.761, 'stocks': {'Доски': 30}},
+        {'id': 2, 'name': 'Склад Б', 'lat': 53.474, 'lng': 83.827, 'stocks': {'Доски': 30}}
+    ],
+    'enterprises': [
+        {'id': 1, 'name': 'Завод К', 'lat': 53.427, 'lng': 83.821, 'needs': {'Доски': 30}},
+        {'id': 2, 'name': 'Завод Л', 'lat': 53.304, 'lng': 83.748, 'needs': {'Доски': 30}}
+    ],
+    'vehicles': [{
+        'number': 'А123БВ', 'category': 'Лесовоз', 'volume': 30, 'status': 'active',
+        'enterprise': 'Завод К', 'productTypes': ['Доски']
+    }]
+}
+
+
+def call(body):
+    index.PLAN_CACHE._entries.clear()
+    response = index.handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    return json.loads(response['body'])
+
+
+@pytest.fixture(scope='module')
+def plans():
+    return call(REQUEST), call({**REQUEST, 'mode': 'flow'})
+
+
+def test_flow_is_shorter_than_greedy(plans):
+    greedy, flow = plans
+    assert greedy['summary']['total_distance'] == 34.8
+    assert flow['summary']['total_distance'] == 32.2
+    assert flow['summary']['total_volume'] == greedy['summary']['total_volume'] == 60
+    assert flow['summary']['trips_count'] == greedy['summary']['trips_count'] == 2
+
+
+def test_flow_swaps_assignment(plans):
+    greedy, flow = plans
+    assert [(r['from'], r['to']) for r in greedy['routes']] == [('Склад А', 'Завод К'), ('Склад Б', 'Завод Л')]
+    assert [(r['from'], r['to']) for r in flow['routes']] == [('Склад Б', 'Завод К'), ('Склад А', 'Завод Л')]
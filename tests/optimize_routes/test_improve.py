@@ -0,0 +1,74 @@
+"""Улучшение плана: пробег уменьшается, самая загруженная машина не становится загруженнее"""
+import json
+from collections import defaultdict
+
+import pytest
+
+import index
+from scheduler import AVERAGE_SPEED_KMH, HANDLING_HOURS
+
+
+def lumber_truck(number, parking):
+    return {
+        'number': number, 'category': 'Лесовоз', 'volume': 30, 'status': 'active',
+        'enterprise': parking, 'productTypes': ['Доски']
+    }
+
+
+# Жадный план здесь гоняет машины порожняком между далёкими складами (63.1 км против 48.5 км)
+REQUEST = {
+    'month': 'Январь 2025',
+    'warehouses': [
+        {'id': 1, 'name': 'Склад А', 'lat': 53.414, 'lng': 83.711, 'stocks': {'Доски': 60}},
+        {'id': 2, 'name': 'Склад Б', 'lat': 53.364, 'lng': 83.861, 'stocks': {'Доски': 90}}
+    ],
+    'enterprises': [
+        {'id': 1, 'name': 'Завод К', 'lat': 53.424, 'lng': 83.707, 'needs': {'Доски': 90}},
+        {'id': 2, 'name': 'Завод Л', 'lat': 53.388, 'lng': 83.768, 'needs': {'Доски': 90}}
+    ],
+    'vehicles': [lumber_truck('А123БВ', 'Завод Л'), lumber_truck('В456ГД', 'Завод Л')]
+}
+
+
+def call(body):
+    index.PLAN_CACHE._entries.clear()
+    response = index.handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    return json.loads(response['body'])
+
+
+def busy_hours(routes):
+    """Занятость машин так же, как её считает improve.LocalSearch: пробег / скорость + погрузка по записям"""
+    mileage, records = defaultdict(float), defaultdict(int)
+    for route in routes:
+        mileage[route['vehicle']] += route['distance'] + route['parkingDistance']
+        records[route['vehicle']] += 1
+    return {v: mileage[v] / AVERAGE_SPEED_KMH + HANDLING_HOURS * records[v] for v in mileage}
+
+
+@pytest.fixture(scope='module')
+def plans():
+    greedy = call(REQUEST)
+    improved = call({**REQUEST, 'timeBudgetMs': 1000})
+    return greedy, improved
+
+
+def test_improvement_shortens_greedy_plan(plans):
+    greedy, improved = plans
+    report = improved['summary']['improvement']
+    assert report['moves_applied'] > 0
+    assert report['distance_after'] < report['distance_before']
+    assert report['distance_before'] == pytest.approx(greedy['summary']['total_distance'], abs=0.2)
+    assert improved['summary']['total_distance'] < greedy['summary']['total_distance']
+
+
+def test_improvement_keeps_deliveries(plans):
+    greedy, improved = plans
+    assert improved['summary']['total_volume'] == greedy['summary']['total_volume']
+    assert improved['total_routes'] == greedy['total_routes']
+
+
+def test_improvement_respects_makespan(plans):
+    greedy, improved = plans
+    # Расстояния в ответе округлены до 0.1 км
+    tolerance = 0.1 * len(improved['routes']) / AVERAGE_SPEED_KMH
+    assert max(busy_hours(improved['routes']).values()) <= max(busy_hours(greedy['routes']).values()) + tolerance
@@ -0,0 +1,148 @@
+"""OsrmTableProvider против локальной заглушки OSRM (bench/stub_osrm.py)"""
+import json
+import math
+import os
+import sys
+import threading
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'bench')))
+
+import distances
+import stub_osrm
+from distances import DistanceMatrix, HaversineProvider, OsrmTableProvider, MISSING_DISTANCE
+
+# Точка, которая не привязывается к дороге (OSRM отдаёт null), и точка, на которой сервер падает
+UNSNAPPED = (53.5, 83.9)
+BROKEN = (53.6, 84.0)
+
+
+def road_meters(source, target):
+    """Расстояние заглушки: в сторону роста широты дорога вдвое длиннее — матрица несимметрична"""
+    meters = stub_osrm._meters(source, target)
+    return meters * 2 if target[1] > source[1] else meters
+
+
+class TableHandler(stub_osrm.StubOsrmHandler):
+    tables = []
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        coords = stub_osrm._coordinates(url.path.rsplit('/', 1)[1])
+        query = parse_qs(url.query)
+        sources = [int(x) for x in query['sources'][0].split(';')]
+        targets = [int(x) for x in query['destinations'][0].split(';')]
+        type(self).tables.append((len(sources), len(targets)))
+        if (BROKEN[1], BROKEN[0]) in coords:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        unsnapped = (UNSNAPPED[1], UNSNAPPED[0])
+        body = json.dumps({'code': 'Ok', 'distances': [
+            [None if unsnapped in (coords[s], coords[t]) else road_meters(coords[s], coords[t]) for t in targets]
+            for s in sources
+        ]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    server = stub_osrm.StubServer(('127.0.0.1', 0), TableHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    distances._road_distance_cache.clear()
+    TableHandler.tables = []
+    yield
+    distances._road_distance_cache.clear()
+
+
+def grid(count):
+    return [(53.30 + 0.01 * k, 83.70 + 0.013 * (k % 3)) for k in range(count)]
+
+
+def expected_km(points, i, j):
+    if i == j:
+        return 0.0
+    a, b = points[i], points[j]
+    return round(road_meters((a[1], a[0]), (b[1], b[0])) / 1000, 2)
+
+
+def test_chunked_matrix_matches_server(server_url):
+    points = grid(7)
+    provider = OsrmTableProvider(base_url=server_url, chunk_size=3)
+    rows = provider.rows(points, list(range(7)))
+    for i in range(7):
+        for j in range(7):
+            assert rows[i][j] == expected_km(points, i, j), (i, j)
+    # 7 источников × 7 назначений блоками 3 × 3
+    assert provider.requests == 9
+    assert max(max(block) for block in TableHandler.tables) <= 3
+    assert rows[0][6] != rows[6][0]
+
+
+def test_source_subset_and_cache(server_url):
+    points = grid(5)
+    provider = OsrmTableProvider(base_url=server_url, chunk_size=50)
+    first = provider.rows(points, [1, 3])
+    assert first == [[expected_km(points, i, j) for j in range(5)] for i in (1, 3)]
+    assert provider.requests == 1
+
+    again = OsrmTableProvider(base_url=server_url)
+    assert again.rows(points, [3, 1]) == [first[1], first[0]]
+    assert again.requests == 0
+    assert again.cached_pairs == 8
+
+
+def test_unsnapped_pairs_fall_back_and_are_not_cached(server_url):
+    points = grid(3) + [UNSNAPPED]
+    provider = OsrmTableProvider(base_url=server_url)
+    rows = provider.rows(points, list(range(4)))
+    straight = HaversineProvider().rows(points, list(range(4)))
+    for k in range(3):
+        assert rows[k][3] == straight[k][3]
+        assert rows[3][k] == straight[3][k]
+        assert rows[0][k] == expected_km(points, 0, k)
+    assert not any(UNSNAPPED in pair for pair in distances._road_distance_cache)
+
+
+def test_failed_block_falls_back(server_url):
+    points = grid(3) + [BROKEN]
+    provider = OsrmTableProvider(base_url=server_url, chunk_size=2)
+    rows = provider.rows(points, list(range(4)))
+    straight = HaversineProvider().rows(points, list(range(4)))
+    # Блоки с BROKEN (источники 2–3 или назначения 2–3) — по прямой, блок 0–1 × 0–1 — с сервера
+    assert provider.failed_chunks == 3
+    assert rows[0][1] == expected_km(points, 0, 1)
+    assert rows[1][0] == expected_km(points, 1, 0)
+    for i, j in ((0, 2), (2, 0), (1, 3), (3, 2)):
+        assert rows[i][j] == straight[i][j]
+
+
+def test_invalid_points_are_missing(server_url):
+    points = grid(2) + [(None, None)]
+    rows = OsrmTableProvider(base_url=server_url).rows(points, [0, 2])
+    assert rows[0][2] == MISSING_DISTANCE
+    assert rows[1] == [MISSING_DISTANCE] * 3
+
+
+def test_distance_matrix_uses_road_distances(server_url):
+    warehouses = [{'id': 1, 'name': 'Склад А', 'lat': 53.30, 'lng': 83.70}]
+    enterprises = [{'id': 1, 'name': 'Завод Б', 'lat': 53.32, 'lng': 83.72}]
+    matrix = DistanceMatrix(enterprises, warehouses, OsrmTableProvider(base_url=server_url))
+    # Индексы: предприятия, затем склады
+    points = [(53.32, 83.72), (53.30, 83.70)]
+    assert matrix.between(0, 1) == expected_km(points, 0, 1)
+    assert matrix.between(1, 0) == expected_km(points, 1, 0)
+    assert not math.isclose(matrix.between(0, 1), matrix.between(1, 0))
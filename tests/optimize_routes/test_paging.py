@@ -0,0 +1,61 @@
+"""Постраничная выдача: курсоры из ответов, до последней страницы"""
+import json
+
+import pytest
+
+import index
+
+FUEL = 'Бензин АИ-95'
+
+REQUEST = {
+    'month': 'Январь 2025',
+    'warehouses': [{'id': 1, 'name': 'Склад А', 'lat': 53.356, 'lng': 83.769, 'stocks': {FUEL: 500, 'Дизель': 300}}],
+    'enterprises': [{'id': 1, 'name': 'Завод Б', 'lat': 53.348, 'lng': 83.776, 'needs': {FUEL: 200}}],
+    'vehicles': [{
+        'number': 'А123БВ', 'category': 'Бензовоз', 'volume': 30, 'status': 'active',
+        'enterprise': 'Завод Б', 'productTypes': [FUEL, 'Дизель']
+    }]
+}
+
+
+def call(body):
+    response = index.handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    index.PLAN_CACHE._entries.clear()
+    yield
+    index.PLAN_CACHE._entries.clear()
+
+
+def test_pages_follow_cursor_to_the_end():
+    _, full = call(REQUEST)
+    index.PLAN_CACHE._entries.clear()
+
+    _, first = call({**REQUEST, 'pageSize': 10})
+    assert first['plan_id'] == full['plan_id']
+    assert first['total_routes'] == len(full['routes'])
+    routes, cursor, pages = list(first['routes']), first['next_cursor'], 1
+    while cursor:
+        status, body = call({'cursor': cursor, 'pageSize': 10})
+        assert status == 200
+        assert len(body['routes']) <= 10
+        routes.extend(body['routes'])
+        cursor, pages = body['next_cursor'], pages + 1
+    assert routes == full['routes']
+    assert pages == -(-len(full['routes']) // 10)
+
+
+def test_last_page_has_no_cursor():
+    _, body = call({**REQUEST, 'pageSize': 1000})
+    assert body['next_cursor'] is None
+    assert len(body['routes']) == body['total_routes']
+
+
+def test_bad_and_unknown_cursors():
+    status, body = call({'cursor': 'nonsense', 'pageSize': 10})
+    assert status == 400
+    status, body = call({'cursor': 'unknown:10', 'pageSize': 10})
+    assert status == 404
@@ -0,0 +1,78 @@
+"""Дельты к плану из кэша: ремонт, повтор дельты и полный запрос того же плана"""
+import json
+
+import pytest
+
+import index
+
+FUEL = 'Бензин АИ-95'
+
+
+def vehicle(number, parking):
+    return {
+        'number': number, 'category': 'Бензовоз', 'volume': 30, 'status': 'active',
+        'enterprise': parking, 'productTypes': [FUEL]
+    }
+
+
+FULL_REQUEST = {
+    'month': 'Январь 2025',
+    'warehouses': [{'id': 1, 'name': 'Склад А', 'lat': 53.356, 'lng': 83.769, 'stocks': {FUEL: 400}}],
+    'enterprises': [
+        {'id': 1, 'name': 'Завод Б', 'lat': 53.348, 'lng': 83.776, 'needs': {FUEL: 400}},
+        {'id': 2, 'name': 'Завод В', 'lat': 53.30, 'lng': 83.70, 'needs': {}}
+    ],
+    'vehicles': [vehicle('А123БВ', 'Завод Б'), vehicle('В456ГД', 'Завод В')]
+}
+DEACTIVATE = {'vehicles': [{'number': 'В456ГД', 'status': 'inactive'}]}
+
+
+def call(body):
+    response = index.handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    index.PLAN_CACHE._entries.clear()
+    yield
+    index.PLAN_CACHE._entries.clear()
+
+
+def test_deactivated_vehicle_load_goes_to_remaining_fleet():
+    _, fresh = call(FULL_REQUEST)
+    assert fresh['plan_source'] == 'fresh'
+    assert fresh['summary']['total_volume'] == 400
+    assert fresh['summary']['vehicles_used'] == 2
+
+    status, repaired = call({'basePlanId': fresh['plan_id'], 'changes': DEACTIVATE})
+    assert status == 200
+    assert repaired['plan_source'] == 'repaired'
+    assert repaired['summary']['total_volume'] == 400
+    assert {route['vehicle'] for route in repaired['routes']} == {'А123БВ'}
+
+
+def test_repeated_delta_is_served_from_cache():
+    _, fresh = call(FULL_REQUEST)
+    _, repaired = call({'basePlanId': fresh['plan_id'], 'changes': DEACTIVATE})
+    _, again = call({'basePlanId': fresh['plan_id'], 'changes': DEACTIVATE})
+    assert again['plan_source'] == 'cached'
+    assert again['plan_id'] == repaired['plan_id']
+    assert again['routes'] == repaired['routes']
+
+
+def test_full_request_is_not_answered_with_repaired_plan():
+    _, fresh = call(FULL_REQUEST)
+    _, repaired = call({'basePlanId': fresh['plan_id'], 'changes': DEACTIVATE})
+
+    full = json.loads(json.dumps(FULL_REQUEST))
+    full['vehicles'][1]['status'] = 'inactive'
+    _, solved = call(full)
+    assert solved['plan_source'] == 'fresh'
+    assert solved['plan_id'] != repaired['plan_id']
+
+
+def test_delta_to_unknown_plan_is_404():
+    status, body = call({'basePlanId': 'unknown', 'changes': DEACTIVATE})
+    assert status == 404
+    assert 'error' in body
@@ -0,0 +1,15 @@
+"""
+Модули функции osrm-route импортируются по имени, как в среде функций.
+index и codec есть в обеих функциях: их версии из другой функции выгружаются.
+Кэш маршрутов в тестах только в памяти, дорожного графа нет.
+"""
+import os
+import sys
+
+FUNCTION_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'backend', 'osrm-route'))
+
+os.environ['ROUTE_CACHE_PATH'] = ''
+os.environ.pop('ROAD_GRAPH_PATH', None)
+sys.path.insert(0, FUNCTION_DIR)
+for name in ('index', 'codec'):
+    sys.modules.pop(name, None)
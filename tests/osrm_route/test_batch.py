@@ -0,0 +1,32 @@
+"""Пакет отрезков: ошибка на одном отрезке остаётся в его ячейке"""
+import json
+
+import index
+
+GOOD = {'fromLat': 53.30, 'fromLng': 83.70, 'toLat': 53.32, 'toLng': 83.72}
+BROKEN = {'fromLat': 53.40, 'fromLng': 83.80, 'toLat': 53.42, 'toLng': 83.82}
+
+
+def test_failing_leg_does_not_fail_batch(monkeypatch):
+    build_view = index.build_view
+
+    def flaky_view(leg, geometry):
+        if leg == tuple(BROKEN.values()):
+            raise KeyError('routes')
+        return build_view(leg, geometry)
+
+    monkeypatch.setattr(index, 'build_view', flaky_view)
+    monkeypatch.setattr(index, 'fetch_osrm_route', lambda leg: None)
+    response = index.handler({'httpMethod': 'POST', 'body': json.dumps({'legs': [GOOD, BROKEN, GOOD]})}, None)
+    assert response['statusCode'] == 200
+    legs = json.loads(response['body'])['legs']
+    assert legs[1] == {'error': "'routes'"}
+    assert legs[0] == legs[2]
+    assert legs[0]['fallback'] is True
+
+
+def test_parse_leg_accepts_zero_and_rejects_strings():
+    assert index.parse_leg({'fromLat': 0, 'fromLng': 0.0, 'toLat': 1, 'toLng': 1}) == (0, 0.0, 1, 1)
+    assert index.parse_leg({'fromLat': '53', 'fromLng': 83, 'toLat': 53, 'toLng': 84}) is None
+    assert index.parse_leg({'fromLat': True, 'fromLng': 83, 'toLat': 53, 'toLng': 84}) is None
+    assert index.parse_leg({'fromLat': 53, 'fromLng': 83, 'toLat': 53}) is None
@@ -0,0 +1,165 @@
+"""Дорожный граф: сборка из OSM XML, формат CSR, привязка точек и A* против Дейкстры"""
+import heapq
+import math
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'scripts')))
+
+import build_road_graph
+from road_graph import RoadGraph, MICRODEGREES
+
+ROWS, COLS = 8, 8
+LAT0, LNG0, STEP = 53.30, 83.70, 0.004
+
+
+def grid_osm():
+    """
+    Решётка ROWS × COLS: часть улиц односторонние, часть перекрёстков без связи.
+    Плюс пешеходная дорожка и оторванный двор — в граф они попасть не должны.
+    """
+    rng = random.Random(7)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<osm version="0.6">']
+    for r in range(ROWS):
+        for c in range(COLS):
+            lines.append(f'<node id="{r * COLS + c + 1}" lat="{LAT0 + r * STEP:.6f}" lon="{LNG0 + c * STEP * 1.5:.6f}"/>')
+    lines.append(f'<node id="900" lat="{LAT0 + 0.2:.6f}" lon="{LNG0:.6f}"/>')
+    lines.append(f'<node id="901" lat="{LAT0 + 0.2:.6f}" lon="{LNG0 + 0.001:.6f}"/>')
+    way = 1000
+
+    def add_way(refs, tags):
+        nonlocal way
+        way += 1
+        lines.append(f'<way id="{way}">')
+        lines.extend(f'<nd ref="{ref}"/>' for ref in refs)
+        lines.extend(f'<tag k="{k}" v="{v}"/>' for k, v in tags.items())
+        lines.append('</way>')
+
+    for r in range(ROWS):
+        for c in range(COLS):
+            node = r * COLS + c + 1
+            for neighbour in ([node + 1] if c + 1 < COLS else []) + ([node + COLS] if r + 1 < ROWS else []):
+                if rng.random() < 0.15:
+                    continue
+                tags = {'highway': 'residential'}
+                if rng.random() < 0.3:
+                    tags['oneway'] = rng.choice(['yes', '-1'])
+                add_way([node, neighbour], tags)
+    add_way([1, ROWS * COLS], {'highway': 'footway'})
+    add_way([900, 901], {'highway': 'service'})
+    lines.append('<relation id="5000"><member type="way" ref="1001" role=""/><tag k="type" v="route"/></relation>')
+    lines.append('</osm>')
+    return '\n'.join(lines)
+
+
+@pytest.fixture(scope='module')
+def graph(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('road_graph')
+    extract = folder / 'grid.osm'
+    extract.write_text(grid_osm())
+    build_road_graph.build(str(extract), str(folder / 'grid.bin'), cell_size=0.01)
+    road_graph = RoadGraph(str(folder / 'grid.bin'))
+    yield road_graph
+    road_graph.close()
+
+
+def arcs(csr):
+    offsets, targets, weights = csr
+    return [(u, targets[e], weights[e]) for u in range(len(offsets) - 1) for e in range(offsets[u], offsets[u + 1])]
+
+
+def dijkstra(graph, source, target):
+    offsets, targets, weights = graph.forward
+    dist, heap = {source: 0.0}, [(0.0, source)]
+    while heap:
+        d, u = heapq.heappop(heap)
+        if u == target:
+            return d
+        if d > dist[u]:
+            continue
+        for e in range(offsets[u], offsets[u + 1]):
+            nd = d + weights[e]
+            if nd < dist.get(targets[e], math.inf):
+                dist[targets[e]] = nd
+                heapq.heappush(heap, (nd, targets[e]))
+    return None
+
+
+def test_csr_layout(graph):
+    forward, backward = arcs(graph.forward), arcs(graph.backward)
+    assert graph.forward[0][0] == graph.backward[0][0] == 0
+    assert graph.forward[0][graph.node_count] == len(forward) == graph.edge_count
+    assert sorted((v, u, w) for u, v, w in forward) == backward
+    assert all(w > 0 for _, _, w in forward)
+    # Одностороннее движение: есть дуги без встречной
+    pairs = {(u, v) for u, v, _ in forward}
+    assert any((v, u) not in pairs for u, v in pairs)
+
+
+def test_largest_component_only(graph):
+    # Оторванный двор и узлы, отрезанные от решётки, не попадают в граф
+    lats = [graph.lat[v] / MICRODEGREES for v in range(graph.node_count)]
+    assert max(lats) < LAT0 + ROWS * STEP
+    assert graph.node_count <= ROWS * COLS
+
+
+def test_nodes_are_numbered_by_grid_cells(graph):
+    offsets = graph.cell_offsets
+    assert offsets[0] == 0 and offsets[graph.grid_rows * graph.grid_cols] == graph.node_count
+    for cell in range(graph.grid_rows * graph.grid_cols):
+        row, col = divmod(cell, graph.grid_cols)
+        for v in range(offsets[cell], offsets[cell + 1]):
+            lat, lng = graph.lat[v] / MICRODEGREES, graph.lng[v] / MICRODEGREES
+            assert int((lat - graph.grid_lat0) // graph.cell_size) == row
+            assert int((lng - graph.grid_lng0) // graph.cell_size) == col
+
+
+def test_snapping_finds_nearest_node(graph):
+    rng = random.Random(3)
+    for _ in range(50):
+        lat = LAT0 + rng.uniform(-0.01, ROWS * STEP + 0.01)
+        lng = LNG0 + rng.uniform(-0.01, COLS * STEP * 1.5 + 0.01)
+        scale_x = math.cos(math.radians(lat))
+        nearest = min(range(graph.node_count), key=lambda v: math.hypot(
+            (graph.lng[v] / MICRODEGREES - lng) * scale_x, graph.lat[v] / MICRODEGREES - lat))
+        node, meters = graph.nearest_node(lat, lng)
+        assert node == nearest
+        assert meters < 2000
+    assert graph.nearest_node(LAT0 + 1, LNG0 + 1) is None
+
+
+def test_astar_matches_dijkstra(graph):
+    rng = random.Random(5)
+    offsets, targets, weights = graph.forward
+    for _ in range(200):
+        source, target = rng.randrange(graph.node_count), rng.randrange(graph.node_count)
+        expected = dijkstra(graph, source, target)
+        found = graph.shortest_path(source, target)
+        if expected is None:
+            assert found is None
+            continue
+        length, path = found
+        assert length == pytest.approx(expected, rel=1e-6)
+        assert (path[0], path[-1]) == (source, target)
+        walked = sum(min(weights[e] for e in range(offsets[u], offsets[u + 1]) if targets[e] == v)
+                     for u, v in zip(path, path[1:]))
+        assert walked == pytest.approx(length, rel=1e-6)
+
+
+def test_route_adds_approaches(graph):
+    # Узлы решётки, между которыми есть путь по направленному графу
+    rng = random.Random(11)
+    while True:
+        source, target = rng.randrange(graph.node_count), rng.randrange(graph.node_count)
+        if source != target and dijkstra(graph, source, target):
+            break
+    from_lat, from_lng = graph.lat[source] / MICRODEGREES + 0.0003, graph.lng[source] / MICRODEGREES
+    to_lat, to_lng = graph.lat[target] / MICRODEGREES, graph.lng[target] / MICRODEGREES - 0.0003
+    route = graph.route(from_lat, from_lng, to_lat, to_lng)
+    assert (route['lats'][0], route['lngs'][0]) == (from_lat, from_lng)
+    assert (route['lats'][-1], route['lngs'][-1]) == (to_lat, to_lng)
+    approaches = graph.nearest_node(from_lat, from_lng)[1] + graph.nearest_node(to_lat, to_lng)[1]
+    assert route['meters'] == pytest.approx(dijkstra(graph, source, target) + approaches, rel=1e-6)
@@ -0,0 +1,97 @@
+"""Кэш маршрутов: сроки жизни, вытеснение, ключ по округлённым координатам, блокировки"""
+import threading
+
+import pytest
+
+import route_cache
+from route_cache import RouteCache, FAILED
+
+LEG = (53.30, 83.70, 53.32, 83.72)
+ROUTE = {'lats': [53.30, 53.32], 'lngs': [83.70, 83.72], 'distance': 2.6, 'duration': 3, 'fallback': False}
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = Clock()
+    monkeypatch.setattr(route_cache, 'time', fake)
+    return fake
+
+
+def leg(k):
+    return (53.30 + k * 0.001, 83.70, 53.32, 83.72)
+
+
+def test_route_expires_after_ttl(clock, tmp_path):
+    cache = RouteCache(str(tmp_path / 'routes.sqlite3'), ttl=60, negative_ttl=10)
+    cache.put(LEG, ROUTE)
+    clock.now += 59
+    assert cache.get(LEG) == ROUTE
+    clock.now += 2
+    assert cache.get(LEG) is None
+    # Просроченная запись не поднимается и с диска
+    assert RouteCache(str(tmp_path / 'routes.sqlite3'), ttl=60).get(LEG) is None
+
+
+def test_failure_lives_negative_ttl(clock):
+    cache = RouteCache(None, ttl=60, negative_ttl=10)
+    cache.put_failure(LEG)
+    assert cache.get(LEG) == FAILED
+    assert cache.stats()['negative_hits'] == 1
+    clock.now += 11
+    assert cache.get(LEG) is None
+
+
+def test_memory_eviction_falls_back_to_disk(tmp_path):
+    cache = RouteCache(str(tmp_path / 'routes.sqlite3'), memory_entries=2)
+    for k in range(3):
+        cache.put(leg(k), {**ROUTE, 'distance': k})
+    stats = cache.stats()
+    assert stats['memory_size'] == 2
+    assert stats['evictions'] == 1
+    assert cache.get(leg(0))['distance'] == 0
+    assert cache.stats()['disk_hits'] == 1
+
+    memory_only = RouteCache(None, memory_entries=2)
+    for k in range(3):
+        memory_only.put(leg(k), ROUTE)
+    assert memory_only.get(leg(0)) is None
+    assert memory_only.get(leg(2)) == ROUTE
+
+
+def test_disk_eviction_keeps_newest(clock, tmp_path):
+    cache = RouteCache(str(tmp_path / 'routes.sqlite3'), memory_entries=1, disk_entries=50)
+    # Чистка диска — каждые 200 записей
+    for k in range(200):
+        clock.now += 1
+        cache.put(leg(k), {**ROUTE, 'distance': k})
+    assert cache.stats()['evictions'] == 199 + 150
+    assert cache.get(leg(149)) is None
+    assert cache.get(leg(150))['distance'] == 150
+
+
+def test_key_is_rounded_to_precision():
+    cache = RouteCache(None, precision=3)
+    assert cache.key((53.30049, 83.7, 53.32, 83.72)) == '53.300,83.700,53.320,83.720'
+    cache.put((53.30049, 83.70012, 53.32, 83.72), ROUTE)
+    assert cache.get((53.3001, 83.6996, 53.3204, 83.7199)) == ROUTE
+    assert cache.get((53.3006, 83.70, 53.32, 83.72)) is None
+
+
+def test_memory_hit_does_not_wait_for_sqlite(tmp_path):
+    cache = RouteCache(str(tmp_path / 'routes.sqlite3'))
+    cache.put(LEG, ROUTE)
+    found = []
+    # Другой поток занят файлом: попадание в память его не ждёт
+    with cache._db_lock:
+        reader = threading.Thread(target=lambda: found.append(cache.get(LEG)))
+        reader.start()
+        reader.join(timeout=2)
+        assert found == [ROUTE]
@@ -0,0 +1,90 @@
+"""Клиент OSRM: ответы 4xx с кодом OSRM не размыкают выключатель, без серверов — запасной маршрут"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import index
+from route_cache import RouteCache
+from upstream import BreakerOpen, ConnectionPool, Endpoint, UpstreamClient, UpstreamError, CLOSED, OPEN
+
+NO_ROUTE_LEG = (53.30, 83.70, 53.40, 83.80)
+
+
+class Handler(BaseHTTPRequestHandler):
+    '''/noroute — 400 {"code": "NoRoute"}, /html — 400 без JSON, /down — 503'''
+
+    def do_GET(self):
+        if self.path.startswith('/noroute'):
+            status, body = 400, json.dumps({'code': 'NoRoute', 'message': 'Impossible route between points'})
+        elif self.path.startswith('/html'):
+            status, body = 400, '<html>Bad Request</html>'
+        else:
+            status, body = 503, ''
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+
+
+def endpoint(url):
+    return Endpoint(url, ConnectionPool(), min_timeout=0.5, max_timeout=2, failure_threshold=3, cooldown=30)
+
+
+def test_no_route_answer_keeps_breaker_closed(server_url):
+    upstream = endpoint(server_url + '/noroute')
+    for _ in range(5):
+        assert upstream.fetch('/leg')['code'] == 'NoRoute'
+    assert upstream.breaker.state == CLOSED
+    assert upstream.counters['failures'] == 0
+
+
+@pytest.mark.parametrize('path', ['/html', '/down'])
+def test_server_errors_open_breaker(server_url, path):
+    upstream = endpoint(server_url + path)
+    for _ in range(3):
+        with pytest.raises(UpstreamError):
+            upstream.fetch('/leg')
+    assert upstream.breaker.state == OPEN
+    with pytest.raises(BreakerOpen):
+        upstream.fetch('/leg')
+
+
+def test_no_route_leg_is_remembered_as_failure(server_url, monkeypatch):
+    upstream = UpstreamClient([endpoint(server_url + '/noroute')])
+    cache = RouteCache(None, precision=5, ttl=3600, negative_ttl=600)
+    monkeypatch.setattr(index, 'UPSTREAM', upstream)
+    monkeypatch.setattr(index, 'ROUTE_CACHE', cache)
+
+    route = index.build_route(NO_ROUTE_LEG)
+    assert route['fallback'] is True
+    assert cache.get(NO_ROUTE_LEG) == {'failed': True}
+    index.build_route(NO_ROUTE_LEG)
+    assert upstream.endpoints[0].counters['requests'] == 1
+
+
+def test_client_without_endpoints_falls_back(monkeypatch):
+    upstream = UpstreamClient([])
+    cache = RouteCache(None, precision=5, ttl=3600, negative_ttl=600)
+    monkeypatch.setattr(index, 'UPSTREAM', upstream)
+    monkeypatch.setattr(index, 'ROUTE_CACHE', cache)
+
+    with pytest.raises(BreakerOpen):
+        upstream.fetch('/leg')
+    assert upstream.stats()['connections'] == {}
+    assert index.build_route(NO_ROUTE_LEG)['fallback'] is True
+    # Сервер не спрашивали — отказ не запоминается
+    assert cache.get(NO_ROUTE_LEG) is None
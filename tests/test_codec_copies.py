@@ -0,0 +1,12 @@
+"""Копии codec.py в папках функций совпадают байт в байт (см. docstring codec.py)"""
+import os
+
+BACKEND = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+
+def test_codec_copies_are_identical():
+    copies = {}
+    for function in ('optimize-routes', 'osrm-route'):
+        with open(os.path.join(BACKEND, function, 'codec.py'), 'rb') as f:
+            copies[function] = f.read()
+    assert copies['optimize-routes'] == copies['osrm-route']